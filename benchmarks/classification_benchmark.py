@@ -0,0 +1,211 @@
+"""
+A micro-benchmark of the path classification layer (guess_path, the UFC and Masterclass extractors, and the routing in
+_classify_file). Accuracy is checked against a hand-checked corpus of real release names and their expected cloud paths,
+while throughput and latency are measured over thousands of synthetic names (see the library module) as well.
+
+Usage:
+    python -m benchmarks.classification_benchmark [--throughput-names 3000] [--output results.json]
+                                                  [--compare baseline.json]
+    python -m benchmarks.classification_benchmark --update
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import logbook
+
+from benchmarks import results as benchmark_results
+from benchmarks.library import generate_names
+from benchmarks.results import get_peak_rss, percentile
+from clouduploader import config
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'classification_corpus.tsv')
+CORPUS_FIELDS = ['file_name', 'cloud_dir', 'cloud_file', 'is_subtitles']
+# Corpus names are classified as if they were downloaded here.
+DOWNLOAD_DIR = '/download'
+
+SCENARIO_COLD = 'cold'
+SCENARIO_WARM = 'warm'
+
+# Compared results, and whether higher values are better.
+COMPARED_RESULTS = {
+    'names_per_sec': True,
+    'p50_us': False,
+    'p99_us': False,
+    'accuracy': True,
+}
+# The amount of synthetic names timed along with the corpus, since timing a small corpus alone is mostly noise.
+DEFAULT_THROUGHPUT_NAMES = 3000
+DEFAULT_THRESHOLD = 10
+MAX_SHOWN_MISMATCHES = 20
+
+
+def load_corpus(path=CORPUS_PATH):
+    """
+    :param path: The corpus file path.
+    :return: A list of tuples of format (file_name, (cloud_dir, cloud_file, is_subtitles)). Cloud dir and file are None
+             for names which should be skipped.
+    """
+    with open(path, 'r', encoding='UTF-8', newline='') as corpus_file:
+        reader = csv.DictReader(corpus_file, delimiter='\t', quoting=csv.QUOTE_NONE)
+        return [(row['file_name'], (row['cloud_dir'] or None, row['cloud_file'] or None, row['is_subtitles'] == '1'))
+                for row in reader]
+
+
+def save_corpus(entries, path=CORPUS_PATH):
+    """
+    :param entries: A list of tuples, as returned by load_corpus.
+    :param path: The corpus file path.
+    """
+    with open(path, 'w', encoding='UTF-8', newline='') as corpus_file:
+        writer = csv.writer(corpus_file, delimiter='\t', quoting=csv.QUOTE_NONE, lineterminator='\n')
+        writer.writerow(CORPUS_FIELDS)
+        for file_name, (cloud_dir, cloud_file, is_subtitles) in entries:
+            writer.writerow([file_name, cloud_dir or '', cloud_file or '', '1' if is_subtitles else '0'])
+
+
+def _reset_guess_cache():
+    """
+    Start over with an empty, memory only guess cache.
+    """
+    from clouduploader import cache
+
+    config.GUESS_CACHE_PATH = None
+    cache._guess_cache = None
+
+
+def _run_scenario(classify, corpus, names):
+    """
+    Classify every corpus name and throughput name once, timing each one and checking the corpus' results.
+
+    :param classify: The classification function (e.g. _classify_file).
+    :param corpus: The corpus entries, as returned by load_corpus.
+    :param names: The throughput names (which have no expected results).
+    :return: A tuple of format (scenario results dictionary, list of mismatches, list of all results in order).
+    """
+    latencies = []
+    classified = []
+    start_time = time.perf_counter()
+    for file_name in [file_name for file_name, _ in corpus] + names:
+        name_start_time = time.perf_counter()
+        classified.append(tuple(classify(os.path.join(DOWNLOAD_DIR, file_name))))
+        latencies.append(time.perf_counter() - name_start_time)
+    elapsed = time.perf_counter() - start_time
+    mismatches = [(file_name, expected, result)
+                  for (file_name, expected), result in zip(corpus, classified) if result != expected]
+    latencies.sort()
+    return {
+        'names': len(latencies),
+        'seconds': round(elapsed, 3),
+        'names_per_sec': round(len(latencies) / elapsed, 3) if elapsed else 0,
+        'p50_us': round(percentile(latencies, 50) * 1000000, 3),
+        'p99_us': round(percentile(latencies, 99) * 1000000, 3),
+        'accuracy': round(1 - len(mismatches) / len(corpus), 6) if corpus else 1,
+        'mismatches': len(mismatches),
+        'inconsistent': 0
+    }, mismatches, classified
+
+
+def run(corpus, repeat, names):
+    """
+    Run the benchmark: a cold pass with an empty guess cache, and warm passes which hit it.
+
+    :param corpus: The corpus entries, as returned by load_corpus.
+    :param repeat: The amount of warm passes.
+    :param names: The throughput names, timed along with the corpus.
+    :return: A tuple of format (results dictionary, list of mismatches of the cold pass).
+    """
+    from clouduploader.uploader import _classify_file
+
+    _reset_guess_cache()
+    results = {'scenarios': {}}
+    results['scenarios'][SCENARIO_COLD], mismatches, cold_classified = _run_scenario(_classify_file, corpus, names)
+    inconsistent = 0
+    for _ in range(repeat):
+        scenario_results, _, classified = _run_scenario(_classify_file, corpus, names)
+        # Caching must never change a result, including the throughput names' ones.
+        inconsistent = max(inconsistent, sum(1 for cold, warm in zip(cold_classified, classified) if cold != warm))
+        # Keep the fastest warm pass, which is the least noisy one.
+        best_results = results['scenarios'].get(SCENARIO_WARM)
+        if not best_results or scenario_results['names_per_sec'] > best_results['names_per_sec']:
+            results['scenarios'][SCENARIO_WARM] = scenario_results
+    if repeat:
+        results['scenarios'][SCENARIO_WARM]['inconsistent'] = inconsistent
+    results['peak_rss_mb'], results['children_peak_rss_mb'] = get_peak_rss()
+    return results, mismatches
+
+
+def update(corpus, path=CORPUS_PATH):
+    """
+    Replace the corpus' expected results with the current classification results.
+
+    :param corpus: The corpus entries, as returned by load_corpus.
+    :param path: The corpus file path.
+    :return: The amount of changed entries.
+    """
+    from clouduploader.uploader import _classify_file
+
+    _reset_guess_cache()
+    updated_corpus = [(file_name, tuple(_classify_file(os.path.join(DOWNLOAD_DIR, file_name))))
+                      for file_name, _ in corpus]
+    save_corpus(updated_corpus, path)
+    return sum(1 for old, new in zip(corpus, updated_corpus) if old != new)
+
+
+def main():
+    """
+    Run the benchmark, optionally saving its results and comparing them against a baseline run.
+    Exits with a nonzero code if a name was misclassified, or if a regression was found.
+    """
+    parser = argparse.ArgumentParser(description='Path classification micro-benchmark.')
+    parser.add_argument('--corpus', default=CORPUS_PATH, help='The corpus file.')
+    parser.add_argument('--repeat', type=int, default=3, help='The amount of warm (cached) passes.')
+    parser.add_argument('--throughput-names', type=int, default=DEFAULT_THROUGHPUT_NAMES,
+                        help='The amount of synthetic names timed along with the corpus.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed of the synthetic names.')
+    parser.add_argument('--min-accuracy', type=float, default=1.0, help='Fail below this accuracy (0-1).')
+    parser.add_argument('--update', action='store_true',
+                        help='Replace the expected results with the current ones (after reviewing the mismatches!).')
+    parser.add_argument('--output', help='Save the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare the results against a saved JSON file.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed slowdown against the baseline, in percent.')
+    args = parser.parse_args()
+    corpus = load_corpus(args.corpus)
+
+    with logbook.NullHandler().applicationbound():
+        if args.update:
+            print(f'Updated {update(corpus, args.corpus)} of {len(corpus)} corpus entries.')
+            return
+        results, mismatches = run(corpus, args.repeat, generate_names(args.throughput_names, args.seed))
+
+    for file_name, expected, result in mismatches[:MAX_SHOWN_MISMATCHES]:
+        print(f'Mismatch: {file_name}\n    expected: {expected}\n    got:      {result}')
+    print(json.dumps(results, indent=4))
+    if args.output:
+        benchmark_results.save(results, args.output)
+
+    is_failed = False
+    # Warm passes are checked as well, since caching must never change a result.
+    for scenario, scenario_results in results['scenarios'].items():
+        if scenario_results['accuracy'] < args.min_accuracy:
+            print(f'Accuracy of the {scenario} pass is below {args.min_accuracy}!')
+            is_failed = True
+        if scenario_results['inconsistent']:
+            print(f'{scenario_results["inconsistent"]} names were classified differently by the {scenario} pass!')
+            is_failed = True
+    if args.compare:
+        baseline = benchmark_results.load(args.compare)
+        regressions = benchmark_results.compare(results, baseline, COMPARED_RESULTS, args.threshold)
+        if regressions:
+            print(f'Found {len(regressions)} regressions (over {args.threshold}%)!')
+            is_failed = True
+    if is_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
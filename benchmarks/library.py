@@ -0,0 +1,168 @@
+"""
+Synthetic media libraries, made of sparse files with realistic names and sizes.
+"""
+import os
+import random
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+KIND_TV = 'tv'
+KIND_MOVIE = 'movie'
+KIND_UFC = 'ufc'
+KIND_MASTERCLASS = 'masterclass'
+KIND_SUBTITLES = 'subtitles'
+KIND_VIDEO = 'video'
+
+# The share of each kind in a generated library, and its (minimum, maximum) file size.
+LIBRARY_KINDS = {
+    KIND_TV: (0.45, (150 * MB, 2 * GB)),
+    KIND_MOVIE: (0.15, (700 * MB, 12 * GB)),
+    KIND_UFC: (0.05, (1 * GB, 6 * GB)),
+    KIND_MASTERCLASS: (0.05, (100 * MB, 700 * MB)),
+    KIND_SUBTITLES: (0.30, (20 * 1024, 150 * 1024)),
+}
+VIDEO_SIZE_RANGE = (5 * MB, 4 * GB)
+
+SHOWS = ['The Wire', 'Breaking Bad', 'The Office US', 'Mr Robot', 'Better Call Saul', 'Fargo', 'Dark', 'Succession',
+         'The Expanse', 'Severance', 'Stranger Things', 'The Bear', 'Peaky Blinders', 'Ted Lasso', 'Mad Men',
+         'Six Feet Under', 'True Detective', 'Black Mirror', 'The Sopranos', 'Halt and Catch Fire']
+MOVIES = ['Heat', 'Alien', 'Arrival', 'Parasite', 'Inception', 'Drive', 'Zodiac', 'Sicario', 'Whiplash', 'Prisoners',
+          'Memento', 'Oldboy', 'Amelie', 'Up', 'Coco', 'Her', 'Gravity', 'Interstellar', 'The Prestige', 'Nightcrawler']
+MASTERCLASS_TOPICS = ['Gordon Ramsay Teaches Cooking', 'Aaron Sorkin Teaches Screenwriting',
+                      'Neil Gaiman Teaches The Art of Storytelling', 'Garry Kasparov Teaches Chess']
+UFC_EVENTS = ['UFC', 'UFC.Fight.Night', 'UFC.on.ESPN', 'UFC.on.FOX']
+QUALITIES = ['720p.HDTV.x264', '1080p.WEB.h264', '1080p.AMZN.WEB-DL.DDP5.1.H.264', '2160p.NF.WEB-DL.x265',
+             '720p.BluRay.x264', '1080p.BluRay.x264']
+GROUPS = ['KILLERS', 'NTb', 'CAKES', 'GGEZ', 'SPARKS', 'FLUX', 'EDITH', 'ION10', 'DIMENSION']
+VIDEO_EXTENSIONS = ['.mkv', '.mkv', '.mkv', '.mp4', '.avi']
+
+
+def _dotted(title):
+    """
+    :param title: A title.
+    :return: The title, in release name format.
+    """
+    return title.replace(' ', '.')
+
+
+def _release_suffix(rng):
+    """
+    :param rng: A random generator.
+    :return: A random quality and release group suffix.
+    """
+    return f'{rng.choice(QUALITIES)}-{rng.choice(GROUPS)}'
+
+
+def _make_name(kind, rng, index):
+    """
+    Make a random (unique) release name of the given kind.
+
+    :param kind: The file kind.
+    :param rng: A random generator.
+    :param index: The file index, used for keeping names unique.
+    :return: The file name.
+    """
+    if kind in (KIND_TV, KIND_SUBTITLES):
+        name = f'{_dotted(rng.choice(SHOWS))}.S{index // 100 % 20 + 1:02d}E{index % 100 + 1:02d}'
+        if rng.random() < 0.05:
+            name += '.Hebrew.Dubbed'
+        name += f'.{_release_suffix(rng)}'
+        if kind == KIND_SUBTITLES:
+            return name + rng.choice(['.en.srt', '.he.srt', '.srt'])
+        return name + rng.choice(VIDEO_EXTENSIONS)
+    if kind == KIND_MOVIE:
+        return f'{_dotted(rng.choice(MOVIES))}.{1960 + index % 64}.{_release_suffix(rng)}.{index}' + \
+            rng.choice(VIDEO_EXTENSIONS)
+    if kind == KIND_UFC:
+        prelims = '.Prelims' if rng.random() < 0.3 else ''
+        return f'{rng.choice(UFC_EVENTS)}.S{index // 100 % 20 + 1:02d}E{index % 100 + 1:02d}{prelims}.' \
+               f'{_release_suffix(rng)}.mkv'
+    if kind == KIND_MASTERCLASS:
+        return f'MasterClass.{_dotted(rng.choice(MASTERCLASS_TOPICS))}.{index % 30 + 1:02d}.Lesson.{index}.mp4'
+    return f'VID_{20200101 + index % 1231}_{index:06d}' + rng.choice(['.mp4', '.mov', '.mkv'])
+
+
+def generate_names(count, seed=0):
+    """
+    Generate unique release names of a synthetic media library, without creating any file.
+
+    :param count: The amount of names.
+    :param seed: The random seed.
+    :return: A list of file names.
+    """
+    rng = random.Random(seed)
+    kind_names = list(LIBRARY_KINDS)
+    weights = [LIBRARY_KINDS[kind][0] for kind in kind_names]
+    names = {}
+    index = 0
+    while len(names) < count:
+        names[_make_name(rng.choices(kind_names, weights)[0], rng, index)] = None
+        index += 1
+    return list(names)
+
+
+def _create_sparse_file(file_path, size):
+    """
+    Create a sparse file of the given size, with a unique first block (so files never look alike).
+
+    :param file_path: The file path.
+    :param size: The file size.
+    """
+    with open(file_path, 'wb') as f:
+        f.write(os.path.basename(file_path).encode('UTF-8')[:size])
+        f.truncate(size)
+
+
+def _create_files(root_dir, kinds, count, seed, size_scale):
+    """
+    Create the given amount of sparse files, of randomly chosen kinds, in per-release directories.
+
+    :param root_dir: The directory to create the files in.
+    :param kinds: A dictionary of format {kind: (share, (minimum size, maximum size))}.
+    :param count: The amount of files.
+    :param seed: The random seed.
+    :param size_scale: A factor applied to all file sizes.
+    :return: A list of tuples of format (kind, file_path, size).
+    """
+    rng = random.Random(seed)
+    kind_names = list(kinds)
+    weights = [kinds[kind][0] for kind in kind_names]
+    files = []
+    for index in range(count):
+        kind = rng.choices(kind_names, weights)[0]
+        minimum_size, maximum_size = kinds[kind][1]
+        size = max(1, int(rng.randint(minimum_size, maximum_size) * size_scale))
+        file_name = _make_name(kind, rng, index)
+        release_dir = os.path.join(root_dir, f'{index // 50:04d}')
+        os.makedirs(release_dir, exist_ok=True)
+        file_path = os.path.join(release_dir, file_name)
+        _create_sparse_file(file_path, size)
+        files.append((kind, file_path, size))
+    return files
+
+
+def generate_library(root_dir, count, seed=0, size_scale=1.0):
+    """
+    Generate a synthetic media library (TV, movies, UFC, Masterclass and subtitles).
+
+    :param root_dir: The directory to create the library in.
+    :param count: The amount of files.
+    :param seed: The random seed.
+    :param size_scale: A factor applied to all file sizes.
+    :return: A list of tuples of format (kind, file_path, size).
+    """
+    return _create_files(root_dir, LIBRARY_KINDS, count, seed, size_scale)
+
+
+def generate_videos(root_dir, count, seed=0, size_scale=1.0):
+    """
+    Generate synthetic personal videos.
+
+    :param root_dir: The directory to create the videos in.
+    :param count: The amount of files.
+    :param seed: The random seed.
+    :param size_scale: A factor applied to all file sizes.
+    :return: A list of tuples of format (kind, file_path, size).
+    """
+    return _create_files(root_dir, {KIND_VIDEO: (1, VIDEO_SIZE_RANGE)}, count, seed, size_scale)
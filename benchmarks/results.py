@@ -0,0 +1,73 @@
+"""
+Helpers for computing, saving and comparing benchmark results.
+"""
+import json
+import resource
+
+
+def percentile(values, percent):
+    """
+    :param values: A sorted list of values.
+    :param percent: The percentile (0-100).
+    :return: The nearest-rank percentile of the values.
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, int(round(percent / 100 * len(values))) - 1))]
+
+
+def get_peak_rss():
+    """
+    :return: A tuple of format (self, children) of the peak RSS, in MB.
+    """
+    # ru_maxrss is in KB on Linux.
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1))
+
+
+def save(results, path):
+    """
+    :param results: The results dictionary.
+    :param path: The JSON file to save the results to.
+    """
+    with open(path, 'w', encoding='UTF-8') as output_file:
+        json.dump(results, output_file, indent=4)
+
+
+def load(path):
+    """
+    :param path: A JSON file of saved results.
+    :return: The results dictionary.
+    """
+    with open(path, 'r', encoding='UTF-8') as results_file:
+        return json.load(results_file)
+
+
+def compare(results, baseline, compared_results, threshold):
+    """
+    Compare the given results against a baseline run, printing the differences.
+    Both are expected to hold a 'scenarios' dictionary of per-scenario results, and a 'peak_rss_mb' value.
+
+    :param results: The results dictionary.
+    :param baseline: The baseline results dictionary.
+    :param compared_results: A dictionary of format {result name: whether higher values are better}.
+    :param threshold: The allowed slowdown, in percent.
+    :return: A list of regression descriptions (empty if there are none).
+    """
+    regressions = []
+    rows = []
+    for scenario, scenario_results in results['scenarios'].items():
+        baseline_results = baseline.get('scenarios', {}).get(scenario)
+        if not baseline_results:
+            continue
+        for name, higher_is_better in compared_results.items():
+            rows.append((f'{scenario}.{name}', baseline_results[name], scenario_results[name], higher_is_better))
+    rows.append(('peak_rss_mb', baseline['peak_rss_mb'], results['peak_rss_mb'], False))
+
+    for name, old_value, new_value, higher_is_better in rows:
+        change = (new_value - old_value) / old_value * 100 if old_value else 0
+        is_regression = (-change if higher_is_better else change) > threshold
+        print(f'{name:<28} {old_value:>12} -> {new_value:<12} ({change:+.1f}%){"  REGRESSION" if is_regression else ""}')
+        if is_regression:
+            regressions.append(f'{name}: {old_value} -> {new_value} ({change:+.1f}%)')
+    return regressions
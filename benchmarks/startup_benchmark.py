@@ -0,0 +1,135 @@
+"""
+A startup benchmark of the command line entry points, based on "python -X importtime". Each entry point has an
+import-time budget, relative to the import time of logbook measured in the same run (so budgets hold on slower and
+faster machines alike), and a list of heavy modules it must not import at startup.
+
+Usage:
+    python -m benchmarks.startup_benchmark [--runs 5] [--budget-scale 1.0] [--output results.json]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import results as benchmark_results
+
+HEAVY_MODULES = ['guessit', 'showsformatter', 'subliminal', 'plexapi', 'babelfish', 'requests', 'tqdm']
+
+# Every entry point imports logbook (except for the daemon's client), so its import time is the baseline.
+BASELINE_MODULE = 'logbook'
+# Entry point modules, with their import-time budget (relative to the baseline's) and the modules they must not import.
+ENTRY_POINTS = {
+    'clouduploader.daemon': (0.5, HEAVY_MODULES + ['logbook']),
+    'clouduploader.uploader': (2.5, HEAVY_MODULES),
+    'clouduploader.scripts.video_upload': (2.5, HEAVY_MODULES),
+    'clouduploader.scripts.subtitles_monitor': (2.5, HEAVY_MODULES),
+    'clouduploader.scripts.episodes_rename': (1.75, HEAVY_MODULES),
+    'clouduploader.scripts.suffix_add': (1.75, HEAVY_MODULES),
+    'clouduploader.scripts.movie_rename': (1.75, HEAVY_MODULES),
+    'clouduploader.scripts.sonarr_faker': (1.75, HEAVY_MODULES),
+}
+
+
+def _parse_importtime(output):
+    """
+    Parse the output of "python -X importtime".
+
+    :param output: The stderr output.
+    :return: A dictionary of format {module name: cumulative import time in microseconds}.
+    """
+    import_times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module_name = line[len('import time:'):].split('|')
+        import_times[module_name.strip()] = int(cumulative)
+    return import_times
+
+
+def measure(module_name):
+    """
+    Import the given module in a new interpreter.
+
+    :param module_name: The module to import.
+    :return: A tuple of format (import time in milliseconds, process wall time in milliseconds, imported modules).
+    :raise RuntimeError: If the import failed.
+    """
+    start_time = time.perf_counter()
+    process_result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=False)
+    wall_time = (time.perf_counter() - start_time) * 1000
+    import_times = _parse_importtime(process_result.stderr)
+    if process_result.returncode != 0 or module_name not in import_times:
+        raise RuntimeError(f'Failed to import {module_name}:\n{process_result.stderr[-2000:]}')
+    return import_times[module_name] / 1000, wall_time, set(import_times)
+
+
+def get_heavy_imports(module_name):
+    """
+    :param module_name: An entry point module (see ENTRY_POINTS).
+    :return: A sorted list of the forbidden modules the entry point imports at startup.
+    """
+    _, _, imported_modules = measure(module_name)
+    return sorted(m for m in ENTRY_POINTS[module_name][1] if m in imported_modules)
+
+
+def run(runs, budget_scale):
+    """
+    Measure the baseline and every entry point, and check each entry point against its budget.
+
+    :param runs: The amount of runs per module (the median is used).
+    :param budget_scale: A factor applied to all budgets.
+    :return: A tuple of format (results dictionary, list of failure descriptions).
+    """
+    baseline = statistics.median(measure(BASELINE_MODULE)[0] for _ in range(runs))
+    results = {'baseline_ms': round(baseline, 3), 'scenarios': {}}
+    failures = []
+    for module_name, (budget_ratio, forbidden_modules) in ENTRY_POINTS.items():
+        budget = budget_ratio * baseline
+        import_times = []
+        wall_times = []
+        imported_modules = set()
+        for _ in range(runs):
+            import_time, wall_time, imported_modules = measure(module_name)
+            import_times.append(import_time)
+            wall_times.append(wall_time)
+        import_time = statistics.median(import_times)
+        heavy_imports = sorted(m for m in forbidden_modules if m in imported_modules)
+        results['scenarios'][module_name] = {
+            'import_ms': round(import_time, 3),
+            'wall_ms': round(statistics.median(wall_times), 3),
+            'budget_ms': round(budget * budget_scale, 3),
+            'heavy_imports': heavy_imports
+        }
+        if import_time > budget * budget_scale:
+            failures.append(f'{module_name}: {import_time:.1f}ms is over its {budget * budget_scale:.1f}ms budget')
+        if heavy_imports:
+            failures.append(f'{module_name}: imports {", ".join(heavy_imports)} at startup')
+    results['peak_rss_mb'], results['children_peak_rss_mb'] = benchmark_results.get_peak_rss()
+    return results, failures
+
+
+def main():
+    """
+    Run the benchmark, exiting with a nonzero code if an entry point is over its budget, or imports a heavy module.
+    """
+    parser = argparse.ArgumentParser(description='Startup (import time) benchmark of the entry points.')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per module (the median is used).')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='A factor applied to all budgets.')
+    parser.add_argument('--output', help='Save the results to this JSON file.')
+    args = parser.parse_args()
+
+    results, failures = run(args.runs, args.budget_scale)
+    print(json.dumps(results, indent=4))
+    if args.output:
+        benchmark_results.save(results, args.output)
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+An end-to-end benchmark of upload_file and upload_video, using stub rclone, encfs and umount binaries.
+
+Usage:
+    python -m benchmarks.upload_benchmark [--files 2000] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+from collections import Counter
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import logbook
+
+from benchmarks import results as benchmark_results
+from benchmarks.library import generate_library, generate_videos
+from benchmarks.results import get_peak_rss, percentile
+from clouduploader import config
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+
+SCENARIO_UPLOAD_FILE = 'upload_file'
+SCENARIO_UPLOAD_VIDEO = 'upload_video'
+SCENARIOS = [SCENARIO_UPLOAD_FILE, SCENARIO_UPLOAD_VIDEO]
+
+# Compared results, and whether higher values are better.
+COMPARED_RESULTS = {
+    'files_per_sec': True,
+    'mb_per_sec': True,
+    'p50_ms': False,
+    'p99_ms': False,
+}
+DEFAULT_THRESHOLD = 10
+
+
+def _configure(work_dir, args):
+    """
+    Point the configuration (and the stubs' environment) at the work directory and the stub binaries.
+
+    :param work_dir: The benchmark's work directory.
+    :param args: The parsed command line arguments.
+    """
+    config.RCLONE_PATH = os.path.join(STUBS_DIR, 'rclone')
+    config.ENCFS_PATH = os.path.join(STUBS_DIR, 'encfs')
+    config.UMOUNT_PATH = os.path.join(STUBS_DIR, 'umount')
+    config.RCLONE_CONFIG_PATH = os.devnull
+    config.RCLONE_RC_URL = None
+    config.SHOULD_DELETE = not args.copy
+    config.SHOULD_ENCRYPT = not args.no_encrypt
+    config.ENCFS_STAGING_PATH = os.path.join(work_dir, 'staging')
+    config.JOURNAL_PATH = os.path.join(work_dir, 'journal')
+    config.ORIGINAL_NAMES_LOG = os.path.join(work_dir, 'original_names.log')
+    config.CATALOG_PATH = os.path.join(work_dir, 'upload_catalog.db')
+    config.LOGFILE = os.path.join(work_dir, 'cloud_uploader.log')
+    config.GUESS_CACHE_PATH = os.path.join(work_dir, 'guess_cache.db')
+    config.DEDUP_INDEX_PATH = os.path.join(work_dir, 'dedup_index.db') if args.dedup else None
+    config.TRANSFER_HISTORY_PATH = os.path.join(work_dir, 'transfer_history.db')
+    config.METRICS_TEXTFILE_PATH = None
+    config.METRICS_JSON_PATH = None
+    # Retries should cost the same as a transfer, not minutes of sleeping.
+    config.RETRY_BASE_DELAY = config.RETRY_MAX_DELAY = config.RATE_LIMIT_BASE_DELAY = 0.001
+    config.RETRY_BUDGET = 1000000
+
+    os.environ['BENCHMARK_RCLONE_LATENCY'] = str(args.rclone_latency)
+    os.environ['BENCHMARK_RCLONE_BANDWIDTH'] = str(args.rclone_bandwidth)
+    os.environ['BENCHMARK_RCLONE_FAILURE_RATE'] = str(args.failure_rate)
+    os.environ['BENCHMARK_ENCFS_LATENCY'] = str(args.encfs_latency)
+
+
+def _run_scenario(upload, files):
+    """
+    Upload the given files one by one, timing each one.
+
+    :param upload: The upload function (e.g. upload_file).
+    :param files: A list of tuples of format (kind, file_path, size).
+    :return: The scenario results dictionary.
+    """
+    latencies = []
+    statuses = Counter()
+    total_size = 0
+    start_time = time.perf_counter()
+    for _, file_path, size in files:
+        file_start_time = time.perf_counter()
+        job = upload(file_path)
+        latencies.append(time.perf_counter() - file_start_time)
+        statuses[job.status] += 1
+        total_size += size
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+    return {
+        'files': len(files),
+        'seconds': round(elapsed, 3),
+        'files_per_sec': round(len(files) / elapsed, 3) if elapsed else 0,
+        'mb_per_sec': round(total_size / (1024 * 1024) / elapsed, 3) if elapsed else 0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'statuses': dict(statuses)
+    }
+
+
+def run(args):
+    """
+    Run the benchmark.
+
+    :param args: The parsed command line arguments.
+    :return: The results dictionary.
+    """
+    work_dir = tempfile.mkdtemp(prefix='clouduploader-benchmark-', dir=args.work_dir)
+    try:
+        _configure(work_dir, args)
+        # Only import the uploader once the configuration is ready.
+        from clouduploader.encfs import get_shared_mount
+        from clouduploader.journal import get_journal
+        from clouduploader.scripts.video_upload import upload_video
+        from clouduploader.uploader import upload_file
+
+        results = {'settings': vars(args), 'scenarios': {}}
+        if SCENARIO_UPLOAD_FILE in args.scenarios:
+            files = generate_library(os.path.join(work_dir, 'library'), args.files, args.seed, args.size_scale)
+            results['scenarios'][SCENARIO_UPLOAD_FILE] = _run_scenario(upload_file, files)
+        if SCENARIO_UPLOAD_VIDEO in args.scenarios:
+            files = generate_videos(os.path.join(work_dir, 'videos'), args.videos, args.seed, args.size_scale)
+            results['scenarios'][SCENARIO_UPLOAD_VIDEO] = _run_scenario(upload_video, files)
+        get_journal().close()
+        if config.SHOULD_ENCRYPT:
+            get_shared_mount().close()
+
+        results['peak_rss_mb'], results['children_peak_rss_mb'] = get_peak_rss()
+        return results
+    finally:
+        if args.keep:
+            print(f'Work directory kept: {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    """
+    Run the benchmark, optionally saving its results and comparing them against a baseline run.
+    Exits with a nonzero code if a regression was found.
+    """
+    parser = argparse.ArgumentParser(description='End-to-end upload benchmark, using stub rclone and encfs binaries.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help='Scenarios to run.')
+    parser.add_argument('--files', type=int, default=2000, help='Library size, for the upload_file scenario.')
+    parser.add_argument('--videos', type=int, default=200, help='Amount of videos, for the upload_video scenario.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated files.')
+    parser.add_argument('--size-scale', type=float, default=1.0, help='A factor applied to all file sizes.')
+    parser.add_argument('--rclone-latency', type=float, default=0.0, help='Seconds added to every rclone run.')
+    parser.add_argument('--rclone-bandwidth', type=float, default=0.0, help='Simulated MB/sec (0 is unlimited).')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability of a file transfer failing.')
+    parser.add_argument('--encfs-latency', type=float, default=0.0, help='Seconds added to every mount.')
+    parser.add_argument('--no-encrypt', action='store_true', help='Upload plain files (without encfs).')
+    parser.add_argument('--copy', action='store_true', help='Keep the original files (SHOULD_DELETE = False).')
+    parser.add_argument('--dedup', action='store_true', help='Enable the dedup index (reads every file in full).')
+    parser.add_argument('--work-dir', help='Where to create the work directory (defaults to the temp directory).')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory.')
+    parser.add_argument('--verbose', action='store_true', help='Show the uploader logs.')
+    parser.add_argument('--output', help='Save the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare the results against a saved JSON file.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Allowed slowdown against the baseline, in percent.')
+    args = parser.parse_args()
+
+    handler = logbook.StderrHandler(level=logbook.INFO) if args.verbose else logbook.NullHandler()
+    with handler.applicationbound():
+        results = run(args)
+    print(json.dumps(results, indent=4))
+    if args.output:
+        benchmark_results.save(results, args.output)
+
+    if args.compare:
+        baseline = benchmark_results.load(args.compare)
+        regressions = benchmark_results.compare(results, baseline, COMPARED_RESULTS, args.threshold)
+        if regressions:
+            print(f'Found {len(regressions)} regressions (over {args.threshold}%)!')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
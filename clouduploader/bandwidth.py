@@ -0,0 +1,298 @@
+from contextlib import contextmanager
+import datetime
+import os
+import threading
+
+import logbook
+
+from clouduploader import config
+
+# How often deferred transfers check whether their window has ended, in seconds.
+WINDOW_CHECK_INTERVAL = 30
+SECONDS_PER_DAY = 24 * 60 * 60
+
+logger = logbook.Logger('BandwidthScheduler')
+
+_bandwidth_scheduler = None
+_bandwidth_scheduler_lock = threading.Lock()
+
+
+def _parse_time(time_string):
+    """
+    :param time_string: A time of day, of format 'HH:MM'.
+    :return: The time of day, in seconds since midnight.
+    """
+    hours, minutes = time_string.split(':')
+    return int(hours) * 60 * 60 + int(minutes) * 60
+
+
+def _format_rate(limit):
+    """
+    :param limit: A bandwidth limit in bytes/sec, or None if unlimited.
+    :return: The limit, in rclone's bandwidth format.
+    """
+    return f'{max(1, int(limit / 1024))}k' if limit is not None else 'off'
+
+
+class BandwidthScheduler(object):
+    """
+    Applies bandwidth limits by time of day (a timetable of windows) to all transfers of this process.
+    Every transfer gets its share of the current limit, small transfers always go first, and large transfers are
+    deferred during tight windows (e.g. when streaming in the evening), until a looser window starts.
+    """
+
+    def __init__(self, timetable=None, small_file_size=None, defer_below=None):
+        """
+        :param timetable: A list of tuples of format ('HH:MM', bytes/sec or None for unlimited), each starting a window
+                          which lasts until the next one (defaults to the configured one).
+        :param small_file_size: The maximum size of a small file, in bytes (defaults to the configured one).
+        :param defer_below: Large transfers are deferred while the limit is below this, in bytes/sec (defaults to the
+                            configured one).
+        """
+        self.timetable = sorted((_parse_time(start), limit) for start, limit in timetable or config.BANDWIDTH_TIMETABLE)
+        self.small_file_size = small_file_size or config.BANDWIDTH_SMALL_FILE_SIZE
+        self.defer_below = defer_below or config.BANDWIDTH_DEFER_BELOW
+        self._condition = threading.Condition()
+        self._transfers = 0
+        self._small_transfers = 0
+        self._transfer_bytes = 0
+        # The deferred transfers and queued submissions, as a dictionary of format {key: (file count, bytes)}.
+        self._deferred = {}
+
+    @staticmethod
+    def _now():
+        """
+        :return: The current time of day, in seconds since midnight.
+        """
+        now = datetime.datetime.now()
+        return now.hour * 60 * 60 + now.minute * 60 + now.second
+
+    def _get_window_index(self, now):
+        """
+        :param now: A time of day, in seconds since midnight.
+        :return: The timetable index of the window at the given time.
+        """
+        # Before the first window starts, the last one (from the day before) still applies.
+        index = len(self.timetable) - 1
+        for window_index, (start, _) in enumerate(self.timetable):
+            if start <= now:
+                index = window_index
+        return index
+
+    def get_limit(self, now=None):
+        """
+        :param now: A time of day, in seconds since midnight (defaults to now).
+        :return: The total bandwidth limit at the given time in bytes/sec, or None if unlimited.
+        """
+        return self.timetable[self._get_window_index(self._now() if now is None else now)][1]
+
+    def was_limited(self, duration):
+        """
+        :param duration: A duration which ended now, in seconds.
+        :return: True if any window during the given duration had a limit, and False otherwise.
+        """
+        if duration >= SECONDS_PER_DAY:
+            return any(limit is not None for _, limit in self.timetable)
+        now = (self._now() - int(duration)) % SECONDS_PER_DAY
+        index = self._get_window_index(now)
+        remaining = duration
+        for offset in range(len(self.timetable)):
+            if self.timetable[(index + offset) % len(self.timetable)][1] is not None:
+                return True
+            next_start = self.timetable[(index + offset + 1) % len(self.timetable)][0]
+            # A single window lasts the whole day.
+            until_next = (next_start - now) % SECONDS_PER_DAY or SECONDS_PER_DAY
+            if until_next > remaining:
+                return False
+            remaining -= until_next
+            now = next_start
+        return False
+
+    def _is_tight(self, limit):
+        """
+        :param limit: A bandwidth limit in bytes/sec, or None if unlimited.
+        :return: True if large transfers should be deferred under the given limit, and False otherwise.
+        """
+        return limit is not None and limit < self.defer_below
+
+    def _get_next_open_window(self, now):
+        """
+        :param now: A time of day, in seconds since midnight.
+        :return: A tuple of format (seconds until the next window which isn't tight, its limit), or None if every
+                 window is tight.
+        """
+        index = self._get_window_index(now)
+        for offset in range(1, len(self.timetable) + 1):
+            start, limit = self.timetable[(index + offset) % len(self.timetable)]
+            if not self._is_tight(limit):
+                return (start - now) % SECONDS_PER_DAY, limit
+        return None
+
+    def _should_wait(self, is_small):
+        """
+        :param is_small: Whether the transfer holds small files only.
+        :return: True if the transfer should wait, and False if it may start now.
+        """
+        if is_small:
+            return False
+        limit = self.get_limit()
+        if self._is_tight(limit) and self._get_next_open_window(self._now()):
+            return True
+        # Under a limit, large transfers let small transfers use all of it first.
+        return limit is not None and self._small_transfers > 0
+
+    def is_small(self, jobs):
+        """
+        :param jobs: The upload jobs of a single transfer.
+        :return: True if the jobs' files are all small (or subtitles), and False otherwise.
+        """
+        return all(job.is_subtitles or (job.size or 0) <= self.small_file_size for job in jobs)
+
+    def _log_deferral(self, count, size):
+        """
+        Log a new deferral, along with the backlog. Should be called while holding the condition.
+
+        :param count: The amount of deferred files.
+        :param size: The deferred files' total size.
+        """
+        backlog = self.stats()
+        logger.info(f'Deferring the transfer of {count} large files ({size / 1024 ** 3:.2f} GB). Backlog: '
+                    f'{backlog["deferred_bytes"] / 1024 ** 3:.2f} GB, about '
+                    f'{backlog["backlog_seconds"] / 60 / 60:.1f} hours behind')
+
+    def defer(self, jobs):
+        """
+        Wait until a transfer of the given jobs may start: right away for small files, and once there's enough
+        bandwidth for large ones. Used by direct uploads, while the daemon's queue defers submissions before they're
+        taken by a worker (see get_deferral).
+
+        :param jobs: The upload jobs of the transfer.
+        """
+        is_small = self.is_small(jobs)
+        size = sum(job.size or 0 for job in jobs)
+        key = object()
+        with self._condition:
+            if not self._should_wait(is_small):
+                return
+            self._deferred[key] = (len(jobs), size)
+            self._log_deferral(len(jobs), size)
+            while self._should_wait(is_small):
+                self._condition.wait(WINDOW_CHECK_INTERVAL)
+            del self._deferred[key]
+
+    def get_deferral(self, submission_id, file_paths):
+        """
+        Decide whether a queued submission may start now, before a worker takes it (so a deferred submission never
+        holds a worker, nor gets staged). A deferred submission is counted in the backlog until it may start.
+
+        :param submission_id: The submission ID.
+        :param file_paths: The submitted files.
+        :return: The seconds to wait before checking the submission again, or 0 if it may start now.
+        """
+        from clouduploader.uploader import SUBTITLES_EXTENSIONS
+
+        is_small = True
+        size = 0
+        for file_path in file_paths:
+            try:
+                file_size = os.path.getsize(file_path)
+            except OSError:
+                file_size = 0
+            size += file_size
+            if os.path.splitext(file_path)[1].lower() not in SUBTITLES_EXTENSIONS and file_size > self.small_file_size:
+                is_small = False
+        with self._condition:
+            if not self._should_wait(is_small):
+                self._deferred.pop(submission_id, None)
+                return 0
+            if submission_id not in self._deferred:
+                self._deferred[submission_id] = (len(file_paths), size)
+                self._log_deferral(len(file_paths), size)
+            now = self._now()
+            next_open_window = self._get_next_open_window(now) if self._is_tight(self.get_limit(now)) else None
+            # Otherwise, the submission waits for the small transfers to end.
+            return next_open_window[0] if next_open_window else WINDOW_CHECK_INTERVAL
+
+    @contextmanager
+    def transfer(self, jobs):
+        """
+        Hold a share of the bandwidth for a transfer of the given jobs for the duration of the context.
+        Should be entered once the transfer starts (see defer).
+
+        :param jobs: The upload jobs of the transfer.
+        """
+        is_small = self.is_small(jobs)
+        size = sum(job.size or 0 for job in jobs)
+        with self._condition:
+            self._transfers += 1
+            self._transfer_bytes += size
+            if is_small:
+                self._small_transfers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._transfers -= 1
+                self._transfer_bytes -= size
+                if is_small:
+                    self._small_transfers -= 1
+                self._condition.notify_all()
+
+    def get_bwlimit(self):
+        """
+        A transfer's share is fixed once it starts: it isn't raised when other transfers end (nor lowered when more
+        start) until its next retry. This deliberately trades some unused bandwidth for never restarting an rclone
+        process mid-transfer.
+
+        :return: The bandwidth limit of a starting rclone process, as an rclone timetable of its share of every window.
+        """
+        with self._condition:
+            shares = max(1, self._transfers)
+        return ' '.join(f'{start // 3600:02d}:{start % 3600 // 60:02d},'
+                        f'{_format_rate(limit / shares if limit is not None else None)}'
+                        for start, limit in self.timetable)
+
+    def get_rate(self):
+        """
+        :return: The current window's whole limit, in rclone's format (a single rate, for an rc server which applies it
+                 to all of its transfers at once).
+        """
+        return _format_rate(self.get_limit())
+
+    def stats(self):
+        """
+        :return: A dictionary of the current limit, the transfers and how far behind the deferred backlog is.
+        """
+        with self._condition:
+            now = self._now()
+            limit = self.get_limit(now)
+            deferred_jobs = sum(count for count, _ in self._deferred.values())
+            deferred_bytes = sum(size for _, size in self._deferred.values())
+            # The backlog drains once deferred transfers may start, at the limit of that time.
+            drain_limit = limit
+            backlog_seconds = 0
+            if self._is_tight(limit) and deferred_jobs:
+                next_open_window = self._get_next_open_window(now)
+                if next_open_window:
+                    backlog_seconds, drain_limit = next_open_window
+            if drain_limit:
+                backlog_seconds += (deferred_bytes + self._transfer_bytes) / drain_limit
+            return {
+                'limit': limit,
+                'transfers': self._transfers,
+                'transfer_bytes': self._transfer_bytes,
+                'deferred_jobs': deferred_jobs,
+                'deferred_bytes': deferred_bytes,
+                'backlog_seconds': round(backlog_seconds)
+            }
+
+
+def get_bandwidth_scheduler():
+    """
+    :return: The bandwidth scheduler shared by this process, or None if there are no bandwidth limits.
+    """
+    global _bandwidth_scheduler
+    with _bandwidth_scheduler_lock:
+        if _bandwidth_scheduler is None and config.BANDWIDTH_TIMETABLE:
+            _bandwidth_scheduler = BandwidthScheduler()
+        return _bandwidth_scheduler
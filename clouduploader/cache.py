@@ -0,0 +1,213 @@
+from collections import OrderedDict
+from importlib import metadata
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import logbook
+
+from clouduploader import config
+
+GUESSIT_NAMESPACE = 'guessit'
+PATH_NAMESPACE = 'path'
+# Run disk eviction once every X new disk entries.
+DISK_EVICTION_INTERVAL = 1000
+
+logger = logbook.Logger('GuessCache')
+
+_guess_cache = None
+_guess_cache_lock = threading.Lock()
+
+
+def _get_package_version(package_name):
+    """
+    :param package_name: The installed package name.
+    :return: The package version, or 'unknown' if it can't be found.
+    """
+    try:
+        return metadata.version(package_name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def _normalize_name(file_name):
+    """
+    Normalize the given file name, so equal names always have the same cache key.
+    Case is kept, since guessit results depend on it.
+
+    :param file_name: The file name to normalize.
+    :return: The normalized file name.
+    """
+    return unicodedata.normalize('NFC', file_name).strip()
+
+
+class GuessCache(object):
+    """
+    A two-tier cache for file name guesses: an in-process LRU tier, and an on-disk (SQLite) tier which survives
+    restarts. Keys include the guessit and showsformatter versions, so upgrading them invalidates old results.
+    """
+
+    def __init__(self, disk_path=None, memory_size=None, disk_size=None):
+        """
+        :param disk_path: The on-disk cache file path (defaults to the configured one, None disables the disk tier).
+        :param memory_size: The maximum amount of in-process entries (defaults to the configured one).
+        :param disk_size: The maximum amount of on-disk entries (defaults to the configured one).
+        """
+        self.disk_path = disk_path or config.GUESS_CACHE_PATH
+        self.memory_size = memory_size or config.GUESS_CACHE_MEMORY_SIZE
+        self.disk_size = disk_size or config.GUESS_CACHE_DISK_SIZE
+        self.version = 'guessit-{}/showsformatter-{}'.format(
+            _get_package_version('guessit'), _get_package_version('showsformatter'))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._new_disk_entries = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    def _get_connection(self):
+        """
+        :return: The on-disk cache connection (opened on first use), or None if the disk tier is disabled or broken.
+        """
+        if self._connection is None and self.disk_path:
+            try:
+                os.makedirs(os.path.dirname(self.disk_path) or '.', exist_ok=True)
+                self._connection = sqlite3.connect(self.disk_path, timeout=30, check_same_thread=False)
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS guesses (key TEXT PRIMARY KEY, value BLOB, accessed REAL)')
+                self._connection.execute('CREATE INDEX IF NOT EXISTS guesses_accessed ON guesses (accessed)')
+                self._connection.commit()
+            except sqlite3.Error:
+                logger.exception(f'Failed to open guess cache: {self.disk_path}. Using memory only...')
+                self.disk_path = None
+                self._connection = None
+        return self._connection
+
+    def _make_key(self, namespace, file_name):
+        return f'{self.version}/{namespace}/{_normalize_name(file_name)}'
+
+    def _remember(self, key, value):
+        """
+        Add the given value to the in-process tier, evicting the least recently used entries.
+        """
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    def get(self, namespace, file_name, default=None):
+        """
+        Get a cached value.
+
+        :param namespace: The cached value type (e.g. GUESSIT_NAMESPACE).
+        :param file_name: The file name the value was computed for.
+        :param default: The value to return if nothing is cached.
+        :return: The cached value, or the default one.
+        """
+        key = self._make_key(namespace, file_name)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            connection = self._get_connection()
+            if connection:
+                try:
+                    row = connection.execute('SELECT value FROM guesses WHERE key = ?', (key,)).fetchone()
+                    if row:
+                        value = pickle.loads(row[0])
+                        connection.execute('UPDATE guesses SET accessed = ? WHERE key = ?', (time.time(), key))
+                        connection.commit()
+                        self._remember(key, value)
+                        self.disk_hits += 1
+                        return value
+                except (sqlite3.Error, pickle.UnpicklingError):
+                    logger.exception(f'Failed to read guess cache entry: {key}')
+
+            self.misses += 1
+            return default
+
+    def set(self, namespace, file_name, value):
+        """
+        Cache a value in both tiers.
+
+        :param namespace: The cached value type (e.g. GUESSIT_NAMESPACE).
+        :param file_name: The file name the value was computed for.
+        :param value: The (picklable) value to cache.
+        """
+        key = self._make_key(namespace, file_name)
+        with self._lock:
+            self._remember(key, value)
+            connection = self._get_connection()
+            if connection:
+                try:
+                    connection.execute('INSERT OR REPLACE INTO guesses (key, value, accessed) VALUES (?, ?, ?)',
+                                       (key, pickle.dumps(value), time.time()))
+                    connection.commit()
+                    self._new_disk_entries += 1
+                    if self._new_disk_entries >= DISK_EVICTION_INTERVAL:
+                        self._evict_disk(connection)
+                except sqlite3.Error:
+                    logger.exception(f'Failed to write guess cache entry: {key}')
+
+    def _evict_disk(self, connection):
+        """
+        Delete the least recently used on-disk entries, beyond the maximum amount of entries.
+        """
+        self._new_disk_entries = 0
+        cursor = connection.execute(
+            'DELETE FROM guesses WHERE key NOT IN (SELECT key FROM guesses ORDER BY accessed DESC LIMIT ?)',
+            (self.disk_size,))
+        connection.commit()
+        self.disk_evictions += cursor.rowcount
+
+    def stats(self):
+        """
+        :return: A dictionary of the cache hit and miss counters.
+        """
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_evictions': self.memory_evictions,
+                'disk_evictions': self.disk_evictions
+            }
+
+
+def get_guess_cache():
+    """
+    :return: The guess cache shared by this process.
+    """
+    global _guess_cache
+    with _guess_cache_lock:
+        if _guess_cache is None:
+            _guess_cache = GuessCache()
+        return _guess_cache
+
+
+def cached_guessit(file_name):
+    """
+    Run guessit on the given file name, unless its results are already cached.
+
+    :param file_name: The file name to guess on.
+    :return: A dictionary of guessit results (a copy, so it may be modified freely).
+    """
+    cache = get_guess_cache()
+    guess_results = cache.get(GUESSIT_NAMESPACE, file_name)
+    if guess_results is None:
+        # guessit is slow to import, so it's only imported once something isn't cached.
+        from guessit import guessit
+
+        guess_results = dict(guessit(file_name))
+        cache.set(GUESSIT_NAMESPACE, file_name, guess_results)
+    return dict(guess_results)
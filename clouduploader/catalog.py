@@ -0,0 +1,213 @@
+from collections import namedtuple
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+from clouduploader.cache import cached_guessit
+
+# Log the import progress once every X lines.
+IMPORT_LOG_INTERVAL = 1000
+
+# An uploaded file's catalog entry. Upload time and size are None for entries imported from the original names log.
+CatalogEntry = namedtuple('CatalogEntry', ['id', 'source_path', 'cloud_dir', 'cloud_file', 'size', 'uploaded', 'title',
+                                           'season', 'episodes', 'metadata'])
+
+logger = logbook.Logger('UploadCatalog')
+
+_upload_catalog = None
+_upload_catalog_lock = threading.Lock()
+
+
+def get_metadata(file_path):
+    """
+    Parse the given file's name.
+
+    :param file_path: The (original) file path.
+    :return: A JSON serializable dictionary of the parsed file name details.
+    """
+    file_name = os.path.basename(file_path)
+    # Remove brackets group name prefix.
+    if file_name.startswith('[') and ']' in file_name:
+        file_name = file_name.split(']', 1)[1]
+    # Values such as languages and dates are kept as strings.
+    return json.loads(json.dumps(dict(cached_guessit(file_name)), default=str))
+
+
+def _get_indexed_fields(metadata):
+    """
+    :param metadata: The parsed file name details.
+    :return: A tuple of format (title, season, episodes) of the indexed details (each is None if unknown).
+    """
+    title = metadata.get('title')
+    if isinstance(title, list):
+        title = title[0]
+    season = metadata.get('season')
+    if isinstance(season, list):
+        season = season[0]
+    episodes = metadata.get('episode')
+    if episodes is not None and not isinstance(episodes, list):
+        episodes = [episodes]
+    return title, season, episodes
+
+
+class UploadCatalog(object):
+    """
+    A local (SQLite) catalog of uploaded files: where every file came from, where it was uploaded to, and its parsed
+    name details. Indexed for finding the latest uploads, the uploads of a show (or season), and uploads by cloud path.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: The catalog file path (defaults to the configured one).
+        """
+        self.path = path or config.CATALOG_PATH
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                 'source_path TEXT, cloud_dir TEXT, cloud_file TEXT, cloud_path TEXT, size INTEGER, '
+                                 'uploaded REAL, title TEXT COLLATE NOCASE, season INTEGER, episodes TEXT, '
+                                 'metadata TEXT)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS uploads_uploaded ON uploads (uploaded)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS uploads_show ON uploads (title, season)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS uploads_cloud_path ON uploads (cloud_path)')
+        # Imported original names logs, and the offset they were imported up to.
+        self._connection.execute('CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, offset INTEGER, '
+                                 'imported REAL)')
+        self._connection.commit()
+
+    def add(self, source_path, cloud_dir, cloud_file, size=None, metadata=None, uploaded=None):
+        """
+        Add an uploaded file to the catalog.
+
+        :param source_path: The original file path.
+        :param cloud_dir: The cloud directory the file was uploaded to.
+        :param cloud_file: The cloud file name.
+        :param size: The file size.
+        :param metadata: The parsed file name details (see get_metadata).
+        :param uploaded: The upload time (defaults to now).
+        """
+        self.add_many([(source_path, cloud_dir, cloud_file, size, metadata, uploaded or time.time())])
+
+    def add_many(self, entries):
+        """
+        Add several uploaded files to the catalog, in a single transaction.
+
+        :param entries: A list of tuples of format (source_path, cloud_dir, cloud_file, size, metadata, uploaded).
+        """
+        rows = []
+        for source_path, cloud_dir, cloud_file, size, metadata, uploaded in entries:
+            metadata = metadata or {}
+            title, season, episodes = _get_indexed_fields(metadata)
+            rows.append((source_path, cloud_dir, cloud_file, os.path.join(cloud_dir, cloud_file), size, uploaded,
+                         title, season, json.dumps(episodes) if episodes is not None else None, json.dumps(metadata)))
+        with self._lock:
+            self._connection.executemany(
+                'INSERT INTO uploads (source_path, cloud_dir, cloud_file, cloud_path, size, uploaded, title, season, '
+                'episodes, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._connection.commit()
+
+    def _query(self, where, params=(), limit=None):
+        """
+        :param where: The SQL condition and order of the query.
+        :param params: The query parameters.
+        :param limit: The maximum amount of entries (None for all of them).
+        :return: A list of the matching catalog entries.
+        """
+        query = 'SELECT id, source_path, cloud_dir, cloud_file, size, uploaded, title, season, episodes, metadata ' \
+                f'FROM uploads {where}'
+        if limit is not None:
+            query += f' LIMIT {int(limit)}'
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [CatalogEntry(*row[:8], json.loads(row[8]) if row[8] else None, json.loads(row[9] or '{}'))
+                for row in rows]
+
+    def get_latest(self, limit=None):
+        """
+        :param limit: The maximum amount of entries (None for all of them).
+        :return: A list of the latest catalog entries, from the newest to the oldest. Imported entries (whose upload
+                 time is unknown) are older than all others.
+        """
+        return self._query('ORDER BY uploaded DESC, id DESC', limit=limit)
+
+    def get_by_show(self, title, season=None):
+        """
+        :param title: The show (or movie) title, as parsed from the file names (case insensitive).
+        :param season: An optional season number.
+        :return: A list of the title's catalog entries (of the given season only, if given), from the oldest to the
+                 newest.
+        """
+        if season is None:
+            return self._query('WHERE title = ? ORDER BY id', (title,))
+        return self._query('WHERE title = ? AND season = ? ORDER BY id', (title, season))
+
+    def get_by_cloud_path(self, cloud_path):
+        """
+        :param cloud_path: A full cloud path (cloud directory and file name).
+        :return: A list of the catalog entries uploaded to the given cloud path, from the oldest to the newest.
+        """
+        return self._query('WHERE cloud_path = ? ORDER BY id', (cloud_path,))
+
+    def import_names_log(self, log_path=None):
+        """
+        Import the entries of an original names log, classifying every file name again (as it was on upload).
+        Every log is imported once; only lines appended since the last import are imported again.
+
+        :param log_path: The original names log path (defaults to the configured one).
+        :return: The amount of imported entries.
+        """
+        # The uploader imports the catalog, so its classification is only imported when needed.
+        from clouduploader.uploader import _classify_file
+
+        log_path = os.path.abspath(log_path or config.ORIGINAL_NAMES_LOG)
+        if not os.path.isfile(log_path):
+            return 0
+        with self._lock:
+            row = self._connection.execute('SELECT offset FROM imports WHERE path = ?', (log_path,)).fetchone()
+        offset = row[0] if row else 0
+        if offset >= os.path.getsize(log_path):
+            return 0
+
+        logger.info(f'Importing the original names log: {log_path}')
+        entries = []
+        lines = 0
+        with open(log_path, 'rb') as log_file:
+            log_file.seek(offset)
+            for line in log_file:
+                # A partially written last line is left for the next import.
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                lines += 1
+                if lines % IMPORT_LOG_INTERVAL == 0:
+                    logger.info(f'Classified {lines} lines...')
+                source_path = line.decode('UTF-8', errors='replace').strip()
+                if not source_path:
+                    continue
+                cloud_dir, cloud_file, _ = _classify_file(source_path)
+                if cloud_dir and cloud_file:
+                    entries.append((source_path, cloud_dir, cloud_file, None, get_metadata(source_path), None))
+        self.add_many(entries)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO imports (path, offset, imported) VALUES (?, ?, ?)',
+                                     (log_path, offset, time.time()))
+            self._connection.commit()
+        logger.info(f'Imported {len(entries)} entries ({lines} lines) from the original names log.')
+        return len(entries)
+
+
+def get_upload_catalog():
+    """
+    :return: The upload catalog shared by this process, or None if it's disabled.
+    """
+    global _upload_catalog
+    with _upload_catalog_lock:
+        if _upload_catalog is None and config.CATALOG_PATH:
+            _upload_catalog = UploadCatalog()
+        return _upload_catalog
@@ -5,6 +5,55 @@ SHOULD_DELETE = True
 RCLONE_PATH = '/usr/bin/rclone'
 RCLONE_CONFIG_PATH = '/mnt/vdb/rclone.conf'
 MAX_UPLOAD_TRIES = 3
+# An optional long-lived rclone remote control server ("rclone rcd"), used instead of an rclone process per upload.
+RCLONE_RC_URL = None
+RCLONE_RC_USER = None
+RCLONE_RC_PASSWORD = None
+RCLONE_RC_TIMEOUT = 30
+RCLONE_RC_POLL_INTERVAL = 1
+# Transfer progress settings: how often rclone reports its stats, how long a transfer may go without any progress
+# before it's killed (None disables stall detection), and how many output lines are kept for error reporting.
+RCLONE_STATS_INTERVAL = 10
+RCLONE_STALL_TIMEOUT = 600
+RCLONE_OUTPUT_LINES = 200
+# Adaptive transfer tuning: transfers are grouped into buckets by file size, and every bucket picks the candidate
+# profile with the best throughput observed so far (trying every candidate at least once, and a random one every
+# now and then). Multi-thread streams are only used by backends which support multi-part uploads.
+# Set the history path to None in order to keep the throughput history in memory only.
+TRANSFER_HISTORY_PATH = '/mnt/vdb/transfer_history.db'
+TRANSFER_EXPLORE_RATE = 0.1
+# The weight of every new throughput sample in a profile's (exponential moving) average.
+TRANSFER_HISTORY_WEIGHT = 0.3
+# Size buckets, as (bucket name, maximum file size in bytes or None) tuples, from the smallest to the largest.
+TRANSFER_SIZE_BUCKETS = [('small', 64 * 1024 ** 2), ('medium', 4 * 1024 ** 3), ('large', None)]
+TRANSFER_PROFILES = {
+    'small': [
+        {'chunk_size': '8M', 'transfers': 16, 'checkers': 32, 'multi_thread_streams': 0},
+        {'chunk_size': '8M', 'transfers': 8, 'checkers': 16, 'multi_thread_streams': 0},
+    ],
+    'medium': [
+        {'chunk_size': '64M', 'transfers': 4, 'checkers': 8, 'multi_thread_streams': 0},
+        {'chunk_size': '128M', 'transfers': 4, 'checkers': 8, 'multi_thread_streams': 4},
+    ],
+    'large': [
+        {'chunk_size': '256M', 'transfers': 2, 'checkers': 4, 'multi_thread_streams': 4},
+        {'chunk_size': '512M', 'transfers': 1, 'checkers': 4, 'multi_thread_streams': 8},
+    ],
+}
+# Bandwidth limits by time of day, as ('HH:MM', bytes/sec or None for unlimited) tuples, each starting a window which
+# lasts until the next one (set to None in order to disable the limits). For example, limit uploads while streaming:
+# [('00:00', None), ('18:00', 2 * 1024 ** 2), ('23:30', None)]
+BANDWIDTH_TIMETABLE = None
+# Small files (and subtitles) are transferred first, and larger ones are deferred while the limit is below X bytes/sec.
+BANDWIDTH_SMALL_FILE_SIZE = 64 * 1024 ** 2
+BANDWIDTH_DEFER_BELOW = 1024 ** 2
+# Retry backoff settings (in seconds). Rate limits start with a longer delay, and hold back all uploads meanwhile.
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+RATE_LIMIT_BASE_DELAY = 60
+# A retry budget shared by all concurrent uploads: up to X saved retries, earning one back every Y seconds.
+RETRY_BUDGET = 10
+RETRY_BUDGET_REFILL_SECONDS = 60
 
 # encfs settings.
 SHOULD_ENCRYPT = True
@@ -13,6 +62,8 @@ UMOUNT_PATH = '/usr/bin/umount'
 ENCFS_ENVIRONMENT_VARIABLE = 'ENCFS6_CONFIG'
 ENCFS_CONFIG_PATH = '/mnt/vdb/encfs6.xml'
 ENCFS_PASSWORD = 'Password1'
+# A long-lived encrypted staging mount, shared by all uploads.
+ENCFS_STAGING_PATH = '/mnt/vdb/encfs_staging'
 
 # Directories settings.
 CLOUD_ENCRYPTED_PATH = 'Encrypted'
@@ -23,7 +74,48 @@ CLOUD_KIDS_TV_PATH = 'Kids TV'
 CLOUD_KIDS_MOVIES_PATH = 'Kids Movies'
 CLOUD_UFC_PATH = 'UFC'
 CLOUD_VIDEOS_PATH = 'Videos'
+# A catalog of uploaded files, replacing the original names log (set to None in order to keep using the log).
+# An existing log is imported into the catalog once, by the subtitles monitor or "clouduploader catalog import".
+CATALOG_PATH = '/mnt/vdb/upload_catalog.db'
 ORIGINAL_NAMES_LOG = '/mnt/vdb/original_names.log'
+# The latest paths read from the original names log and the offset they were read up to, so only new lines are read
+# (set to None in order to always read the log's end instead).
+NAMES_LOG_CHECKPOINT_PATH = '/mnt/vdb/original_names.checkpoint'
+# An index of uploaded files' hashes, used for skipping duplicates (set to None in order to disable it).
+DEDUP_INDEX_PATH = '/mnt/vdb/dedup_index.db'
+# A directory of write-ahead journals, used for recovering uploads after a crash.
+JOURNAL_PATH = '/mnt/vdb/journal'
+
+# Daemon settings. The daemon's socket is only accessible by its own user.
+DAEMON_SOCKET_PATH = '/tmp/clouduploader.sock'
+UPLOAD_WORKERS = 4
+# Maximum amount of files copied into staging trees at the same time.
+STAGING_LIMIT = 2
+# Maximum amount of concurrent rclone transfers, in total and per destination (cloud directory).
+TRANSFER_LIMIT = 3
+DESTINATION_TRANSFER_LIMIT = 1
+# A persistent priority queue of the daemon's submissions (set to None in order to keep the queue in memory only).
+UPLOAD_QUEUE_PATH = '/mnt/vdb/upload_queue.db'
+# Submissions with lower scores go first. A submission's score is its explicit priority, plus a point for every size
+# doubling above the size unit, plus a penalty unless it only holds subtitles. Waiting submissions gain a point every
+# X seconds, so large ones never starve.
+QUEUE_SIZE_UNIT = 64 * 1024 ** 2
+QUEUE_VIDEO_PENALTY = 5
+QUEUE_AGING_SECONDS = 600
+
+# Planner settings: the amount of classification processes (None for one per CPU).
+PLAN_WORKERS = None
+
+# Guess cache settings (set the path to None in order to keep the cache in memory only).
+GUESS_CACHE_PATH = '/mnt/vdb/guess_cache.db'
+GUESS_CACHE_MEMORY_SIZE = 10000
+GUESS_CACHE_DISK_SIZE = 200000
+
+# Metrics settings (set the paths to None in order to disable the exporters).
+# A Prometheus textfile, for node_exporter's textfile collector.
+METRICS_TEXTFILE_PATH = None
+# A JSON-lines file, with a line per finished upload job.
+METRICS_JSON_PATH = None
 
 # Log settings.
 LOGFILE = '/var/log/cloud_uploader.log'
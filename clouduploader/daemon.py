@@ -0,0 +1,316 @@
+#!/usr/local/bin/python3
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+
+from clouduploader import config
+
+SERVE_COMMAND = 'serve'
+STATS_COMMAND = 'stats'
+PLAN_COMMAND = 'plan'
+CATALOG_COMMAND = 'catalog'
+CLIENT_TIMEOUT = 5
+# Statuses (see the uploader module) which make a waiting client fail.
+FAILED_STATUSES = ['rolled-back', 'failed']
+
+
+class _SubmissionHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single client connection: one JSON request line, and one JSON response line.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('UTF-8'))
+            if request.get('stats'):
+                from clouduploader.bandwidth import get_bandwidth_scheduler
+                from clouduploader.cache import get_guess_cache
+
+                bandwidth = get_bandwidth_scheduler()
+                self._respond({'stats': dict(self.server.scheduler.stats(), guess_cache=get_guess_cache().stats(),
+                                             metrics=self.server.metrics.snapshot(),
+                                             bandwidth=bandwidth.stats() if bandwidth else None)})
+                return
+            paths = [str(p) for p in request['paths']]
+            priority = int(request.get('priority', 0))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._respond({'error': 'Bad request'})
+            return
+
+        from clouduploader import uploader
+
+        # Invalid paths are reported back, so the client shows them (rather than the daemon's log).
+        file_paths, invalid_paths = uploader._expand_paths(paths)
+        future = self.server.scheduler.submit(file_paths, priority)
+        if not request.get('wait'):
+            self._respond({'queued': len(file_paths), 'invalid': invalid_paths})
+            return
+        try:
+            results = [job.to_dict() for job in future.result()]
+        except Exception:
+            results = [{'file_path': p, 'status': uploader.STATUS_FAILED, 'cloud_path': None} for p in file_paths]
+        self._respond({'results': results, 'invalid': invalid_paths})
+
+    def _respond(self, response):
+        self.wfile.write(json.dumps(response).encode('UTF-8') + b'\n')
+
+
+class UploadDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A resident upload daemon, which accepts upload submissions over a Unix domain socket.
+    Submissions are uploaded by a pool of workers (see the scheduler module).
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, recovered_jobs=()):
+        """
+        :param socket_path: The Unix domain socket path to listen on.
+        :param recovered_jobs: The upload jobs recovered from the journal, which are dropped from restored submissions.
+        """
+        from clouduploader import uploader
+        from clouduploader.metrics import MetricsAggregator, get_metrics_reporter
+        from clouduploader.scheduler import UploadScheduler
+        from clouduploader.upload_queue import UploadQueue
+
+        # Remove a stale socket left behind by a previous daemon (but nothing else).
+        if os.path.lexists(socket_path):
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f'Refusing to replace a file which is not a socket: {socket_path}')
+            os.remove(socket_path)
+        super().__init__(socket_path, _SubmissionHandler)
+        # Sum up the metrics of all jobs uploaded since the daemon started.
+        self.metrics = MetricsAggregator()
+        get_metrics_reporter().add_hook(self.metrics)
+        upload_queue = UploadQueue()
+        # Recovery already uploaded (or rolled back) these files, so they must not be uploaded again.
+        discarded = upload_queue.discard_files(job.file_path for job in recovered_jobs)
+        if discarded:
+            uploader.logger.info(f'Dropped {discarded} recovered files from the restored submissions.')
+        for job in recovered_jobs:
+            if job.status == uploader.STATUS_ROLLED_BACK and os.path.isfile(job.file_path):
+                uploader.logger.warning(f'Recovery rolled back an upload, submit it again if needed: {job.file_path}')
+        self.scheduler = UploadScheduler(upload_queue=upload_queue)
+        self.scheduler.start()
+
+    def server_bind(self):
+        # Submissions may delete files, so only this user may connect (the socket is never accessible to others).
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        from clouduploader.metrics import get_metrics_reporter
+
+        get_metrics_reporter().remove_hook(self.metrics)
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def serve(socket_path=None):
+    """
+    Run the upload daemon until interrupted.
+
+    :param socket_path: The Unix domain socket path to listen on (defaults to the configured one).
+    """
+    # Heavy modules are only imported by the daemon itself, so the client stays fast.
+    import logbook
+    from clouduploader import uploader
+    from clouduploader.encfs import get_shared_mount
+    from clouduploader.journal import get_journal
+
+    with logbook.NestedSetup(uploader._get_log_handlers()).applicationbound():
+        recovered_jobs = uploader.recover_jobs()
+        socket_path = socket_path or config.DAEMON_SOCKET_PATH
+        uploader.logger.info(f'Upload daemon listening on: {socket_path}')
+        with UploadDaemon(socket_path, recovered_jobs) as daemon:
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                uploader.logger.info('Upload daemon stopped!')
+        get_journal().close()
+        if config.SHOULD_ENCRYPT:
+            get_shared_mount().close()
+
+
+def _request(request, socket_path=None):
+    """
+    Send the given request to a running upload daemon.
+
+    :param request: The request dictionary.
+    :param socket_path: The daemon's Unix domain socket path (defaults to the configured one).
+    :return: The daemon's response dictionary.
+    :raise OSError: If the daemon couldn't be reached.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT)
+        client.connect(socket_path or config.DAEMON_SOCKET_PATH)
+        # Uploads can take a long time, so only the connection itself has a timeout.
+        client.settimeout(None)
+        client.sendall(json.dumps(request).encode('UTF-8') + b'\n')
+        with client.makefile('rb') as response_file:
+            response = response_file.readline()
+    if not response:
+        raise ConnectionError('Upload daemon closed the connection')
+    return json.loads(response.decode('UTF-8'))
+
+
+def submit(paths, wait=False, socket_path=None, priority=0):
+    """
+    Submit the given paths to a running upload daemon.
+
+    :param paths: The file and directory paths to upload.
+    :param wait: Whether to block until the upload is done.
+    :param socket_path: The daemon's Unix domain socket path (defaults to the configured one).
+    :param priority: An explicit priority (lower goes first), added to the one of the files' type and size.
+    :return: The daemon's response dictionary.
+    :raise OSError: If the daemon couldn't be reached.
+    """
+    return _request({'paths': paths, 'wait': wait, 'priority': priority}, socket_path)
+
+
+def get_stats(socket_path=None):
+    """
+    Get the queue depth, in-flight counts and aggregated job metrics of a running upload daemon.
+
+    :param socket_path: The daemon's Unix domain socket path (defaults to the configured one).
+    :return: The daemon's scheduler stats dictionary.
+    :raise OSError: If the daemon couldn't be reached.
+    """
+    return _request({'stats': True}, socket_path)['stats']
+
+
+def plan(argv):
+    """
+    Print the planned cloud path of every given file (or every file in the given directories) as JSON, without
+    touching them.
+
+    :param argv: The plan command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog=f'clouduploader {PLAN_COMMAND}',
+                                     description='Plan the upload of files, without touching them.')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='A file or directory to plan.')
+    parser.add_argument('--workers', type=int, help='The amount of classification processes.')
+    parser.add_argument('--output', help='Write the plan to this file (instead of the standard output).')
+    args = parser.parse_args(argv)
+
+    import logbook
+    from clouduploader.planner import plan_uploads
+
+    # Only warnings are shown, since the plan itself holds every file's result.
+    with logbook.NestedSetup([logbook.NullHandler(), logbook.StderrHandler(level=logbook.WARNING)]).applicationbound():
+        upload_plan = plan_uploads(args.paths, args.workers)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output_file:
+            json.dump(upload_plan, output_file, indent=4)
+    else:
+        print(json.dumps(upload_plan, indent=4))
+    planned = sum(1 for entry in upload_plan if entry['cloud_path'])
+    print(f'Planned {planned} files ({len(upload_plan) - planned} skipped).', file=sys.stderr)
+
+
+def catalog(argv):
+    """
+    Query the upload catalog (printing the matching entries as JSON), or import the original names log into it.
+
+    :param argv: The catalog command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog=f'clouduploader {CATALOG_COMMAND}', description='Query the upload catalog.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='Import an original names log (only its new lines).')
+    import_parser.add_argument('log_path', nargs='?', help='The log path (defaults to the configured one).')
+    latest_parser = subparsers.add_parser('latest', help='Show the latest uploads.')
+    latest_parser.add_argument('-n', '--limit', type=int, default=20, help='The amount of uploads to show.')
+    show_parser = subparsers.add_parser('show', help='Show the uploads of a show (or movie).')
+    show_parser.add_argument('title', help='The title, as parsed from the file names (case insensitive).')
+    show_parser.add_argument('--season', type=int, help='Only show the uploads of this season.')
+    path_parser = subparsers.add_parser('path', help='Show the uploads to a cloud path.')
+    path_parser.add_argument('cloud_path', help='The full cloud path.')
+    args = parser.parse_args(argv)
+
+    import logbook
+    from clouduploader.catalog import get_upload_catalog
+
+    upload_catalog = get_upload_catalog()
+    if not upload_catalog:
+        print('The upload catalog is disabled!', file=sys.stderr)
+        sys.exit(1)
+    if args.command == 'import':
+        with logbook.NestedSetup([logbook.NullHandler(), logbook.StderrHandler(level=logbook.INFO)]).applicationbound():
+            print(f'Imported {upload_catalog.import_names_log(args.log_path)} entries.')
+        return
+    if args.command == 'latest':
+        entries = upload_catalog.get_latest(args.limit)
+    elif args.command == 'show':
+        entries = upload_catalog.get_by_show(args.title, args.season)
+    else:
+        entries = upload_catalog.get_by_cloud_path(args.cloud_path)
+    print(json.dumps([entry._asdict() for entry in entries], indent=4))
+
+
+def main():
+    """
+    Submit the given files (or directories) to the upload daemon, run the daemon itself, plan an upload or query the
+    upload catalog.
+    """
+    if len(sys.argv) >= 2 and sys.argv[1] == PLAN_COMMAND:
+        plan(sys.argv[2:])
+        return
+    if len(sys.argv) >= 2 and sys.argv[1] == CATALOG_COMMAND:
+        catalog(sys.argv[2:])
+        return
+    if len(sys.argv) == 2 and sys.argv[1] == SERVE_COMMAND:
+        serve()
+        return
+    if len(sys.argv) == 2 and sys.argv[1] == STATS_COMMAND:
+        try:
+            print(json.dumps(get_stats(), indent=4))
+        except OSError:
+            print('Upload daemon is not running!')
+            sys.exit(1)
+        return
+
+    parser = argparse.ArgumentParser(prog='clouduploader', description='Upload files to Google Drive.',
+                                     epilog=f'Run "clouduploader {SERVE_COMMAND}" to start the upload daemon, '
+                                            f'"clouduploader {STATS_COMMAND}" to show its queue stats, '
+                                            f'"clouduploader {PLAN_COMMAND} PATH [PATH ...]" to plan an upload, and '
+                                            f'"clouduploader {CATALOG_COMMAND}" to query the upload catalog.')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='A file or directory to upload.')
+    parser.add_argument('--wait', action='store_true', help='Wait until the upload is done.')
+    parser.add_argument('--priority', type=int, default=0, help='Upload priority (lower goes first).')
+    args = parser.parse_args()
+    paths = [os.path.abspath(p) for p in args.paths]
+
+    try:
+        response = submit(paths, wait=args.wait, priority=args.priority)
+    except OSError:
+        # No daemon is running, so upload in this process instead.
+        print('Upload daemon is not running. Uploading directly...')
+        sys.argv = [sys.argv[0]] + paths
+        from clouduploader import uploader
+        uploader.main()
+        return
+
+    if 'error' in response:
+        print(f'Upload daemon error: {response["error"]}')
+        sys.exit(1)
+    for invalid_path in response.get('invalid', []):
+        print(f'Invalid path given: {invalid_path}. Skipping!')
+    if args.wait:
+        for result in response['results']:
+            print(f'{result["status"]}: {result["file_path"]}')
+        if any(result['status'] in FAILED_STATUSES for result in response['results']):
+            sys.exit(1)
+    else:
+        print(f'Submitted {response["queued"]} files to the upload daemon.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+from collections import namedtuple
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# The amount of bytes hashed from both the start and the end of a file, for its partial hash.
+PARTIAL_HASH_SIZE = 1024 * 1024
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+# An uploaded file's index entry.
+IndexEntry = namedtuple('IndexEntry', ['cloud_path', 'size', 'partial_hash', 'full_hash', 'uploaded'])
+
+logger = logbook.Logger('DedupIndex')
+
+_dedup_index = None
+_dedup_index_lock = threading.Lock()
+
+
+def new_hasher():
+    """
+    :return: A new hash object, for full file hashes.
+    """
+    return hashlib.blake2b(digest_size=32)
+
+
+def get_partial_hash(file_path, size):
+    """
+    Quickly hash the given file, by its size and the data at its start and end.
+
+    :param file_path: The file to hash.
+    :param size: The file size.
+    :return: The partial hash hex digest.
+    """
+    hasher = new_hasher()
+    hasher.update(str(size).encode('UTF-8'))
+    with open(file_path, 'rb') as f:
+        hasher.update(f.read(PARTIAL_HASH_SIZE))
+        if size > 2 * PARTIAL_HASH_SIZE:
+            f.seek(-PARTIAL_HASH_SIZE, os.SEEK_END)
+            hasher.update(f.read(PARTIAL_HASH_SIZE))
+    return hasher.hexdigest()
+
+
+def get_full_hash(file_path):
+    """
+    Hash the entire given file.
+
+    :param file_path: The file to hash.
+    :return: The full hash hex digest.
+    """
+    hasher = new_hasher()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DedupIndex(object):
+    """
+    A local (SQLite) index of uploaded files, holding the latest content uploaded to every cloud path.
+    Files are compared by size and partial hash first, so full hashes are only computed for likely duplicates.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: The index file path (defaults to the configured one).
+        """
+        self.path = path or config.DEDUP_INDEX_PATH
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS uploads (cloud_path TEXT PRIMARY KEY, size INTEGER, '
+                                 'partial_hash TEXT, full_hash TEXT, uploaded REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS uploads_hashes ON uploads (size, partial_hash)')
+        self._connection.commit()
+
+    def get(self, cloud_path):
+        """
+        :param cloud_path: The cloud path to look up.
+        :return: The index entry of the given cloud path, or None if nothing was uploaded to it.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT cloud_path, size, partial_hash, full_hash, uploaded FROM uploads WHERE cloud_path = ?',
+                (cloud_path,)).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def add(self, cloud_path, size, partial_hash, full_hash):
+        """
+        Add an uploaded file to the index (replacing whatever was uploaded to the same cloud path before).
+
+        :param cloud_path: The file's cloud path.
+        :param size: The file size.
+        :param partial_hash: The file's partial hash.
+        :param full_hash: The file's full hash.
+        """
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO uploads (cloud_path, size, partial_hash, full_hash, uploaded) '
+                'VALUES (?, ?, ?, ?, ?)', (cloud_path, size, partial_hash, full_hash, time.time()))
+            self._connection.commit()
+
+    def find_duplicate(self, job):
+        """
+        Find the file already uploaded to the given job's cloud path, if it has the exact same content (whatever the
+        source file is named). Identical content uploaded to another cloud path isn't a duplicate, since the file
+        must still reach its own path. The full hash is only computed if the size and partial hash match.
+        The job's size and partial hash are filled, and its full hash as well if it was needed for the check.
+
+        :param job: The classified upload job.
+        :return: The index entry of the uploaded file, or None if there's none.
+        """
+        job.size = os.path.getsize(job.file_path)
+        job.partial_hash = get_partial_hash(job.file_path, job.size)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT cloud_path, size, partial_hash, full_hash, uploaded FROM uploads '
+                'WHERE cloud_path = ? AND size = ? AND partial_hash = ?',
+                (job.cloud_path, job.size, job.partial_hash)).fetchone()
+        if not row:
+            return None
+        job.full_hash = get_full_hash(job.file_path)
+        entry = IndexEntry(*row)
+        return entry if entry.full_hash == job.full_hash else None
+
+
+def get_dedup_index():
+    """
+    :return: The dedup index shared by this process, or None if it's disabled.
+    """
+    global _dedup_index
+    with _dedup_index_lock:
+        if _dedup_index is None and config.DEDUP_INDEX_PATH:
+            _dedup_index = DedupIndex()
+        return _dedup_index
@@ -0,0 +1,316 @@
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import uuid
+
+import logbook
+
+from clouduploader import config
+
+# A file created right after mounting, which is only visible through a healthy mount.
+MARKER_FILE_NAME = '.clouduploader_mount'
+LOCK_FILE_NAME = '.clouduploader_lock'
+# A directory of claims on staged files (one per file, holding its owner process and ownership token), shared by all
+# processes using the mount.
+CLAIMS_DIR_NAME = '.clouduploader_claims'
+# A directory of the processes holding references to the mount (one empty file per process ID).
+HOLDERS_DIR_NAME = '.clouduploader_holders'
+
+logger = logbook.Logger('EncryptedMount')
+
+_shared_mount = None
+_shared_mount_lock = threading.Lock()
+
+
+def _is_process_alive(pid):
+    """
+    :param pid: A process ID.
+    :return: True if the process is running, and False otherwise.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to another user.
+        return True
+    return True
+
+
+class EncryptedMount(object):
+    """
+    A long-lived ENCFS mount, shared by all uploads (of all processes).
+    Files written to the (plain) mount directory are stored encrypted in the root directory, which is the one uploaded.
+    Every staged file is claimed by the upload which created it, using an ownership token, so only that upload can
+    remove it.
+    """
+
+    def __init__(self, staging_dir=None):
+        """
+        :param staging_dir: The directory holding both the root and the mount directories (defaults to the configured
+                            one).
+        """
+        self.staging_dir = staging_dir or config.ENCFS_STAGING_PATH
+        self.root_dir = os.path.join(self.staging_dir, config.CLOUD_ENCRYPTED_PATH)
+        self.mount_dir = os.path.join(self.staging_dir, config.CLOUD_PLAIN_PATH)
+        self._lock_file_path = os.path.join(self.staging_dir, LOCK_FILE_NAME)
+        self._claims_dir = os.path.join(self.staging_dir, CLAIMS_DIR_NAME)
+        self._holders_dir = os.path.join(self.staging_dir, HOLDERS_DIR_NAME)
+        self._thread_lock = threading.Lock()
+        self._references = 0
+        # Ownership tokens of the files currently staged by this process.
+        self._tokens = set()
+
+    @contextmanager
+    def lock(self):
+        """
+        Lock the mount for the duration of the context (against both other threads and other processes).
+        """
+        with self._thread_lock:
+            os.makedirs(self.staging_dir, exist_ok=True)
+            with open(self._lock_file_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def is_healthy(self):
+        """
+        :return: True if the directory is mounted and responding, and False otherwise.
+        """
+        try:
+            return os.path.isfile(os.path.join(self.mount_dir, MARKER_FILE_NAME))
+        except OSError:
+            # Stale FUSE mounts raise errors like "Transport endpoint is not connected".
+            return False
+
+    def _unmount(self):
+        """
+        Lazily unmount the mount directory (errors are ignored, since it might not be mounted at all).
+        """
+        subprocess.call(f'{config.UMOUNT_PATH} -l "{self.mount_dir}"', shell=True, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+
+    def _mount(self):
+        """
+        Mount the ENCFS directory, getting rid of any stale mount first.
+
+        :return: True if succeeded, and False otherwise.
+        """
+        logger.info(f'Mounting encrypted staging directory: {self.mount_dir}')
+
+        # Verify config environment variable first.
+        if not os.environ.get(config.ENCFS_ENVIRONMENT_VARIABLE):
+            logger.info(f'{config.ENCFS_ENVIRONMENT_VARIABLE} environment variable is not defined. '
+                        f'Defining: {config.ENCFS_CONFIG_PATH}')
+            os.environ[config.ENCFS_ENVIRONMENT_VARIABLE] = config.ENCFS_CONFIG_PATH
+
+        self._unmount()
+        os.makedirs(self.root_dir, exist_ok=True)
+        os.makedirs(self.mount_dir, exist_ok=True)
+        return_code = subprocess.call(
+            f'echo {config.ENCFS_PASSWORD} | {config.ENCFS_PATH} -S "{self.root_dir}" "{self.mount_dir}"', shell=True)
+        if return_code != 0:
+            logger.error(f'Bad return code ({return_code}) for encryption mount. Stopping!')
+            return False
+
+        open(os.path.join(self.mount_dir, MARKER_FILE_NAME), 'w').close()
+        return True
+
+    def acquire(self):
+        """
+        Take a reference to the mount, mounting (or remounting) it if it's not healthy.
+
+        :return: True if the mount is ready, and False otherwise.
+        """
+        with self.lock():
+            if not self.is_healthy():
+                if self._references:
+                    logger.warning(f'Encrypted staging mount is not healthy ({self._references} references)! '
+                                   f'Remounting...')
+                if not self._mount():
+                    return False
+            self._references += 1
+            # Other processes only see whether this process holds any references.
+            os.makedirs(self._holders_dir, exist_ok=True)
+            open(os.path.join(self._holders_dir, str(os.getpid())), 'w').close()
+            return True
+
+    def release(self):
+        """
+        Release a reference to the mount. The mount itself stays up for the next uploads.
+        """
+        with self.lock():
+            self._references -= 1
+            if not self._references:
+                self._remove_holder(os.getpid())
+
+    def _remove_holder(self, pid):
+        """
+        :param pid: The process ID of a process which no longer holds references to the mount.
+        """
+        try:
+            os.remove(os.path.join(self._holders_dir, str(pid)))
+        except FileNotFoundError:
+            pass
+
+    def _get_other_holders(self):
+        """
+        Find the other processes holding references to the mount, forgetting the ones which died.
+        Should be called while the mount is locked.
+
+        :return: A list of the other processes' IDs.
+        """
+        holders = []
+        for holder in os.listdir(self._holders_dir) if os.path.isdir(self._holders_dir) else []:
+            if not holder.isdigit() or int(holder) == os.getpid():
+                continue
+            if _is_process_alive(int(holder)):
+                holders.append(int(holder))
+            else:
+                self._remove_holder(holder)
+        return holders
+
+    def close(self):
+        """
+        Unmount the directory, unless it's still referenced (by this process or any other one).
+        """
+        with self.lock():
+            if self._references:
+                logger.warning(f'Encrypted staging mount is still in use ({self._references} references)!')
+                return
+            other_holders = self._get_other_holders()
+            if other_holders:
+                logger.info(f'Encrypted staging mount is still used by other processes ({len(other_holders)}). '
+                            f'Leaving it mounted.')
+                return
+            logger.info(f'Unmounting encrypted staging directory: {self.mount_dir}')
+            self._unmount()
+
+    def _list_root(self):
+        """
+        :return: A set of all file paths in the root directory, relative to it.
+        """
+        return {os.path.relpath(os.path.join(root, f), self.root_dir)
+                for root, _, files in os.walk(self.root_dir) for f in files}
+
+    def _get_claim_path(self, file_path):
+        """
+        :param file_path: A file path, relative to the mount directory.
+        :return: The path of the file's claim.
+        """
+        return os.path.join(self._claims_dir, hashlib.sha1(file_path.encode('UTF-8')).hexdigest())
+
+    def _read_claim(self, file_path):
+        """
+        :param file_path: A file path, relative to the mount directory.
+        :return: The file's claim dictionary (holding its owner's process ID and token), or None if it isn't claimed.
+        """
+        try:
+            with open(self._get_claim_path(file_path), 'r', encoding='UTF-8') as claim_file:
+                return json.load(claim_file)
+        except (OSError, ValueError):
+            return None
+
+    def _is_claim_alive(self, claim):
+        """
+        :param claim: A claim dictionary.
+        :return: True if the claim's owner may still use the file, and False if it's left over.
+        """
+        if claim['pid'] == os.getpid():
+            # A claim of a previous process with the same ID (e.g. after a container restart) is left over.
+            return claim['token'] in self._tokens
+        return _is_process_alive(claim['pid'])
+
+    def _claim(self, file_path):
+        """
+        Claim the given file for this process. Should be called while the mount is locked.
+
+        :param file_path: A file path, relative to the mount directory.
+        :return: The new ownership token.
+        """
+        token = uuid.uuid4().hex
+        os.makedirs(self._claims_dir, exist_ok=True)
+        with open(self._get_claim_path(file_path), 'w', encoding='UTF-8') as claim_file:
+            json.dump({'path': file_path, 'pid': os.getpid(), 'token': token}, claim_file)
+        self._tokens.add(token)
+        return token
+
+    def create_file(self, file_path):
+        """
+        Create an empty file (and its parent directories) in the mount directory, and claim it.
+
+        :param file_path: The file path, relative to the mount directory.
+        :return: A tuple of format (encrypted_path, token): the encrypted file path, relative to the root directory (or
+                 None if it couldn't be found), and the ownership token needed for removing the file.
+        :raise FileExistsError: If the file is already staged by another upload (of any process).
+        """
+        with self.lock():
+            claim = self._read_claim(file_path)
+            if claim and self._is_claim_alive(claim):
+                raise FileExistsError(f'File is already staged: {file_path}')
+            full_path = os.path.join(self.mount_dir, file_path)
+            # A leftover file (of an upload which died) must be removed first, so its encrypted name can be found again.
+            if os.path.isfile(full_path):
+                os.remove(full_path)
+            existing_files = self._list_root()
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            open(full_path, 'wb').close()
+            token = self._claim(file_path)
+            new_files = self._list_root() - existing_files
+        return new_files.pop() if len(new_files) == 1 else None, token
+
+    def adopt_file(self, file_path):
+        """
+        Take ownership of a file left behind in the mount directory (e.g. by a process which crashed), so it can be
+        removed using remove_file.
+
+        :param file_path: The file path, relative to the mount directory.
+        :return: The new ownership token, or None if the file is claimed by another upload which is still alive.
+        """
+        with self.lock():
+            claim = self._read_claim(file_path)
+            if claim and self._is_claim_alive(claim):
+                logger.warning(f'Staged file is claimed by another upload: {file_path}')
+                return None
+            return self._claim(file_path)
+
+    def remove_file(self, file_path, token):
+        """
+        Remove a file created (or adopted) by this upload from the mount directory (if it still exists), along with its
+        empty parent directories. Files claimed by other uploads are never removed.
+
+        :param file_path: The file path, relative to the mount directory.
+        :param token: The ownership token returned by create_file (or adopt_file).
+        """
+        with self.lock():
+            if token not in self._tokens:
+                return
+            self._tokens.remove(token)
+            claim = self._read_claim(file_path)
+            if not claim or claim['token'] != token:
+                return
+            full_path = os.path.join(self.mount_dir, file_path)
+            if os.path.isfile(full_path):
+                os.remove(full_path)
+            os.remove(self._get_claim_path(file_path))
+            dir_path = os.path.dirname(full_path)
+            while dir_path != self.mount_dir and os.path.isdir(dir_path) and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+                dir_path = os.path.dirname(dir_path)
+
+
+def get_shared_mount():
+    """
+    :return: The encrypted mount shared by all uploads in this process.
+    """
+    global _shared_mount
+    with _shared_mount_lock:
+        if _shared_mount is None:
+            _shared_mount = EncryptedMount()
+        return _shared_mount
@@ -0,0 +1,146 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# Upload job states, in the order they happen.
+STATE_CLASSIFIED = 'classified'
+STATE_STAGED = 'staged'
+STATE_ENCRYPTED = 'encrypted'
+STATE_UPLOADING = 'uploading'
+STATE_UPLOADED = 'uploaded'
+STATE_ROLLED_BACK = 'rolled-back'
+TERMINAL_STATES = [STATE_UPLOADED, STATE_ROLLED_BACK]
+
+# The upload job attributes saved in every journal record.
+JOB_FIELDS = ['id', 'file_path', 'cloud_dir', 'cloud_file', 'is_subtitles', 'staged_path', 'upload_path',
+              'stage_strategy', 'size', 'partial_hash', 'full_hash', 'work_dir', 'upload_base_dir', 'gdrive_dir',
+              'encrypted', 'log_original_name']
+JOURNAL_FILE_PATTERN = 'journal-*.jsonl'
+
+logger = logbook.Logger('UploadJournal')
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+class UploadJournal(object):
+    """
+    A write-ahead journal of upload job states, so unfinished jobs can be resumed or rolled back after a crash.
+    Every process writes its own journal file, and holds a lock on it while alive. Journals which aren't locked
+    belong to processes which died, and can be recovered.
+    """
+
+    def __init__(self, journal_dir=None):
+        """
+        :param journal_dir: The directory holding all journal files (defaults to the configured one).
+        """
+        self.journal_dir = journal_dir or config.JOURNAL_PATH
+        self.path = None
+        self._file = None
+        self._active_jobs = set()
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """
+        Create and lock this process' journal file.
+        """
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.path = os.path.join(self.journal_dir, f'journal-{os.getpid()}-{int(time.time() * 1000)}.jsonl')
+        self._file = open(self.path, 'a', encoding='UTF-8')
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def record(self, job, state):
+        """
+        Durably record the given job's state.
+
+        :param job: The upload job.
+        :param state: The job's new state.
+        """
+        record = {field: getattr(job, field) for field in JOB_FIELDS}
+        record['state'] = state
+        record['time'] = time.time()
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if state in TERMINAL_STATES:
+                self._active_jobs.discard(job.id)
+                # Nothing is left to recover, so the journal can start over.
+                if not self._active_jobs:
+                    self._file.truncate(0)
+            else:
+                self._active_jobs.add(job.id)
+
+    def close(self):
+        """
+        Close and delete this process' journal file, unless some jobs are still unfinished.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            if not self._active_jobs:
+                os.remove(self.path)
+            self._file.close()
+            self._file = None
+
+    def find_orphans(self):
+        """
+        Find all unfinished jobs in journals of processes which died.
+        Each returned journal stays locked by this process, until it's deleted using delete_orphans.
+
+        :return: A tuple of format (records, journals). Records are the latest ones of each unfinished job, and
+                 journals are the open orphan journal files.
+        """
+        records = {}
+        journals = []
+        for journal_path in sorted(glob.glob(os.path.join(self.journal_dir, JOURNAL_FILE_PATTERN))):
+            if journal_path == self.path:
+                continue
+            journal_file = open(journal_path, 'r', encoding='UTF-8')
+            try:
+                fcntl.flock(journal_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # The journal's process is still alive.
+                journal_file.close()
+                continue
+            journals.append(journal_file)
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The process died while writing the last record, which means it never happened.
+                    logger.warning(f'Skipping a partial record in journal: {journal_path}')
+                    continue
+                records[record['id']] = record
+        return [r for r in records.values() if r['state'] not in TERMINAL_STATES], journals
+
+    @staticmethod
+    def delete_orphans(journals):
+        """
+        Delete the given orphan journal files (after their jobs were recovered).
+
+        :param journals: The open orphan journal files, returned by find_orphans.
+        """
+        for journal_file in journals:
+            os.remove(journal_file.name)
+            journal_file.close()
+
+
+def get_journal():
+    """
+    :return: The upload journal of this process.
+    """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = UploadJournal()
+        return _journal
@@ -0,0 +1,233 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# Pipeline stages.
+STAGE_GUESS = 'guess'
+STAGE_DEDUP = 'dedup'
+STAGE_ENCRYPT = 'encrypt'
+STAGE_STAGE = 'stage'
+STAGE_DEFER = 'defer'
+STAGE_TRANSFER = 'transfer'
+STAGE_ROLLBACK = 'rollback'
+STAGE_CLEANUP = 'cleanup'
+
+# Byte counters.
+BYTES_STAGED = 'staged'
+BYTES_COPIED = 'copied'
+BYTES_HASHED = 'hashed'
+BYTES_UPLOADED = 'uploaded'
+
+PROMETHEUS_PREFIX = 'clouduploader'
+
+logger = logbook.Logger('Metrics')
+
+_metrics_reporter = None
+_metrics_reporter_lock = threading.Lock()
+
+
+class JobMetrics(object):
+    """
+    The per-stage timings (in seconds) and byte counters of a single upload job.
+    Batch-wide stages (e.g. a transfer of several files) are added to every job in the batch, with the batch's duration.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        Time the given stage (adding up, if it's timed more than once).
+
+        :param stage: The stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        """
+        :param stage: The stage name.
+        :param seconds: The amount of seconds to add to the stage.
+        """
+        self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def count(self, counter, amount):
+        """
+        :param counter: The counter name.
+        :param amount: The amount to add to the counter.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def to_dict(self):
+        """
+        :return: A JSON serializable dictionary of the job's metrics.
+        """
+        return {'timings': {stage: round(seconds, 6) for stage, seconds in self.timings.items()},
+                'counters': dict(self.counters)}
+
+
+class MetricsAggregator(object):
+    """
+    A metrics hook which sums up the metrics of all reported jobs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = defaultdict(int)
+        self._stage_seconds = defaultdict(float)
+        self._stage_runs = defaultdict(int)
+        self._bytes = defaultdict(int)
+
+    def __call__(self, job):
+        """
+        :param job: The finished upload job.
+        """
+        with self._lock:
+            self._jobs[job.status] += 1
+            for stage, seconds in job.metrics.timings.items():
+                self._stage_seconds[stage] += seconds
+                self._stage_runs[stage] += 1
+            for counter, amount in job.metrics.counters.items():
+                self._bytes[counter] += amount
+
+    def snapshot(self):
+        """
+        :return: A dictionary of all aggregated metrics so far.
+        """
+        with self._lock:
+            return {
+                'jobs': dict(self._jobs),
+                'stage_seconds': {stage: round(seconds, 6) for stage, seconds in self._stage_seconds.items()},
+                'stage_runs': dict(self._stage_runs),
+                'bytes': dict(self._bytes)
+            }
+
+
+class PrometheusTextfileExporter(MetricsAggregator):
+    """
+    A metrics hook which aggregates all reported jobs, and rewrites a Prometheus textfile (for node_exporter's textfile
+    collector) after each one. The counters start over whenever the process does.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The textfile path (should end with '.prom').
+        """
+        super().__init__()
+        self.path = path
+        self._write_lock = threading.Lock()
+
+    def __call__(self, job):
+        super().__call__(job)
+        snapshot = self.snapshot()
+        lines = [f'# TYPE {PROMETHEUS_PREFIX}_jobs_total counter']
+        lines += [f'{PROMETHEUS_PREFIX}_jobs_total{{status="{status}"}} {count}'
+                  for status, count in sorted(snapshot['jobs'].items())]
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_stage_seconds_total counter')
+        lines += [f'{PROMETHEUS_PREFIX}_stage_seconds_total{{stage="{stage}"}} {seconds}'
+                  for stage, seconds in sorted(snapshot['stage_seconds'].items())]
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_stage_runs_total counter')
+        lines += [f'{PROMETHEUS_PREFIX}_stage_runs_total{{stage="{stage}"}} {count}'
+                  for stage, count in sorted(snapshot['stage_runs'].items())]
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_bytes_total counter')
+        lines += [f'{PROMETHEUS_PREFIX}_bytes_total{{kind="{kind}"}} {amount}'
+                  for kind, amount in sorted(snapshot['bytes'].items())]
+        with self._write_lock:
+            # Replace the file atomically, so the collector never reads a partial one.
+            temp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w', encoding='UTF-8') as textfile:
+                textfile.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, self.path)
+
+
+class JsonLinesExporter(object):
+    """
+    A metrics hook which appends a JSON line with the metrics of every reported job.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The JSON-lines file path.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, job):
+        """
+        :param job: The finished upload job.
+        """
+        line = json.dumps(dict(job.metrics.to_dict(), time=time.time(), id=job.id, file_path=job.file_path,
+                               cloud_path=job.cloud_path, status=job.status, stage_strategy=job.stage_strategy,
+                               transfer_profile=job.transfer_profile))
+        with self._lock:
+            with open(self.path, 'a', encoding='UTF-8') as metrics_file:
+                metrics_file.write(line + '\n')
+
+
+class MetricsReporter(object):
+    """
+    Passes the metrics of every finished upload job to all registered hooks.
+    A hook is any callable which accepts a finished upload job (whose metrics are in job.metrics).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+
+    def add_hook(self, hook):
+        """
+        :param hook: The hook to register.
+        """
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        :param hook: The hook to unregister.
+        """
+        with self._lock:
+            self._hooks.remove(hook)
+
+    def report(self, jobs):
+        """
+        Report the given finished jobs to all hooks. Hook failures are logged, and never fail the upload.
+
+        :param jobs: The finished upload jobs.
+        """
+        with self._lock:
+            hooks = list(self._hooks)
+        for job in jobs:
+            timings = ', '.join(f'{stage}={seconds:.3f}s' for stage, seconds in job.metrics.timings.items())
+            logger.debug(f'Job metrics ({job.status}): {job.file_path}: {timings}')
+            for hook in hooks:
+                try:
+                    hook(job)
+                except Exception:
+                    logger.exception(f'Metrics hook failed: {hook!r}')
+
+
+def get_metrics_reporter():
+    """
+    :return: The metrics reporter shared by this process, with the configured exporters already registered.
+    """
+    global _metrics_reporter
+    with _metrics_reporter_lock:
+        if _metrics_reporter is None:
+            _metrics_reporter = MetricsReporter()
+            if config.METRICS_TEXTFILE_PATH:
+                _metrics_reporter.add_hook(PrometheusTextfileExporter(config.METRICS_TEXTFILE_PATH))
+            if config.METRICS_JSON_PATH:
+                _metrics_reporter.add_hook(JsonLinesExporter(config.METRICS_JSON_PATH))
+        return _metrics_reporter
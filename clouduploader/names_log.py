@@ -0,0 +1,117 @@
+from collections import deque
+import json
+import os
+
+import logbook
+
+from clouduploader import config
+
+# The amount of bytes read at once, when reading a file backwards.
+BLOCK_SIZE = 64 * 1024
+
+logger = logbook.Logger('NamesLog')
+
+
+def read_last_lines(path, count):
+    """
+    Read the last complete lines of the given file, by reading it backwards in blocks (so only its end is read).
+    A last line without a newline is still being written, so it's left out.
+
+    :param path: The file path.
+    :param count: The amount of lines to read.
+    :return: A tuple of format (lines, offset): the lines (oldest first), and the offset right after the last complete
+             line.
+    """
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        data = b''
+        # One extra newline is needed, for knowing where the first wanted line starts.
+        while position > 0 and data.count(b'\n') <= count:
+            read_size = min(BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    end = data.rfind(b'\n') + 1
+    offset = position + end
+    lines = data[:end].decode('UTF-8', errors='replace').splitlines()
+    # Without reaching the start of the file, the first line may be partial (it's dropped by the count limit).
+    return [line.strip() for line in lines[-count:] if line.strip()] if count else [], offset
+
+
+def read_new_lines(path, offset):
+    """
+    Read the complete lines appended to the given file since the given offset.
+
+    :param path: The file path.
+    :param offset: The offset to read from (right after a complete line).
+    :return: A tuple of format (lines, offset): the new lines (oldest first), and the offset right after the last
+             complete line.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('UTF-8', errors='replace').splitlines()
+    return [line.strip() for line in lines if line.strip()], offset + end
+
+
+def _load_checkpoint(checkpoint_path):
+    """
+    :param checkpoint_path: The checkpoint file path.
+    :return: The checkpoint dictionary, or None if there's no valid checkpoint.
+    """
+    try:
+        with open(checkpoint_path, 'r', encoding='UTF-8') as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Save the checkpoint atomically, so a crash never leaves a partial checkpoint behind.
+
+    :param checkpoint_path: The checkpoint file path.
+    :param checkpoint: The checkpoint dictionary.
+    """
+    temp_path = f'{checkpoint_path}.tmp'
+    with open(temp_path, 'w', encoding='UTF-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, checkpoint_path)
+
+
+def get_latest_names(count, log_path=None, checkpoint_path=None):
+    """
+    Get the latest original paths of the original names log.
+    A checkpoint keeps the latest paths and the offset they were read up to, so only lines appended since the previous
+    call are read. Without a (valid) checkpoint, only the end of the log is read.
+
+    :param count: The amount of paths (None for all of them).
+    :param log_path: The original names log path (defaults to the configured one).
+    :param checkpoint_path: The checkpoint file path (defaults to the configured one).
+    :return: A list of the latest original paths, from the oldest to the newest.
+    """
+    log_path = log_path or config.ORIGINAL_NAMES_LOG
+    checkpoint_path = checkpoint_path or config.NAMES_LOG_CHECKPOINT_PATH
+    if not count:
+        # Every path is needed anyway.
+        lines, _ = read_new_lines(log_path, 0)
+        return lines
+
+    log_stat = os.stat(log_path)
+    checkpoint = _load_checkpoint(checkpoint_path) if checkpoint_path else None
+    # A rotated (or truncated) log, or a different count, invalidates the checkpoint.
+    if checkpoint and checkpoint.get('inode') == log_stat.st_ino and checkpoint.get('count') == count and \
+            checkpoint.get('offset', 0) <= log_stat.st_size:
+        new_lines, offset = read_new_lines(log_path, checkpoint['offset'])
+        lines = list(deque(checkpoint['lines'] + new_lines, maxlen=count))
+        logger.debug(f'Read {len(new_lines)} new lines of the original names log.')
+    else:
+        lines, offset = read_last_lines(log_path, count)
+    if checkpoint_path:
+        try:
+            _save_checkpoint(checkpoint_path, {'inode': log_stat.st_ino, 'count': count, 'offset': offset,
+                                               'lines': lines})
+        except OSError:
+            logger.exception(f'Failed to save the original names log checkpoint: {checkpoint_path}')
+    return lines
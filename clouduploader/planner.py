@@ -0,0 +1,79 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+import logbook
+
+from clouduploader import config
+from clouduploader.uploader import _classify_file, _expand_paths
+
+# Smaller plans are classified in-process, since starting the pool would take longer.
+MIN_POOL_FILES = 200
+# Maximum amount of files sent to a worker process at once.
+MAX_CHUNK_SIZE = 500
+
+logger = logbook.Logger('UploadPlanner')
+
+
+def _get_settings():
+    """
+    :return: A dictionary of all current configuration settings (including ones changed at runtime).
+    """
+    return {name: value for name, value in vars(config).items() if name.isupper()}
+
+
+def _init_worker(settings):
+    """
+    Apply the parent's configuration settings to a worker process (which imports the configuration from scratch), and
+    silence its classification logs (its results are returned instead).
+
+    :param settings: The parent's configuration settings, as returned by _get_settings.
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+    logbook.NullHandler().push_application()
+
+
+def _classify_files(file_paths, workers):
+    """
+    Classify the given files, using a pool of worker processes for large amounts of files.
+
+    :param file_paths: The files to classify.
+    :param workers: The amount of worker processes.
+    :return: A list of tuples of format (cloud_dir, cloud_file, is_subtitles), in the same order as the files.
+    """
+    if workers <= 1 or len(file_paths) < MIN_POOL_FILES:
+        return [_classify_file(file_path) for file_path in file_paths]
+    chunk_size = max(1, min(MAX_CHUNK_SIZE, len(file_paths) // (workers * 4)))
+    logger.info(f'Classifying {len(file_paths)} files using {workers} processes...')
+    # Spawned (rather than forked) workers never inherit open guess cache connections.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(_get_settings(),)) as executor:
+        return list(executor.map(_classify_file, file_paths, chunksize=chunk_size))
+
+
+def plan_uploads(paths, workers=None):
+    """
+    Plan the upload of the given files (or directory trees), without touching them: find the cloud path every file
+    would be uploaded to, using the same classification as the uploader.
+
+    :param paths: The file and directory paths to plan.
+    :param workers: The amount of classification processes (defaults to the configured one, or one per CPU).
+    :return: A list of dictionaries (one per file), holding the file path, its cloud path (None if the file would be
+             skipped), whether it's a subtitles file and whether it's a valid path. Invalid paths are planned as skipped
+             files, after all others.
+    """
+    file_paths, invalid_paths = _expand_paths(paths)
+    workers = workers or config.PLAN_WORKERS or os.cpu_count() or 1
+    plan = []
+    for file_path, (cloud_dir, cloud_file, is_subtitles) in zip(file_paths, _classify_files(file_paths, workers)):
+        plan.append({
+            'file_path': file_path,
+            'cloud_path': os.path.join(cloud_dir, cloud_file) if cloud_dir and cloud_file else None,
+            'is_subtitles': is_subtitles,
+            'is_valid': True
+        })
+    for invalid_path in invalid_paths:
+        logger.warning(f'Invalid path given: {invalid_path}. Skipping!')
+        plan.append({'file_path': invalid_path, 'cloud_path': None, 'is_subtitles': False, 'is_valid': False})
+    return plan
@@ -0,0 +1,391 @@
+from collections import deque, namedtuple
+import json
+import os
+import subprocess
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# rclone's exit code for errors which are not otherwise categorised.
+RCLONE_GENERIC_ERROR = 2
+
+# How often to check a running rclone process for stalls, in seconds.
+STALL_CHECK_INTERVAL = 1
+STALLED_MESSAGE = 'Transfer stalled'
+
+# The result of a transfer. Failed paths are None if it's unknown which files failed.
+TransferResult = namedtuple('TransferResult', ['return_code', 'output', 'failed_paths'])
+# A live progress event of a transfer. Speed is in bytes/sec, and ETA is in seconds (None if unknown).
+TransferProgress = namedtuple('TransferProgress', ['bytes', 'total_bytes', 'speed', 'eta'])
+# Transfer parameters (see the tuning module). Chunk size is in rclone's size format (e.g. '64M').
+TransferProfile = namedtuple('TransferProfile', ['chunk_size', 'transfers', 'checkers', 'multi_thread_streams'])
+
+logger = logbook.Logger('Rclone')
+
+_rc_client = None
+_rc_client_lock = threading.Lock()
+
+
+def _parse_log_line(line):
+    """
+    Parse a single line of rclone's JSON log (see --use-json-log).
+
+    :param line: The log line.
+    :return: A tuple of format (output, progress). Stats lines only have a progress event, and all other lines only
+             have a readable output line (non-JSON lines are kept as is).
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return line, None
+    if not isinstance(record, dict):
+        return line, None
+    stats = record.get('stats')
+    if isinstance(stats, dict):
+        return None, TransferProgress(stats.get('bytes', 0), stats.get('totalBytes', 0), stats.get('speed', 0),
+                                      stats.get('eta'))
+    message = record.get('msg', '')
+    if record.get('object'):
+        message = f'{record["object"]}: {message}'
+    return f'{str(record.get("level", "info")).upper()}: {message}', None
+
+
+class _OutputReader(threading.Thread):
+    """
+    Reads an rclone process' output as it's produced: passes its stats to a progress callback, and keeps only its
+    latest lines (in a ring buffer) for error reporting.
+    """
+
+    def __init__(self, output_file, progress_callback=None):
+        """
+        :param output_file: The process' (text) output file.
+        :param progress_callback: An optional callable, called with a TransferProgress (from the reader thread) for
+                                  every stats line.
+        """
+        super().__init__(daemon=True)
+        self._output_file = output_file
+        self._progress_callback = progress_callback
+        self._lines = deque(maxlen=config.RCLONE_OUTPUT_LINES)
+        self._dropped_lines = 0
+        self._last_progress = None
+        # Stall detection only starts once the first stats line arrives (so it's never triggered without stats).
+        self.last_progress_time = None
+
+    def run(self):
+        for line in self._output_file:
+            output, progress = _parse_log_line(line.rstrip('\n'))
+            if output is not None:
+                if len(self._lines) == self._lines.maxlen:
+                    self._dropped_lines += 1
+                self._lines.append(output)
+            if progress:
+                if self._last_progress is None or progress.bytes != self._last_progress.bytes:
+                    self.last_progress_time = time.monotonic()
+                self._last_progress = progress
+                if self._progress_callback:
+                    try:
+                        self._progress_callback(progress)
+                    except Exception:
+                        logger.exception('Progress callback failed!')
+
+    @property
+    def output(self):
+        """
+        :return: The latest output lines.
+        """
+        lines = list(self._lines)
+        if self._dropped_lines:
+            lines.insert(0, f'... ({self._dropped_lines} earlier lines were dropped)')
+        return '\n'.join(lines)
+
+
+def get_profile_name(profile):
+    """
+    :param profile: A transfer profile.
+    :return: A short readable name of the profile, which identifies it.
+    """
+    return f'chunk={profile.chunk_size},transfers={profile.transfers},checkers={profile.checkers},' \
+           f'streams={profile.multi_thread_streams}'
+
+
+def _get_profile_arguments(profile):
+    """
+    :param profile: A transfer profile, or None for rclone's defaults.
+    :return: A list of rclone command line arguments, applying the profile.
+    """
+    if not profile:
+        return []
+    return ['--drive-chunk-size', profile.chunk_size, '--transfers', str(profile.transfers), '--checkers',
+            str(profile.checkers), '--multi-thread-streams', str(profile.multi_thread_streams)]
+
+
+def _copy_files_subprocess(upload_base_dir, gdrive_dir, upload_paths, work_dir, progress_callback=None,
+                           profile=None, bwlimit=None):
+    """
+    Copy the given files using a single rclone process, streaming its progress. A transfer which stops making
+    progress for too long is killed.
+
+    :param upload_base_dir: The local directory to copy from.
+    :param gdrive_dir: The Google Drive directory to copy to.
+    :param upload_paths: The file paths to copy, relative to the local directory.
+    :param work_dir: A work directory, for rclone's file lists.
+    :param progress_callback: An optional callable, called with a TransferProgress for every stats update.
+    :param profile: An optional transfer profile (rclone's defaults are used otherwise).
+    :param bwlimit: An optional bandwidth limit, in rclone's format (e.g. a timetable).
+    :return: The transfer result.
+    """
+    files_list_path = os.path.join(work_dir, 'files.txt')
+    errors_list_path = os.path.join(work_dir, 'errors.txt')
+    with open(files_list_path, 'w', encoding='UTF-8') as files_list:
+        files_list.writelines(upload_path + '\n' for upload_path in upload_paths)
+    if os.path.isfile(errors_list_path):
+        os.remove(errors_list_path)
+    # No shell is used, so killing the process (on a stall) kills rclone itself.
+    process = subprocess.Popen(
+        [config.RCLONE_PATH, '--config', config.RCLONE_CONFIG_PATH, 'copy', '--update', '--use-json-log',
+         '--stats', f'{config.RCLONE_STATS_INTERVAL}s', '--stats-log-level', 'NOTICE'] +
+        _get_profile_arguments(profile) + (['--bwlimit', bwlimit] if bwlimit else []) +
+        ['--files-from-raw', files_list_path, '--error', errors_list_path, upload_base_dir, f'GDrive:{gdrive_dir}'],
+        text=True, errors='replace', stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    reader = _OutputReader(process.stdout, progress_callback)
+    reader.start()
+
+    is_stalled = False
+    while True:
+        try:
+            return_code = process.wait(STALL_CHECK_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        if config.RCLONE_STALL_TIMEOUT and reader.last_progress_time and not is_stalled and \
+                time.monotonic() - reader.last_progress_time > config.RCLONE_STALL_TIMEOUT:
+            logger.error(f'No progress was made for {config.RCLONE_STALL_TIMEOUT} seconds! Killing rclone...')
+            is_stalled = True
+            process.kill()
+    reader.join()
+    process.stdout.close()
+
+    output = reader.output
+    if is_stalled:
+        # Stalls are reported as a generic error, so the transfer is retried.
+        return_code = RCLONE_GENERIC_ERROR
+        output += f'\n{STALLED_MESSAGE}: no progress for {config.RCLONE_STALL_TIMEOUT} seconds'
+    failed_paths = None
+    if return_code != 0 and os.path.isfile(errors_list_path):
+        with open(errors_list_path, 'r', encoding='UTF-8') as errors_list:
+            failed_paths = {line.rstrip('\n') for line in errors_list if line.strip()} or None
+    return TransferResult(return_code, output, failed_paths)
+
+
+class RcClient(object):
+    """
+    A client of a long-lived rclone remote control server ("rclone rcd"), which keeps its connections and OAuth tokens
+    between transfers.
+    """
+
+    def __init__(self, url=None, user=None, password=None):
+        """
+        :param url: The rc server URL (defaults to the configured one).
+        :param user: The rc server user name (defaults to the configured one).
+        :param password: The rc server password (defaults to the configured one).
+        """
+        import requests
+
+        self.url = (url or config.RCLONE_RC_URL).rstrip('/')
+        self._session = requests.Session()
+        user = user or config.RCLONE_RC_USER
+        if user:
+            self._session.auth = (user, password or config.RCLONE_RC_PASSWORD)
+
+    def call(self, command, **params):
+        """
+        Call an rc command.
+
+        :param command: The command name (e.g. 'operations/copyfile').
+        :param params: The command parameters.
+        :return: The command's response dictionary.
+        :raise requests.RequestException: If the server couldn't be reached.
+        :raise RuntimeError: If the command failed.
+        """
+        response = self._session.post(f'{self.url}/{command}', json=params, timeout=config.RCLONE_RC_TIMEOUT)
+        result = response.json()
+        if response.status_code != 200:
+            raise RuntimeError(result.get('error', f'Bad status code: {response.status_code}'))
+        return result
+
+    def _stop_jobs(self, jobs):
+        """
+        Stop the given rc jobs, ignoring any errors (they might have finished already, or the server may be gone).
+
+        :param jobs: The job IDs.
+        """
+        for job_id in jobs:
+            try:
+                self.call('job/stop', jobid=job_id)
+            except Exception:
+                logger.warning(f'Failed to stop rc job: {job_id}')
+
+    def copy_files(self, upload_base_dir, gdrive_dir, upload_paths, progress_callback=None, profile=None,
+                   bwlimit_rate=None):
+        """
+        Copy the given files using asynchronous rc jobs, polling them (and their progress) until they're done.
+
+        :param upload_base_dir: The local directory to copy from.
+        :param gdrive_dir: The Google Drive directory to copy to.
+        :param upload_paths: The file paths to copy, relative to the local directory.
+        :param progress_callback: An optional callable, called with a TransferProgress of all jobs on every poll.
+        :param profile: An optional transfer profile (the server's defaults are used otherwise).
+        :param bwlimit_rate: An optional bandwidth limit, as a single rate in rclone's format (applied to the whole
+                             server, until it's set again).
+        :return: The transfer result.
+        :raise requests.RequestException: If the server couldn't be reached (before any rc job was started).
+        """
+        import requests
+
+        if bwlimit_rate:
+            try:
+                self.call('core/bwlimit', rate=bwlimit_rate)
+            except RuntimeError:
+                logger.exception('Failed to set the rc server\'s bandwidth limit!')
+        remote = 'GDrive'
+        job_config = {'UpdateOlder': True}
+        if profile:
+            # The chunk size is a backend option, so it's given using a connection string.
+            remote = f'GDrive,chunk_size={profile.chunk_size}'
+            job_config.update(Transfers=profile.transfers, Checkers=profile.checkers,
+                              MultiThreadStreams=profile.multi_thread_streams)
+        jobs = {}
+        started_paths = set()
+        errors = {}
+        try:
+            for upload_path in upload_paths:
+                try:
+                    jobs[self.call('operations/copyfile', srcFs=upload_base_dir, srcRemote=upload_path,
+                                   dstFs=f'{remote}:{gdrive_dir}', dstRemote=upload_path, _async=True,
+                                   _config=job_config)['jobid']] = upload_path
+                    started_paths.add(upload_path)
+                except RuntimeError as e:
+                    errors[upload_path] = str(e)
+            self._poll_jobs(jobs, errors, progress_callback)
+        except (requests.RequestException, ValueError) as e:
+            if not started_paths:
+                # Nothing was started, so the files may be copied some other way.
+                raise
+            # Started jobs may still be running, so copying the files again some other way would upload them twice.
+            # Instead, they're stopped and reported as failed (along with the files which weren't started).
+            logger.exception('Lost the rclone rc server while copying! Stopping its jobs...')
+            self._stop_jobs(jobs)
+            for upload_path in (set(upload_paths) - started_paths) | set(jobs.values()):
+                errors.setdefault(upload_path, f'Lost the rc server: {e}')
+
+        if not errors:
+            return TransferResult(0, '', None)
+        output = '\n'.join(f'{upload_path}: {error}' for upload_path, error in errors.items())
+        return TransferResult(RCLONE_GENERIC_ERROR, output, set(errors))
+
+    def _poll_jobs(self, jobs, errors, progress_callback=None):
+        """
+        Poll the given rc jobs (and their progress) until they're done. Finished jobs are removed, and the errors of the
+        failed ones are added.
+
+        :param jobs: A dictionary between the started job IDs and their file paths.
+        :param errors: A dictionary between the failed file paths and their errors.
+        :param progress_callback: An optional callable, called with a TransferProgress of all jobs on every poll.
+        :raise requests.RequestException: If the server couldn't be reached.
+        """
+        last_bytes = None
+        last_progress_time = time.monotonic()
+        while jobs:
+            time.sleep(config.RCLONE_RC_POLL_INTERVAL)
+            progress = TransferProgress(0, 0, 0, 0)
+            for job_id, upload_path in list(jobs.items()):
+                try:
+                    status = self.call('job/status', jobid=job_id)
+                except RuntimeError as e:
+                    errors[upload_path] = str(e)
+                    del jobs[job_id]
+                    continue
+                if status.get('finished'):
+                    if not status.get('success'):
+                        errors[upload_path] = status.get('error') or 'Unknown error'
+                    del jobs[job_id]
+                    continue
+                try:
+                    stats = self.call('core/stats', group=f'job/{job_id}')
+                except RuntimeError:
+                    continue
+                # The jobs run in parallel, so the batch ETA is the one of the slowest job.
+                eta = None if stats.get('eta') is None or progress.eta is None else max(progress.eta, stats['eta'])
+                progress = TransferProgress(progress.bytes + stats.get('bytes', 0),
+                                            progress.total_bytes + stats.get('totalBytes', 0),
+                                            progress.speed + stats.get('speed', 0), eta)
+            if not jobs:
+                break
+            if progress_callback:
+                progress_callback(progress)
+            if progress.bytes != last_bytes:
+                last_bytes = progress.bytes
+                last_progress_time = time.monotonic()
+            elif config.RCLONE_STALL_TIMEOUT and time.monotonic() - last_progress_time > config.RCLONE_STALL_TIMEOUT:
+                logger.error(f'No progress was made for {config.RCLONE_STALL_TIMEOUT} seconds! Stopping rc jobs...')
+                self._stop_jobs(jobs)
+                for upload_path in jobs.values():
+                    errors[upload_path] = f'{STALLED_MESSAGE}: no progress for {config.RCLONE_STALL_TIMEOUT} seconds'
+                jobs.clear()
+
+
+def get_rc_client():
+    """
+    :return: The rc client shared by this process.
+    """
+    global _rc_client
+    with _rc_client_lock:
+        if _rc_client is None:
+            _rc_client = RcClient()
+        return _rc_client
+
+
+def copy_files(upload_base_dir, gdrive_dir, upload_paths, work_dir, progress_callback=None, profile=None,
+               bwlimit=None, bwlimit_rate=None):
+    """
+    Copy the given files to Google Drive, using the rc server if enabled and reachable, or an rclone process otherwise.
+
+    :param upload_base_dir: The local directory to copy from.
+    :param gdrive_dir: The Google Drive directory to copy to.
+    :param upload_paths: The file paths to copy, relative to the local directory.
+    :param work_dir: A work directory, for rclone's file lists.
+    :param progress_callback: An optional callable, called with a TransferProgress whenever progress is reported.
+    :param profile: An optional transfer profile (rclone's defaults are used otherwise).
+    :param bwlimit: An optional bandwidth limit of an rclone process, in rclone's format (e.g. a timetable).
+    :param bwlimit_rate: An optional bandwidth limit of the rc server, as a single rate in rclone's format.
+    :return: The transfer result.
+    """
+    if config.RCLONE_RC_URL:
+        # requests is only imported when the rc server is enabled.
+        import requests
+
+        try:
+            return get_rc_client().copy_files(upload_base_dir, gdrive_dir, upload_paths, progress_callback, profile,
+                                              bwlimit_rate)
+        except (requests.RequestException, ValueError):
+            logger.exception('Failed to reach the rclone rc server. Falling back to an rclone process...')
+    return _copy_files_subprocess(upload_base_dir, gdrive_dir, upload_paths, work_dir, progress_callback, profile,
+                                  bwlimit)
+
+
+def list_files(remote_path):
+    """
+    List all files under the given remote path recursively, using a single rclone process.
+
+    :param remote_path: The remote path, in rclone's format (e.g. 'Remote:Media').
+    :return: A list of the file paths, relative to the remote path.
+    :raise subprocess.CalledProcessError: If rclone failed.
+    """
+    process = subprocess.run(
+        [config.RCLONE_PATH, '--config', config.RCLONE_CONFIG_PATH, 'lsjson', '--recursive', '--files-only',
+         '--no-modtime', '--no-mimetype', remote_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return [entry['Path'] for entry in json.loads(process.stdout)]
@@ -0,0 +1,159 @@
+import random
+import re
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# Failure types.
+FAILURE_RATE_LIMITED = 'rate-limited'
+FAILURE_QUOTA_EXCEEDED = 'quota-exceeded'
+FAILURE_TRANSIENT = 'transient'
+FAILURE_PERMANENT = 'permanent'
+
+# rclone exit codes (see https://rclone.org/docs/#exit-code).
+RCLONE_SYNTAX_ERROR = 1
+RCLONE_DIRECTORY_NOT_FOUND = 3
+RCLONE_FILE_NOT_FOUND = 4
+RCLONE_TEMPORARY_ERROR = 5
+RCLONE_FATAL_ERROR = 7
+RCLONE_TRANSFER_EXCEEDED = 8
+PERMANENT_EXIT_CODES = [RCLONE_SYNTAX_ERROR, RCLONE_DIRECTORY_NOT_FOUND, RCLONE_FILE_NOT_FOUND, RCLONE_FATAL_ERROR]
+
+# Output patterns, checked in this order (quota errors are reported as 403 errors as well).
+QUOTA_EXCEEDED_PATTERN = re.compile(
+    r'quotaExceeded|storageQuotaExceeded|dailyLimitExceeded|teamDriveFileLimitExceeded|'
+    r'upload limit|max transfer limit reached', re.IGNORECASE)
+RATE_LIMITED_PATTERN = re.compile(
+    r'rateLimitExceeded|userRateLimitExceeded|rate limit|too many requests|Error 403|Error 429|status(?: code)? 429',
+    re.IGNORECASE)
+TRANSIENT_PATTERN = re.compile(
+    r'connection reset|connection refused|timeout|timed out|temporary failure|no such host|unexpected EOF|'
+    r'TLS handshake|broken pipe|Error 5\d\d|status(?: code)? 5\d\d|Transfer stalled', re.IGNORECASE)
+
+logger = logbook.Logger('RetryPolicy')
+
+_retry_policy = None
+_retry_policy_lock = threading.Lock()
+
+
+def classify_failure(return_code, output):
+    """
+    Classify an rclone failure by its exit code and output.
+
+    :param return_code: The rclone exit code.
+    :param output: The rclone output.
+    :return: The failure type.
+    """
+    output = output or ''
+    if return_code == RCLONE_TRANSFER_EXCEEDED or QUOTA_EXCEEDED_PATTERN.search(output):
+        return FAILURE_QUOTA_EXCEEDED
+    if RATE_LIMITED_PATTERN.search(output):
+        return FAILURE_RATE_LIMITED
+    if return_code == RCLONE_TEMPORARY_ERROR or TRANSIENT_PATTERN.search(output):
+        return FAILURE_TRANSIENT
+    if return_code in PERMANENT_EXIT_CODES:
+        return FAILURE_PERMANENT
+    # Unknown errors might go away, so they're retried.
+    return FAILURE_TRANSIENT
+
+
+class RetryPolicy(object):
+    """
+    Decides whether (and when) to retry failed transfers, using exponential backoff with full jitter.
+    Permanent and quota errors fail fast. Retries of all concurrent jobs share a single budget, and a rate limit hit by
+    one job holds back the next attempts of all jobs.
+    """
+
+    def __init__(self, max_tries=None, base_delay=None, max_delay=None, rate_limit_delay=None, budget=None,
+                 budget_refill_seconds=None):
+        """
+        :param max_tries: The maximum amount of attempts per transfer (defaults to the configured one).
+        :param base_delay: The first backoff delay, in seconds (defaults to the configured one).
+        :param max_delay: The maximum backoff delay, in seconds (defaults to the configured one).
+        :param rate_limit_delay: The first backoff delay after hitting a rate limit, in seconds (defaults to the
+                                 configured one).
+        :param budget: The maximum amount of retries saved up in the shared budget (defaults to the configured one).
+        :param budget_refill_seconds: The amount of seconds it takes to earn a single retry back (defaults to the
+                                      configured one).
+        """
+        self.max_tries = max_tries or config.MAX_UPLOAD_TRIES
+        self.base_delay = base_delay or config.RETRY_BASE_DELAY
+        self.max_delay = max_delay or config.RETRY_MAX_DELAY
+        self.rate_limit_delay = rate_limit_delay or config.RATE_LIMIT_BASE_DELAY
+        self.budget = budget or config.RETRY_BUDGET
+        self.budget_refill_seconds = budget_refill_seconds or config.RETRY_BUDGET_REFILL_SECONDS
+        self._lock = threading.Lock()
+        self._tokens = float(self.budget)
+        self._tokens_time = time.monotonic()
+        self._blocked_until = 0
+
+    def _refill(self):
+        """
+        Earn back retries for the time passed since the last refill.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.budget, self._tokens + (now - self._tokens_time) / self.budget_refill_seconds)
+        self._tokens_time = now
+
+    def wait_for_window(self):
+        """
+        Block until no rate limit window is active.
+        """
+        while True:
+            with self._lock:
+                delay = self._blocked_until - time.monotonic()
+            if delay <= 0:
+                return
+            logger.info(f'Waiting {delay:.1f} seconds for the rate limit window to end...')
+            time.sleep(delay)
+
+    def should_retry(self, failure, attempt):
+        """
+        Decide whether to retry a failed transfer, spending a retry from the shared budget if so.
+
+        :param failure: The failure type.
+        :param attempt: The number of attempts made so far.
+        :return: True if the transfer should be retried, and False otherwise.
+        """
+        if failure in (FAILURE_PERMANENT, FAILURE_QUOTA_EXCEEDED):
+            return False
+        if attempt >= self.max_tries:
+            return False
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                logger.warning('Retry budget is exhausted!')
+                return False
+            self._tokens -= 1
+            return True
+
+    def backoff(self, failure, attempt):
+        """
+        Compute the delay before the next attempt. Rate limits hold back all jobs until the delay is over.
+
+        :param failure: The failure type.
+        :param attempt: The number of attempts made so far.
+        :return: The delay, in seconds.
+        """
+        base_delay = self.rate_limit_delay if failure == FAILURE_RATE_LIMITED else self.base_delay
+        delay = random.uniform(0, min(self.max_delay, base_delay * 2 ** (attempt - 1)))
+        if failure == FAILURE_RATE_LIMITED:
+            # Never go below the base delay, since rate limit windows take a while to end.
+            delay = max(delay, base_delay)
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+
+def get_retry_policy():
+    """
+    :return: The retry policy shared by all transfers of this process.
+    """
+    global _retry_policy
+    with _retry_policy_lock:
+        if _retry_policy is None:
+            _retry_policy = RetryPolicy()
+        return _retry_policy
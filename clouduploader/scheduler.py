@@ -0,0 +1,164 @@
+from concurrent.futures import Future
+from collections import Counter
+from contextlib import contextmanager
+import threading
+
+import logbook
+
+from clouduploader import config
+from clouduploader.bandwidth import get_bandwidth_scheduler
+from clouduploader.upload_queue import UploadQueue
+
+logger = logbook.Logger('UploadScheduler')
+
+
+class UploadScheduler(object):
+    """
+    A pool of upload workers with bounded parallelism, fed by a persistent priority queue (see the upload_queue module).
+    Local staging I/O and remote transfers have separate limits, and every destination (cloud directory) has its own
+    transfer limit, so a single huge upload can't hold up everything behind it.
+    Submissions the bandwidth scheduler defers are returned to the queue before they're staged, so they never hold a
+    worker.
+    """
+
+    def __init__(self, workers=None, staging_limit=None, transfer_limit=None, destination_limit=None,
+                 upload_queue=None):
+        """
+        :param workers: The amount of worker threads (defaults to the configured one).
+        :param staging_limit: The maximum amount of files staged at the same time (defaults to the configured one).
+        :param transfer_limit: The maximum amount of concurrent transfers (defaults to the configured one).
+        :param destination_limit: The maximum amount of concurrent transfers to a single destination (defaults to the
+                                  configured one).
+        :param upload_queue: The submissions queue (defaults to the configured one).
+        """
+        self.workers = workers or config.UPLOAD_WORKERS
+        self.staging_limit = staging_limit or config.STAGING_LIMIT
+        self.transfer_limit = transfer_limit or config.TRANSFER_LIMIT
+        self.destination_limit = destination_limit or config.DESTINATION_TRANSFER_LIMIT
+        self._queue = upload_queue or UploadQueue()
+        # Futures of the queued submissions, by submission ID (restored submissions have none).
+        self._futures = {}
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._staging = 0
+        self._transfers = 0
+        self._destinations = Counter()
+        self._threads = []
+
+    def start(self):
+        """
+        Start all worker threads.
+        """
+        for worker_index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'UploadWorker-{worker_index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop all worker threads, after the queued uploads are done.
+        """
+        self._queue.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, file_paths, priority=0):
+        """
+        Queue the given files for upload.
+
+        :param file_paths: The files to upload (as a single batch).
+        :param priority: An explicit priority (lower goes first), added to the one of the files' type and size.
+        :return: A future, resolving to the list of upload jobs.
+        """
+        future = Future()
+        # The future is registered before the submission is queued, so a worker can never miss it.
+        with self._condition:
+            submission_id = self._queue.put(file_paths, priority)
+            self._futures[submission_id] = future
+        return future
+
+    def _work(self):
+        """
+        Upload queued batches until stopped.
+        """
+        from clouduploader.uploader import upload_files
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            submission_id, file_paths = item
+            bandwidth = get_bandwidth_scheduler()
+            delay = bandwidth.get_deferral(submission_id, file_paths) if bandwidth else 0
+            if delay:
+                self._queue.defer(submission_id, delay)
+                continue
+            with self._condition:
+                future = self._futures.pop(submission_id, None) or Future()
+            if future.set_running_or_notify_cancel():
+                with self._condition:
+                    self._in_flight += 1
+                try:
+                    future.set_result(upload_files(file_paths, scheduler=self))
+                except Exception as e:
+                    # Catch all exceptions so the worker won't stop.
+                    logger.exception(f'Failed to upload: {file_paths}')
+                    future.set_exception(e)
+                finally:
+                    with self._condition:
+                        self._in_flight -= 1
+            self._queue.done(submission_id)
+
+    @contextmanager
+    def staging_slot(self):
+        """
+        Hold a local staging slot for the duration of the context.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._staging < self.staging_limit)
+            self._staging += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._staging -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def transfer_slot(self, destinations):
+        """
+        Hold a remote transfer slot for the given destinations for the duration of the context.
+        All destinations are acquired at once, so batches with several destinations can't deadlock.
+
+        :param destinations: The destinations (cloud directories) of the transferred files.
+        """
+        destinations = set(destinations)
+        with self._condition:
+            self._condition.wait_for(lambda: self._transfers < self.transfer_limit and all(
+                self._destinations[d] < self.destination_limit for d in destinations))
+            self._transfers += 1
+            self._destinations.update(destinations)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._transfers -= 1
+                self._destinations.subtract(destinations)
+                self._destinations += Counter()
+                self._condition.notify_all()
+
+    def stats(self):
+        """
+        :return: A dictionary of the current queue depth and in-flight counts.
+        """
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue': self._queue.stats(),
+                'in_flight': self._in_flight,
+                'staging': self._staging,
+                'transfers': self._transfers,
+                'destinations': dict(self._destinations)
+            }
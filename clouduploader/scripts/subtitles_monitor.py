@@ -1,36 +1,63 @@
 #!/usr/local/bin/python3
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 import datetime
 import os
+import sqlite3
+import subprocess
 import sys
+import threading
 import time
 
-import babelfish
-from guessit import guessit
 import logbook
-from plexapi.server import PlexServer
-import requests
-from showsformatter import format_show
-import subliminal
-from subliminal.cache import region
-from subliminal.subtitle import get_subtitle_path
 
 from clouduploader import config
+from clouduploader.cache import cached_guessit
+from clouduploader.catalog import get_upload_catalog
+from clouduploader.daemon import submit
+from clouduploader.names_log import get_latest_names
 from clouduploader.uploader import guess_path, upload_file
 
-# Ignore SSL warnings.
-requests.packages.urllib3.disable_warnings()
-
 # Directories settings.
 MEDIA_ROOT_PATH = '/app/rclone/gdrive_decrypted'
+# The rclone remote path mounted at MEDIA_ROOT_PATH (e.g. 'GDriveDecrypted:'). If set, files are looked up in a single
+# recursive listing of it, instead of listing every directory through the mount (None).
+MEDIA_ROOT_REMOTE = None
 TEMP_PATH = '/tmp'
-# A map between each language and its favorite subliminal providers (None for all providers).
+# A map between each language (alpha3 code) and its favorite subliminal providers (None for all providers).
 PROVIDERS_MAP = {
-    babelfish.Language('heb'): ['wizdom'],
-    babelfish.Language('eng'): None
+    'heb': ['wizdom'],
+    'eng': None
 }
 # A map between each provider and its credentials.
 PROVIDER_CONFIGS = {}
+# A map between each provider and its limits, as a tuple of format (concurrent searches, minimum seconds between the
+# starts of searches). Providers which aren't listed use DEFAULT_PROVIDER_LIMITS.
+PROVIDER_LIMITS = {
+    'wizdom': (2, 1)
+}
+DEFAULT_PROVIDER_LIMITS = (4, 0)
+
+# The amount of concurrent subtitles searches.
+SEARCH_WORKERS = 8
+# The amount of background workers uploading found subtitles (and refreshing Plex afterwards).
+UPLOAD_WORKERS = 2
+# The time to wait after uploading subtitles before refreshing Plex, in seconds.
+PLEX_REFRESH_DELAY = 5
+
+# A persistent subliminal cache (a dbm file), so provider lookups survive between runs (None keeps it in memory only).
+SUBTITLES_CACHE_PATH = '/mnt/vdb/subliminal_cache.dbm'
+SUBTITLES_CACHE_EXPIRATION = datetime.timedelta(days=7)
+# A ledger of searches which found no subtitles, used for spacing out repeated searches (None disables it).
+# Every fruitless search doubles the time until the next one, from NOT_FOUND_INITIAL_BACKOFF up to NOT_FOUND_MAX_BACKOFF
+# (in seconds), so new releases are searched often while old ones stop using the providers' quota.
+NOT_FOUND_LEDGER_PATH = '/mnt/vdb/subtitles_not_found.db'
+NOT_FOUND_INITIAL_BACKOFF = 6 * 60 * 60
+NOT_FOUND_MAX_BACKOFF = 30 * 24 * 60 * 60
+
+# Subtitles are submitted to the upload daemon with this priority (lower goes first), so they skip queued videos.
+SUBTITLES_UPLOAD_PRIORITY = -10
 
 # The monitor will look only at the latest X files (or all of them if RESULTS_LIMIT is None).
 RESULTS_LIMIT = 1000
@@ -61,7 +88,148 @@ def configure_subtitles_cache():
     Configure the subliminal cache settings.
     Should be called once when the program starts.
     """
-    region.configure('dogpile.cache.memory', expiration_time=datetime.timedelta(days=7))
+    from subliminal.cache import region
+
+    if SUBTITLES_CACHE_PATH:
+        os.makedirs(os.path.dirname(SUBTITLES_CACHE_PATH) or '.', exist_ok=True)
+        region.configure('dogpile.cache.dbm', expiration_time=SUBTITLES_CACHE_EXPIRATION,
+                         arguments={'filename': SUBTITLES_CACHE_PATH})
+    else:
+        region.configure('dogpile.cache.memory', expiration_time=SUBTITLES_CACHE_EXPIRATION)
+
+
+class DirectoryIndex(object):
+    """
+    An in-memory index of the files under the media root, for existence checks without a stat (which may be a remote
+    round trip on the rclone mount) per file.
+    Every directory is listed once, when first needed, or the whole tree is listed at once using rclone.
+    """
+
+    def __init__(self, root_path=None, remote_path=None):
+        """
+        :param root_path: The media root path (defaults to MEDIA_ROOT_PATH).
+        :param remote_path: The rclone remote path mounted at the media root (defaults to MEDIA_ROOT_REMOTE, None
+                            lists the directories through the mount).
+        """
+        self.root_path = root_path or MEDIA_ROOT_PATH
+        self.remote_path = remote_path or MEDIA_ROOT_REMOTE
+        # The file names of every listed directory (relative to the root), or None if it doesn't exist.
+        self._directories = {}
+        self._is_snapshot = False
+        self.listings = 0
+        if self.remote_path:
+            self._load_snapshot()
+
+    def _load_snapshot(self):
+        """
+        Index the whole tree, using a single recursive rclone listing.
+        """
+        from clouduploader import rclone
+
+        try:
+            file_paths = rclone.list_files(self.remote_path)
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            logger.exception(f'Failed to list {self.remote_path}. Listing the directories through the mount...')
+            return
+        directories = defaultdict(set)
+        for file_path in file_paths:
+            directory, file_name = os.path.split(file_path)
+            directories[directory].add(file_name)
+        self._directories = dict(directories)
+        self._is_snapshot = True
+        self.listings = 1
+        logger.info(f'Indexed {len(file_paths)} files in {len(directories)} directories of {self.remote_path}')
+
+    def _list(self, directory):
+        """
+        :param directory: A directory path, relative to the root.
+        :return: A set of the directory's file names, or None if it doesn't exist.
+        """
+        if directory not in self._directories:
+            if self._is_snapshot:
+                # The snapshot holds every directory with files.
+                return None
+            self.listings += 1
+            try:
+                with os.scandir(os.path.join(self.root_path, directory)) as entries:
+                    self._directories[directory] = {entry.name for entry in entries if entry.is_file()}
+            except (FileNotFoundError, NotADirectoryError):
+                self._directories[directory] = None
+        return self._directories[directory]
+
+    def exists(self, file_path):
+        """
+        :param file_path: A file path under the root.
+        :return: True if the file exists (as of its directory's listing), and False otherwise.
+        """
+        directory, file_name = os.path.split(os.path.relpath(file_path, self.root_path))
+        file_names = self._list(directory)
+        return file_names is not None and file_name in file_names
+
+
+class NotFoundLedger(object):
+    """
+    A persistent (SQLite) ledger of searches which found no subtitles, by video and language.
+    Searches are spaced out with a capped exponential backoff, and a video's entry is removed once its subtitles are
+    found.
+    """
+
+    def __init__(self, path=None, initial_backoff=None, max_backoff=None):
+        """
+        :param path: The ledger file path (defaults to NOT_FOUND_LEDGER_PATH).
+        :param initial_backoff: The time until the search after the first fruitless one, in seconds (defaults to
+                                NOT_FOUND_INITIAL_BACKOFF).
+        :param max_backoff: The maximum time between searches, in seconds (defaults to NOT_FOUND_MAX_BACKOFF).
+        """
+        self.path = path or NOT_FOUND_LEDGER_PATH
+        self.initial_backoff = initial_backoff or NOT_FOUND_INITIAL_BACKOFF
+        self.max_backoff = max_backoff or NOT_FOUND_MAX_BACKOFF
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS not_found (video TEXT, language TEXT, attempts INTEGER, '
+                                 'searched REAL, next_search REAL, PRIMARY KEY (video, language))')
+        self._connection.commit()
+
+    def should_search(self, video, language):
+        """
+        :param video: The video's cloud path.
+        :param language: The language's alpha3 code.
+        :return: True if the video's subtitles in the given language should be searched now, and False otherwise.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT next_search FROM not_found WHERE video = ? AND language = ?',
+                                           (video, language)).fetchone()
+        return row is None or row[0] <= time.time()
+
+    def record(self, video, language, is_found):
+        """
+        Record a search's result.
+
+        :param video: The video's cloud path.
+        :param language: The language's alpha3 code.
+        :param is_found: Whether subtitles were found.
+        """
+        now = time.time()
+        with self._lock:
+            if is_found:
+                self._connection.execute('DELETE FROM not_found WHERE video = ? AND language = ?', (video, language))
+            else:
+                row = self._connection.execute('SELECT attempts FROM not_found WHERE video = ? AND language = ?',
+                                               (video, language)).fetchone()
+                attempts = (row[0] if row else 0) + 1
+                backoff = min(self.initial_backoff * 2 ** min(attempts - 1, 32), self.max_backoff)
+                self._connection.execute('INSERT OR REPLACE INTO not_found (video, language, attempts, searched, '
+                                         'next_search) VALUES (?, ?, ?, ?, ?)',
+                                         (video, language, attempts, now, now + backoff))
+            self._connection.commit()
+
+    def close(self):
+        """
+        Close the ledger.
+        """
+        with self._lock:
+            self._connection.close()
 
 
 def refresh_plex_item(title, season=None, episodes=None):
@@ -72,6 +240,12 @@ def refresh_plex_item(title, season=None, episodes=None):
     :param season: The season number.
     :param episodes: The episode numbers list.
     """
+    # The Plex API is only needed (and imported) once subtitles were actually found.
+    from plexapi.server import PlexServer
+    import requests
+
+    # Ignore SSL warnings.
+    requests.packages.urllib3.disable_warnings()
     logger.info('Updating Plex...')
     is_episode = season is not None and episodes is not None
     for base_url, token in config.PLEX_SERVERS:
@@ -94,143 +268,378 @@ def refresh_plex_item(title, season=None, episodes=None):
                     title, episode_details if is_episode else ''))
 
 
-def find_file_subtitles(original_path, current_path, language):
+def upload_subtitles(subtitles_path):
+    """
+    Upload the given subtitles file, using the upload daemon if it's running (ahead of queued videos), or directly
+    otherwise.
+
+    :param subtitles_path: The subtitles file path.
+    """
+    try:
+        response = submit([subtitles_path], wait=True, priority=SUBTITLES_UPLOAD_PRIORITY)
+    except OSError:
+        upload_file(subtitles_path)
+        return
+    if 'error' in response:
+        logger.error(f'Upload daemon error: {response["error"]}')
+
+
+class ProviderLimiter(object):
+    """
+    Limits the concurrent searches and the search rate of every subliminal provider, across all search threads.
+    """
+
+    def __init__(self, limits=None, default_limits=None):
+        """
+        :param limits: A map between each provider and its limits (defaults to PROVIDER_LIMITS).
+        :param default_limits: The limits of providers which aren't in the map (defaults to DEFAULT_PROVIDER_LIMITS).
+        """
+        self.limits = PROVIDER_LIMITS if limits is None else limits
+        self.default_limits = default_limits or DEFAULT_PROVIDER_LIMITS
+        self._condition = threading.Condition()
+        self._searches = Counter()
+        self._last_started = {}
+
+    def _get_wait(self, providers, now):
+        """
+        :param providers: The providers of a search.
+        :param now: The current monotonic time.
+        :return: The time to wait until the search may start, in seconds (0 if it may start now), or None if one of
+                 the providers has no free search.
+        """
+        wait = 0
+        for provider in providers:
+            concurrency, interval = self.limits.get(provider, self.default_limits)
+            if self._searches[provider] >= concurrency:
+                return None
+            wait = max(wait, self._last_started.get(provider, -interval) + interval - now)
+        return wait
+
+    @contextmanager
+    def search(self, providers):
+        """
+        Hold a search of the given providers for the duration of the context.
+        All providers are acquired at once, so searches of several providers can't deadlock.
+
+        :param providers: The providers of the search.
+        """
+        providers = set(providers)
+        with self._condition:
+            while True:
+                wait = self._get_wait(providers, time.monotonic())
+                if wait is not None and wait <= 0:
+                    break
+                self._condition.wait(wait)
+            now = time.monotonic()
+            for provider in providers:
+                self._searches[provider] += 1
+                self._last_started[provider] = now
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._searches.subtract(providers)
+                self._condition.notify_all()
+
+
+def get_language_providers(language):
+    """
+    :param language: A subtitles language.
+    :return: A list of the providers to search the given language with (subliminal's default providers, unless the
+             language has its own).
+    """
+    from subliminal.extensions import get_default_providers
+
+    return PROVIDERS_MAP.get(language.alpha3) or get_default_providers()
+
+
+def get_provider_languages(languages):
+    """
+    :param languages: The subtitles languages to search for.
+    :return: A dictionary between each provider and the languages to search it for.
+    """
+    provider_languages = defaultdict(set)
+    for language in languages:
+        for provider in get_language_providers(language):
+            provider_languages[provider].add(language)
+    return dict(provider_languages)
+
+
+class ProviderPools(object):
+    """
+    Long-lived subliminal provider pools, one for every group of providers, so every provider logs in once per run
+    (instead of once per search).
+    Provider sessions aren't thread safe, so every search thread has pools of its own.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pools = []
+
+    def get(self, providers):
+        """
+        :param providers: The group of providers.
+        :return: The calling thread's pool of the given providers.
+        """
+        from subliminal import ProviderPool
+
+        if not hasattr(self._local, 'pools'):
+            self._local.pools = {}
+        providers = frozenset(providers)
+        if providers not in self._local.pools:
+            pool = ProviderPool(providers=sorted(providers), provider_configs=PROVIDER_CONFIGS)
+            self._local.pools[providers] = pool
+            with self._lock:
+                self._pools.append(pool)
+        return self._local.pools[providers]
+
+    def terminate(self):
+        """
+        Log out of all providers of all pools.
+        Should be called once all searches are done.
+        """
+        with self._lock:
+            pools, self._pools = self._pools, []
+        for pool in pools:
+            pool.terminate()
+
+
+def find_video_subtitles(original_path, current_path, languages, pools, limiter=None):
     """
-    Finds subtitles for the given video file path in the given language.
-    Downloaded subtitles will be saved next to the video file.
+    Finds subtitles for the given video file path in all the given languages at once: every provider is queried once,
+    for all the languages it's used for.
+    Downloaded subtitles will be saved in the temporary directory (in order to be uploaded next to the video file).
 
     :param original_path: The original path of the video file to find subtitles to.
     :param current_path: The current video path (to save the subtitles file next to).
-    :param language: The language to search for.
-    :return: The subtitles file path, or None if a problem occurred.
+    :param languages: The languages to search for.
+    :param pools: The provider pools to search through.
+    :param limiter: The provider limiter to search through (None for no limits).
+    :return: A list of tuples of format (language, subtitles file path, or None if none were found), or None if the
+             search failed. Languages which weren't found, and weren't searched by every one of their providers (due to
+             a provider outage), are left out.
     """
-    logger.info('Searching {} subtitles for file: {}'.format(language.alpha3, original_path))
+    import subliminal
+    from subliminal.subtitle import get_subtitle_path
+
+    original_file_name = os.path.basename(original_path)
+    logger.info('Searching {} subtitles for file: {}'.format(
+        ', '.join(sorted(language.alpha3 for language in languages)), original_path))
+    results = []
     try:
-        subtitles_result = None
-        original_file_name = os.path.basename(original_path)
         # Get required video information.
-        video = subliminal.Video.fromguess(current_path, guessit(original_file_name))
+        video = subliminal.Video.fromguess(current_path, cached_guessit(original_file_name))
         # Try using providers specified by the user.
-        providers = PROVIDERS_MAP.get(language)
-        current_result = subliminal.download_best_subtitles(
-            {video}, languages={language}, providers=providers, provider_configs=PROVIDER_CONFIGS).values()
-        if current_result:
-            current_result = list(current_result)[0]
-            if current_result:
-                subtitles_result = current_result[0]
-        # Handle results.
-        if not subtitles_result:
-            logger.info('No subtitles were found. Moving on...')
-        else:
-            logger.info('Subtitles found! Saving files...')
-            # Save subtitles alongside the video file (if they're not empty).
-            if subtitles_result.content is None:
-                logger.debug(f'Skipping subtitle {subtitles_result}: no content')
-            else:
-                subtitles_file_name = get_subtitle_path(original_file_name, subtitles_result.language)
-                subtitles_path = os.path.join(TEMP_PATH, subtitles_file_name)
-                logger.info(f'Saving {subtitles_result} to: {subtitles_path}')
-                try:
-                    open(subtitles_path, 'wb').write(subtitles_result.content)
-                    logger.info(f'Uploading {subtitles_path}')
-                    try:
-                        upload_file(subtitles_path)
-                    except Exception:
-                        # Catch all exceptions so the script won't stop.
-                        logger.exception(f'Failed to upload file: {subtitles_path}')
-                except OSError:
-                    logger.error(f'Failed to save subtitles in path: {subtitles_path}')
-                return subtitles_path
-        return None
+        provider_languages = get_provider_languages(languages)
+        pool = pools.get(provider_languages)
+        subtitles = []
+        unsearched_languages = set()
+        for provider in sorted(provider_languages):
+            if provider in pool.discarded_providers:
+                unsearched_languages.update(provider_languages[provider])
+                continue
+            with limiter.search([provider]) if limiter else nullcontext():
+                provider_result = pool.list_subtitles_provider(provider, video, provider_languages[provider])
+            if provider_result.outage():
+                logger.info(f'Discarding provider {provider}')
+                pool.discarded_providers.add(provider)
+                pool.failed_providers.add(provider)
+                unsearched_languages.update(provider_languages[provider])
+                continue
+            subtitles.extend(provider_result.subtitles)
+        best_subtitles = []
+        if subtitles:
+            with limiter.search({s.provider_name for s in subtitles}) if limiter else nullcontext():
+                best_subtitles = pool.download_best_subtitles(subtitles, video, set(languages))
     except ValueError:
         # Subliminal raises a ValueError if the given file is not a video file.
         logger.info('Not a video file. Moving on...')
+        return None
     except Exception:
         logger.exception('Error in Subliminal. Moving on...')
+        return None
+
+    # Handle results.
+    for language in languages:
+        subtitles_result = next((s for s in best_subtitles if s.language == language), None)
+        if not subtitles_result and language in unsearched_languages:
+            # Not every provider answered, so this isn't a "not found" result.
+            logger.info(f'{language.alpha3} subtitles were not searched by every provider for: {original_file_name}')
+        elif not subtitles_result:
+            logger.info(f'No {language.alpha3} subtitles were found for: {original_file_name}')
+            results.append((language, None))
+        elif subtitles_result.content is None:
+            # Save subtitles only if they're not empty.
+            logger.debug(f'Skipping subtitle {subtitles_result}: no content')
+        else:
+            subtitles_file_name = get_subtitle_path(original_file_name, subtitles_result.language)
+            subtitles_path = os.path.join(TEMP_PATH, subtitles_file_name)
+            logger.info(f'Saving {subtitles_result} to: {subtitles_path}')
+            try:
+                with open(subtitles_path, 'wb') as subtitles_file:
+                    subtitles_file.write(subtitles_result.content)
+                results.append((language, subtitles_path))
+            except OSError:
+                logger.error(f'Failed to save subtitles in path: {subtitles_path}')
+    return results
+
+
+def _get_plex_item(video_details):
+    """
+    :param video_details: The video's parsed name details.
+    :return: A tuple of format (title, season, episodes) of the video's Plex item.
+    """
+    from showsformatter import format_show
+
+    title = video_details['title']
+    season = video_details.get('season')
+    episode = video_details.get('episode')
+    if isinstance(title, list):
+        title = title[0]
+    # Use the best show title available.
+    if season and episode:
+        title = format_show(title)
+    else:
+        title = title.title()
+    return title, season, [episode] if not isinstance(episode, list) else episode
+
+
+def upload_and_refresh(subtitles_path, video_details):
+    """
+    Upload the given subtitles file, and refresh its video's Plex item (after waiting some time for the file to show
+    up). Runs in a background worker, so searches don't wait for it.
+
+    :param subtitles_path: The subtitles file path.
+    :param video_details: The video's parsed name details.
+    """
+    logger.info(f'Uploading {subtitles_path}')
+    try:
+        upload_subtitles(subtitles_path)
+    except Exception:
+        # Catch all exceptions so the worker won't stop.
+        logger.exception(f'Failed to upload file: {subtitles_path}')
+    if config.PLEX_SERVERS:
+        try:
+            time.sleep(PLEX_REFRESH_DELAY)
+            refresh_plex_item(*_get_plex_item(video_details))
+        except Exception:
+            logger.exception(f'Failed to refresh Plex for: {subtitles_path}')
+
+
+def get_latest_uploads():
+    """
+    Find the latest uploaded videos, using the upload catalog (or the original names log, if it's disabled).
+
+    :return: A list of tuples of format (original_path, cloud_path, video_details) of the latest uploads (up to
+             RESULTS_LIMIT), from the oldest to the newest.
+    """
+    catalog = get_upload_catalog()
+    if catalog:
+        # The original names log is imported once (and only its new lines afterwards).
+        catalog.import_names_log()
+        return [(entry.source_path, os.path.join(entry.cloud_dir, entry.cloud_file), entry.metadata)
+                for entry in reversed(catalog.get_latest(RESULTS_LIMIT))]
+
+    latest_uploads = []
+    for original_path in get_latest_names(RESULTS_LIMIT):
+        fixed_file_name, file_extension = os.path.splitext(os.path.basename(original_path))
+        # Remove brackets group name prefix.
+        if fixed_file_name.startswith('[') and ']' in fixed_file_name:
+            fixed_file_name = fixed_file_name.split(']', 1)[1]
+
+        cloud_dir, cloud_file = guess_path(fixed_file_name)
+        if cloud_dir and cloud_file:
+            latest_uploads.append((original_path, os.path.join(cloud_dir, f'{cloud_file}{file_extension}'),
+                                   cached_guessit(fixed_file_name)))
+    return latest_uploads
 
 
 def main():
     """
     Start going over the video files and search for missing subtitles.
     """
+    import babelfish
+
     with logbook.NestedSetup(_get_log_handlers()).applicationbound():
         logger.info('Subtitles Monitor started!')
 
         # Verify paths.
-        if not os.path.isfile(config.ORIGINAL_NAMES_LOG):
+        if not config.CATALOG_PATH and not os.path.isfile(config.ORIGINAL_NAMES_LOG):
             raise FileNotFoundError('Couldn\'t read original names file! Stopping...')
         if not os.path.isdir(MEDIA_ROOT_PATH):
             raise NotADirectoryError('Couldn\'t find media root directory! Stopping...')
 
         try:
-            original_paths_list = []
             subtitles_map = defaultdict(int)
             # Set subliminal cache first.
             logger.debug('Setting subtitles cache...')
             configure_subtitles_cache()
 
-            logger.info('Going over the original names file...')
-            with open(config.ORIGINAL_NAMES_LOG, 'r', encoding='utf8') as original_names_file:
-                line = original_names_file.readline()
-                while line:
-                    original_path = line.strip()
-                    original_paths_list.append(original_path)
-                    if RESULTS_LIMIT and len(original_paths_list) > RESULTS_LIMIT:
-                        original_paths_list.pop(0)
-                    # Fetch next line.
-                    line = original_names_file.readline()
+            logger.info('Finding the latest uploads...')
+            latest_uploads = get_latest_uploads()
 
             logger.info(f'Searching for subtitles for the {RESULTS_LIMIT} newest videos...')
-            for original_path in original_paths_list:
-                fixed_file_name, file_extension = os.path.splitext(os.path.basename(original_path))
-                # Remove brackets group name prefix.
-                if fixed_file_name.startswith('[') and ']' in fixed_file_name:
-                    fixed_file_name = fixed_file_name.split(']', 1)[1]
-
-                cloud_dir, cloud_file = guess_path(fixed_file_name)
-                if not (cloud_dir and cloud_file):
-                    continue
-
-                current_path = os.path.join(MEDIA_ROOT_PATH, cloud_dir, f'{cloud_file}{file_extension}')
+            limiter = ProviderLimiter()
+            pools = ProviderPools()
+            ledger = NotFoundLedger() if NOT_FOUND_LEDGER_PATH else None
+            directory_index = DirectoryIndex()
+            backed_off = 0
+            # Searches of videos which need the same providers are queued together, so they reuse the same pools.
+            searches = defaultdict(list)
+            for original_path, cloud_path, video_details in latest_uploads:
+                current_path = os.path.join(MEDIA_ROOT_PATH, cloud_path)
 
                 # Check actual video file.
-                if current_path and os.path.isfile(current_path):
+                if current_path and directory_index.exists(current_path):
                     logger.info(f'Checking subtitles for: {current_path}')
 
                     # Find missing subtitle files.
                     video_base_path = os.path.splitext(current_path)[0]
                     languages_list = []
                     for language_extension in LANGUAGE_EXTENSIONS:
-                        if not os.path.isfile(video_base_path + language_extension + SUBTITLES_EXTENSION):
+                        if not directory_index.exists(video_base_path + language_extension + SUBTITLES_EXTENSION):
                             languages_list.append(babelfish.Language.fromalpha2(language_extension.lstrip('.')))
-
-                    # Download missing subtitles.
-                    for language in languages_list:
-                        result_path = find_file_subtitles(original_path, current_path, language)
-                        if result_path:
-                            subtitles_map[language.alpha3] += 1
-
-                            # Refresh Plex data (after waiting some time for the file to upload).
-                            if config.PLEX_SERVERS:
-                                video_details = guessit(fixed_file_name)
-                                title = video_details['title']
-                                season = video_details.get('season')
-                                episode = video_details.get('episode')
-
-                                if isinstance(title, list):
-                                    title = title[0]
-
-                                # Use the best show title available.
-                                if season and episode:
-                                    title = format_show(title)
-                                else:
-                                    title = title.title()
-
-                                time.sleep(5)
-                                refresh_plex_item(
-                                    title, season, [episode] if not isinstance(episode, list) else episode)
+                    # Skip languages which weren't found lately.
+                    if ledger:
+                        missing_count = len(languages_list)
+                        languages_list = [language for language in languages_list
+                                          if ledger.should_search(cloud_path, language.alpha3)]
+                        backed_off += missing_count - len(languages_list)
+                    if languages_list:
+                        providers = frozenset(get_provider_languages(languages_list))
+                        searches[providers].append(
+                            (original_path, cloud_path, current_path, languages_list, video_details))
                 else:
                     logger.info(f'Couldn\'t find: {current_path}')
+            logger.debug(f'Checked {len(latest_uploads)} videos using {directory_index.listings} directory listings.')
+            if backed_off:
+                logger.info(f'Skipping {backed_off} searches which found no subtitles lately.')
+
+            try:
+                with ThreadPoolExecutor(SEARCH_WORKERS, thread_name_prefix='SubtitlesSearch') as search_executor, \
+                        ThreadPoolExecutor(UPLOAD_WORKERS, thread_name_prefix='SubtitlesUpload') as upload_executor:
+                    futures = {}
+                    for providers, group in searches.items():
+                        logger.info(f'Searching {len(group)} videos with providers: {", ".join(sorted(providers))}')
+                        for original_path, cloud_path, current_path, languages_list, video_details in group:
+                            future = search_executor.submit(
+                                find_video_subtitles, original_path, current_path, languages_list, pools, limiter)
+                            futures[future] = (cloud_path, video_details)
+
+                    # Found subtitles are uploaded (and Plex is refreshed) in the background, while searches go on.
+                    for future in as_completed(futures):
+                        cloud_path, video_details = futures[future]
+                        for language, result_path in future.result() or []:
+                            if ledger:
+                                ledger.record(cloud_path, language.alpha3, result_path is not None)
+                            if result_path:
+                                subtitles_map[language.alpha3] += 1
+                                upload_executor.submit(upload_and_refresh, result_path, video_details)
+            finally:
+                pools.terminate()
+                if ledger:
+                    ledger.close()
 
             logger.info('All done! The results are: {}'.format(
                 ', '.join(['{} - {}'.format(language, counter) for language, counter in subtitles_map.items()])))
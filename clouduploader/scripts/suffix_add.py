@@ -4,7 +4,6 @@ from pathlib import Path
 import sys
 
 import logbook
-from tqdm import tqdm
 
 logger = logbook.Logger(__name__)
 logbook.StreamHandler(
@@ -28,6 +27,9 @@ def main():
 
     new_paths = []
     file_index = 0
+    # Imported lazily, so the prompts show up right away.
+    from tqdm import tqdm
+
     for file_name in tqdm(files_list):
         full_path = os.path.join(path, file_name)
         if os.path.isdir(full_path):
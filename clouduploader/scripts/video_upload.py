@@ -1,14 +1,12 @@
 #!/usr/local/bin/python3
 import os
-import random
-import shutil
-import string
-import subprocess
 import sys
 
 import logbook
 
 from clouduploader import config
+from clouduploader.journal import get_journal
+from clouduploader.uploader import UploadJob, upload_jobs
 
 logger = logbook.Logger('VideoUploader')
 
@@ -26,107 +24,20 @@ def _get_log_handlers():
     ]
 
 
-def _encrypt(encrypted_dir, plain_dir):
-    """
-    Encrypt the given plain directory.
-
-    :param encrypted_dir: The encrypted directory to create.
-    :param plain_dir: The plain directory to encrypt (recursively).
-    :return: True if succeeded, and False otherwise.
-    """
-    logger.info('Encrypting directory tree...')
-
-    # Verify config environment variable first.
-    if not os.environ.get(config.ENCFS_ENVIRONMENT_VARIABLE):
-        logger.info(f'{config.ENCFS_ENVIRONMENT_VARIABLE} environment variable is not defined. '
-                    f'Defining: {config.ENCFS_CONFIG_PATH}')
-        os.environ[config.ENCFS_ENVIRONMENT_VARIABLE] = config.ENCFS_CONFIG_PATH
-
-    # Encrypt!
-    os.makedirs(encrypted_dir)
-    return_code = subprocess.call(
-        f'echo {config.ENCFS_PASSWORD} | {config.ENCFS_PATH} -S "{encrypted_dir}" "{plain_dir}"', shell=True)
-
-    if return_code != 0:
-        logger.error(f'Bad return code ({return_code}) for encryption. Stopping!')
-        return False
-
-    return True
-
-
 def upload_video(file_path):
     """
     Upload the given file to the Google Drive videos directory.
 
     :param: file_path: The file to upload.
+    :return: The upload job, holding the file's result.
     """
     logger.info(f'Uploading video: {file_path}')
-    file_name = os.path.basename(file_path)
-    logger.info(f'Cloud path: {config.CLOUD_VIDEOS_PATH}/{file_name}')
-
-    # Create a temporary random cloud dir structure.
-    original_dir = os.path.dirname(file_path)
-    random_dir_name = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10))
-    base_dir = os.path.join(original_dir, random_dir_name)
-    plain_base_dir = os.path.join(base_dir, config.CLOUD_PLAIN_PATH)
-    os.makedirs(plain_base_dir)
-    cloud_temp_path = os.path.join(plain_base_dir, config.CLOUD_VIDEOS_PATH)
-    final_file_path = os.path.join(cloud_temp_path, file_name)
-
-    # Use the plain directory when uploading, unless encryption is enabled.
-    upload_base_dir = plain_base_dir
-    # Set up encryption if needed.
-    if config.SHOULD_ENCRYPT:
-        encrypted_base_dir = os.path.join(base_dir, config.CLOUD_ENCRYPTED_PATH)
-        encryption_successful = _encrypt(encrypted_base_dir, plain_base_dir)
-        if not encryption_successful:
-            # Delete directories and stop.
-            shutil.rmtree(base_dir)
-            return
-        # Upload the encrypted directory tree instead of the plain one.
-        upload_base_dir = encrypted_base_dir
-
-    gdrive_dir = upload_base_dir.split(base_dir)[1].strip('/')
-    logger.info(f'Moving file to temporary path: {cloud_temp_path}')
-    os.makedirs(cloud_temp_path)
-    if config.SHOULD_DELETE:
-        shutil.move(file_path, cloud_temp_path)
-    else:
-        shutil.copy(file_path, cloud_temp_path)
-    os.rename(os.path.join(cloud_temp_path, os.path.basename(file_path)), final_file_path)
-
-    # Upload!
-    upload_tries = 0
-    return_code = 1
-    while return_code != 0 and upload_tries < config.MAX_UPLOAD_TRIES:
-        logger.info('Uploading file...')
-        upload_tries += 1
-        return_code = subprocess.call(f'{config.RCLONE_PATH} --config {config.RCLONE_CONFIG_PATH} copyto '
-                                      f'"{upload_base_dir}" "GDrive:{gdrive_dir}"', shell=True)
-        # Check results.
-        if return_code != 0:
-            logger.error(f'Bad return code ({return_code}) for file: {file_name}')
-            if upload_tries < config.MAX_UPLOAD_TRIES:
-                logger.info('Trying again!')
-            else:
-                logger.error('Max retries with no success! Skipping...')
-
-    # If everything went smoothly, add the file name to the original names log.
-    if return_code == 0:
-        logger.info('Upload succeeded! Deleting original file...')
-    else:
-        # Reverse everything.
-        logger.info('Upload failed! Reversing all changes...')
-        if config.SHOULD_DELETE:
-            shutil.move(final_file_path, original_dir)
-            os.rename(os.path.join(original_dir, file_name), file_path)
-
-    # Unmount ENCFS directory.
-    if config.SHOULD_ENCRYPT:
-        subprocess.call(f'{config.UMOUNT_PATH} -l "{plain_base_dir}"', shell=True)
-
-    # Delete all temporary directories.
-    shutil.rmtree(base_dir)
+    job = UploadJob(file_path)
+    job.cloud_dir = config.CLOUD_VIDEOS_PATH
+    job.cloud_file = os.path.basename(file_path)
+    logger.info(f'Cloud path: {job.cloud_path}')
+    upload_jobs([job], log_original_names=False)
+    return job
 
 
 def main():
@@ -139,6 +50,7 @@ def main():
         if os.path.isfile(file_path):
             with logbook.NestedSetup(_get_log_handlers()).applicationbound():
                 upload_video(file_path)
+                get_journal().close()
         else:
             print('Invalid file path given. Stopping!')
     else:
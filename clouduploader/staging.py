@@ -0,0 +1,101 @@
+import errno
+import fcntl
+import os
+import shutil
+
+# Staging strategies, from the fastest to the slowest.
+STRATEGY_RENAME = 'rename'
+STRATEGY_HARDLINK = 'hardlink'
+STRATEGY_REFLINK = 'reflink'
+STRATEGY_COPY_FILE_RANGE = 'copy_file_range'
+STRATEGY_COPY = 'copy'
+
+# The Linux FICLONE ioctl request (clones a whole file on copy-on-write file systems).
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _copy(source_file, destination_file, hasher=None):
+    """
+    Copy the source file into the destination file, using a streaming copy.
+
+    :param source_file: The source file object.
+    :param destination_file: The destination file object.
+    :param hasher: An optional hash object, updated with the copied data.
+    """
+    if not hasher:
+        shutil.copyfileobj(source_file, destination_file, COPY_CHUNK_SIZE)
+        return
+    for chunk in iter(lambda: source_file.read(COPY_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+        destination_file.write(chunk)
+
+
+def _clone(source_file, destination_file, hasher=None):
+    """
+    Clone the source file into the (empty) destination file, using the fastest method the file systems support.
+
+    :param source_file: The source file object.
+    :param destination_file: The destination file object.
+    :param hasher: An optional hash object, updated with the data if it's actually copied (using a streaming copy).
+    :return: The strategy used.
+    """
+    source_fd = source_file.fileno()
+    destination_fd = destination_file.fileno()
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+        return STRATEGY_REFLINK
+    except OSError:
+        pass
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(source_fd, destination_fd, COPY_CHUNK_SIZE):
+                pass
+            return STRATEGY_COPY_FILE_RANGE
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF):
+                raise
+            # Start over with a regular copy.
+            source_file.seek(0)
+            destination_file.seek(0)
+            destination_file.truncate()
+
+    _copy(source_file, destination_file, hasher)
+    return STRATEGY_COPY
+
+
+def stage_file(source_path, destination_path, move, hasher=None):
+    """
+    Move or copy the given file, preferring zero-copy methods: a rename (or a hardlink when copying) first, then a
+    reflink or copy_file_range clone, and only then a streaming copy.
+    The destination file may already exist, in which case it's overwritten in place (keeping its name).
+
+    :param source_path: The file to stage.
+    :param destination_path: The staged file path.
+    :param move: Whether to move the file (and delete the source) or to copy it.
+    :param hasher: An optional hash object, updated with the data if it's actually copied (when the strategy is
+                   STRATEGY_COPY), so the file isn't read twice.
+    :return: The strategy used.
+    """
+    if move:
+        try:
+            os.rename(source_path, destination_path)
+            return STRATEGY_RENAME
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    elif not os.path.exists(destination_path):
+        try:
+            os.link(source_path, destination_path)
+            return STRATEGY_HARDLINK
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+
+    with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+        strategy = _clone(source_file, destination_file, hasher)
+    shutil.copystat(source_path, destination_path)
+    if move:
+        os.remove(source_path)
+    return strategy
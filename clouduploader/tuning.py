@@ -0,0 +1,127 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+from clouduploader.rclone import TransferProfile, get_profile_name
+
+# The history database path used when it's kept in memory only.
+MEMORY_PATH = ':memory:'
+
+logger = logbook.Logger('TransferTuner')
+
+_transfer_tuner = None
+_transfer_tuner_lock = threading.Lock()
+
+
+def get_size_bucket(size):
+    """
+    :param size: A file size, in bytes.
+    :return: The name of the size bucket the file belongs to.
+    """
+    for bucket, maximum_size in config.TRANSFER_SIZE_BUCKETS:
+        if maximum_size is None or size <= maximum_size:
+            return bucket
+    return config.TRANSFER_SIZE_BUCKETS[-1][0]
+
+
+def get_candidate_profiles(bucket):
+    """
+    :param bucket: A size bucket name.
+    :return: A list of the bucket's candidate transfer profiles (empty if it has none).
+    """
+    return [TransferProfile(**profile) for profile in config.TRANSFER_PROFILES.get(bucket, [])]
+
+
+class TransferTuner(object):
+    """
+    Picks the transfer profile of every size bucket, based on a persistent history of the throughput each candidate
+    profile achieved (an exponential moving average per bucket and profile).
+    """
+
+    def __init__(self, path=None, explore_rate=None, history_weight=None):
+        """
+        :param path: The history file path (defaults to the configured one, None keeps the history in memory only).
+        :param explore_rate: The probability of trying a random candidate (defaults to the configured one).
+        :param history_weight: The weight of every new sample in the moving average (defaults to the configured one).
+        """
+        self.path = path or config.TRANSFER_HISTORY_PATH or MEMORY_PATH
+        self.explore_rate = config.TRANSFER_EXPLORE_RATE if explore_rate is None else explore_rate
+        self.history_weight = history_weight or config.TRANSFER_HISTORY_WEIGHT
+        self._lock = threading.Lock()
+        if self.path != MEMORY_PATH:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS throughput (bucket TEXT, profile TEXT, samples INTEGER, '
+                                 'bytes_per_sec REAL, updated REAL, PRIMARY KEY (bucket, profile))')
+        self._connection.commit()
+
+    def get_history(self, bucket):
+        """
+        :param bucket: A size bucket name.
+        :return: A dictionary of format {profile name: (samples, average bytes/sec)} of the bucket's history.
+        """
+        with self._lock:
+            rows = self._connection.execute('SELECT profile, samples, bytes_per_sec FROM throughput WHERE bucket = ?',
+                                            (bucket,)).fetchall()
+        return {profile_name: (samples, bytes_per_sec) for profile_name, samples, bytes_per_sec in rows}
+
+    def choose_profile(self, bucket):
+        """
+        Choose a transfer profile for the given size bucket: an untried candidate if there is one, a random one every
+        now and then (so changes in the uplink are noticed), and the fastest one otherwise.
+
+        :param bucket: A size bucket name.
+        :return: The chosen transfer profile, or None if the bucket has no candidates (rclone's defaults are used).
+        """
+        candidates = get_candidate_profiles(bucket)
+        if not candidates:
+            return None
+        history = self.get_history(bucket)
+        untried_candidates = [profile for profile in candidates if get_profile_name(profile) not in history]
+        if untried_candidates:
+            return untried_candidates[0]
+        if random.random() < self.explore_rate:
+            return random.choice(candidates)
+        return max(candidates, key=lambda profile: history[get_profile_name(profile)][1])
+
+    def record(self, bucket, profile, size, seconds):
+        """
+        Record the throughput of a successful transfer.
+
+        :param bucket: The transfer's size bucket name.
+        :param profile: The transfer's profile.
+        :param size: The amount of transferred bytes.
+        :param seconds: The transfer's duration.
+        """
+        if not profile or seconds <= 0:
+            return
+        profile_name = get_profile_name(profile)
+        bytes_per_sec = size / seconds
+        with self._lock:
+            row = self._connection.execute('SELECT samples, bytes_per_sec FROM throughput WHERE bucket = ? AND '
+                                           'profile = ?', (bucket, profile_name)).fetchone()
+            samples = 1
+            if row:
+                samples = row[0] + 1
+                bytes_per_sec = (1 - self.history_weight) * row[1] + self.history_weight * bytes_per_sec
+            self._connection.execute(
+                'INSERT OR REPLACE INTO throughput (bucket, profile, samples, bytes_per_sec, updated) '
+                'VALUES (?, ?, ?, ?, ?)', (bucket, profile_name, samples, bytes_per_sec, time.time()))
+            self._connection.commit()
+        logger.debug(f'Throughput of {profile_name} ({bucket} files) is now {bytes_per_sec / 1024 ** 2:.2f} MB/sec')
+
+
+def get_transfer_tuner():
+    """
+    :return: The transfer tuner shared by this process.
+    """
+    global _transfer_tuner
+    with _transfer_tuner_lock:
+        if _transfer_tuner is None:
+            _transfer_tuner = TransferTuner()
+        return _transfer_tuner
@@ -0,0 +1,192 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import logbook
+
+from clouduploader import config
+
+# The queue database path used when it's kept in memory only.
+MEMORY_PATH = ':memory:'
+
+logger = logbook.Logger('UploadQueue')
+
+
+def get_score(file_paths, priority=0):
+    """
+    Score a submission: lower scores are uploaded first. Every explicit priority level, size doubling (above the size
+    unit) and non-subtitles file costs points.
+
+    :param file_paths: The submitted files.
+    :param priority: The caller-supplied priority (lower goes first).
+    :return: The submission's score.
+    """
+    from clouduploader.uploader import SUBTITLES_EXTENSIONS
+
+    size = 0
+    for file_path in file_paths:
+        try:
+            size += os.path.getsize(file_path)
+        except OSError:
+            pass
+    score = priority + math.log2(max(1.0, size / config.QUEUE_SIZE_UNIT))
+    if not all(os.path.splitext(file_path)[1].lower() in SUBTITLES_EXTENSIONS for file_path in file_paths):
+        score += config.QUEUE_VIDEO_PENALTY
+    return score
+
+
+class UploadQueue(object):
+    """
+    A persistent (SQLite) priority queue of upload submissions, which survives restarts.
+    Submissions age while they wait, gaining a priority point every QUEUE_AGING_SECONDS, so large ones never starve.
+    Since all submissions age at the same rate, aging is folded into a fixed sort key (score + submit time / aging).
+    A deferred submission (see defer) keeps its place, but isn't taken before its not-before time.
+    """
+
+    def __init__(self, path=None, aging_seconds=None):
+        """
+        :param path: The queue file path (defaults to the configured one, None keeps the queue in memory only).
+        :param aging_seconds: The time it takes a waiting submission to gain a priority point (defaults to the
+                              configured one).
+        """
+        self.path = path or config.UPLOAD_QUEUE_PATH or MEMORY_PATH
+        self.aging_seconds = aging_seconds or config.QUEUE_AGING_SECONDS
+        self._condition = threading.Condition()
+        self._is_closed = False
+        if self.path != MEMORY_PATH:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS submissions (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                 'file_paths TEXT, priority INTEGER, score REAL, sort_key REAL, submitted REAL, '
+                                 'taken INTEGER DEFAULT 0, not_before REAL DEFAULT 0)')
+        # Queues created before submissions could be deferred.
+        if 'not_before' not in {row[1] for row in self._connection.execute('PRAGMA table_info(submissions)')}:
+            self._connection.execute('ALTER TABLE submissions ADD COLUMN not_before REAL DEFAULT 0')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS submissions_order ON submissions (taken, sort_key)')
+        # Submissions taken by a previous process which died are queued again (without the files the journal
+        # recovered, see discard_files), and deferred submissions are decided on again.
+        self._connection.execute('UPDATE submissions SET taken = 0, not_before = 0')
+        self._connection.commit()
+        pending = self.qsize()
+        if pending:
+            logger.info(f'Restored {pending} queued submissions.')
+
+    def put(self, file_paths, priority=0):
+        """
+        Queue a submission.
+
+        :param file_paths: The submitted files (uploaded as a single batch).
+        :param priority: The caller-supplied priority (lower goes first).
+        :return: The submission ID.
+        """
+        score = get_score(file_paths, priority)
+        submitted = time.time()
+        with self._condition:
+            cursor = self._connection.execute(
+                'INSERT INTO submissions (file_paths, priority, score, sort_key, submitted) VALUES (?, ?, ?, ?, ?)',
+                (json.dumps(file_paths), priority, score, score + submitted / self.aging_seconds, submitted))
+            self._connection.commit()
+            self._condition.notify()
+        return cursor.lastrowid
+
+    def get(self):
+        """
+        Take the next submission (the one with the lowest aged score, which isn't deferred), waiting until there is one.
+
+        :return: A tuple of format (submission ID, file paths), or None if the queue was closed.
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                row = self._connection.execute('SELECT id, file_paths FROM submissions WHERE taken = 0 AND '
+                                               'not_before <= ? ORDER BY sort_key, id LIMIT 1', (now,)).fetchone()
+                if row:
+                    self._connection.execute('UPDATE submissions SET taken = 1 WHERE id = ?', (row[0],))
+                    self._connection.commit()
+                    return row[0], json.loads(row[1])
+                next_due = self._connection.execute(
+                    'SELECT MIN(not_before) FROM submissions WHERE taken = 0').fetchone()[0]
+                if next_due is None and self._is_closed:
+                    return None
+                self._condition.wait(next_due - now if next_due is not None else None)
+
+    def defer(self, submission_id, delay):
+        """
+        Return a taken submission to the queue, without taking it again for the given time (e.g. until the bandwidth
+        allows it). The submission keeps its place otherwise.
+
+        :param submission_id: The submission ID.
+        :param delay: The time to wait before the submission is taken again, in seconds.
+        """
+        with self._condition:
+            self._connection.execute('UPDATE submissions SET taken = 0, not_before = ? WHERE id = ?',
+                                     (time.time() + delay, submission_id))
+            self._connection.commit()
+            # Waiting workers recalculate when the next deferred submission is due.
+            self._condition.notify_all()
+
+    def done(self, submission_id):
+        """
+        Remove a taken submission, once it's uploaded.
+
+        :param submission_id: The submission ID.
+        """
+        with self._condition:
+            self._connection.execute('DELETE FROM submissions WHERE id = ?', (submission_id,))
+            self._connection.commit()
+
+    def discard_files(self, file_paths):
+        """
+        Remove the given files from all queued submissions (e.g. files already handled by the journal's recovery),
+        removing submissions which are left empty.
+
+        :param file_paths: The files to remove.
+        :return: The amount of removed files.
+        """
+        file_paths = set(file_paths)
+        removed = 0
+        with self._condition:
+            for submission_id, submitted_paths in self._connection.execute(
+                    'SELECT id, file_paths FROM submissions WHERE taken = 0').fetchall():
+                submitted_paths = json.loads(submitted_paths)
+                kept_paths = [file_path for file_path in submitted_paths if file_path not in file_paths]
+                if len(kept_paths) == len(submitted_paths):
+                    continue
+                removed += len(submitted_paths) - len(kept_paths)
+                if kept_paths:
+                    self._connection.execute('UPDATE submissions SET file_paths = ? WHERE id = ?',
+                                             (json.dumps(kept_paths), submission_id))
+                else:
+                    self._connection.execute('DELETE FROM submissions WHERE id = ?', (submission_id,))
+            self._connection.commit()
+        return removed
+
+    def close(self):
+        """
+        Make all waiting (and future) get calls return None once the queue is empty.
+        """
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+
+    def qsize(self):
+        """
+        :return: The amount of queued (not taken) submissions.
+        """
+        with self._condition:
+            return self._connection.execute('SELECT COUNT(*) FROM submissions WHERE taken = 0').fetchone()[0]
+
+    def stats(self):
+        """
+        :return: A dictionary of the queued submissions' count, the deferred ones' count and the longest wait (in
+                 seconds).
+        """
+        now = time.time()
+        with self._condition:
+            count, deferred, oldest = self._connection.execute(
+                'SELECT COUNT(*), TOTAL(not_before > ?), MIN(submitted) FROM submissions WHERE taken = 0',
+                (now,)).fetchone()
+        return {'queued': count, 'deferred': int(deferred), 'longest_wait': round(now - oldest) if oldest else 0}
@@ -1,16 +1,32 @@
 #!/usr/local/bin/python3
+from collections import defaultdict
+from contextlib import nullcontext
 import os
 import random
 import shutil
+import sqlite3
 import string
-import subprocess
 import sys
+import time
+import uuid
 
-from guessit import guessit
 import logbook
-from showsformatter import format_show
 
 from clouduploader import config
+from clouduploader.bandwidth import get_bandwidth_scheduler
+from clouduploader.cache import PATH_NAMESPACE, cached_guessit, get_guess_cache
+from clouduploader.catalog import get_metadata, get_upload_catalog
+from clouduploader.dedup import get_dedup_index, get_full_hash, get_partial_hash, new_hasher
+from clouduploader.encfs import get_shared_mount
+from clouduploader.journal import JOB_FIELDS, STATE_CLASSIFIED, STATE_ENCRYPTED, STATE_ROLLED_BACK, STATE_STAGED, \
+    STATE_UPLOADED, STATE_UPLOADING, get_journal
+from clouduploader.metrics import BYTES_COPIED, BYTES_HASHED, BYTES_STAGED, BYTES_UPLOADED, STAGE_CLEANUP, \
+    STAGE_DEDUP, STAGE_DEFER, STAGE_ENCRYPT, STAGE_GUESS, STAGE_ROLLBACK, STAGE_STAGE, STAGE_TRANSFER, JobMetrics, \
+    get_metrics_reporter
+from clouduploader.rclone import copy_files, get_profile_name
+from clouduploader.retry import classify_failure, get_retry_policy
+from clouduploader.staging import STRATEGY_COPY, STRATEGY_COPY_FILE_RANGE, stage_file
+from clouduploader.tuning import get_size_bucket, get_transfer_tuner
 
 DEFAULT_VIDEO_EXTENSION = '.mkv'
 DEFAULT_LANGUAGE_EXTENSION = '.en'
@@ -20,6 +36,13 @@ LANGUAGE_EXTENSIONS = ['.he', '.en']
 EXTENSIONS_WHITE_LIST = ['.srt', '.mkv', '.avi', '.mp4', '.m4v', '.wmv', '.mpg']
 NAMES_BLACK_LIST = ['sample']
 
+# Upload job statuses.
+STATUS_UPLOADED = 'uploaded'
+STATUS_ROLLED_BACK = 'rolled-back'
+STATUS_SKIPPED = 'skipped'
+STATUS_SKIPPED_DUPLICATE = 'skipped-duplicate'
+STATUS_FAILED = 'failed'
+
 logger = logbook.Logger('CloudUploader')
 
 
@@ -36,34 +59,6 @@ def _get_log_handlers():
     ]
 
 
-def _encrypt(encrypted_dir, plain_dir):
-    """
-    Encrypt the given plain directory.
-
-    :param encrypted_dir: The encrypted directory to create.
-    :param plain_dir: The plain directory to encrypt (recursively).
-    :return: True if succeeded, and False otherwise.
-    """
-    logger.info('Encrypting directory tree...')
-
-    # Verify config environment variable first.
-    if not os.environ.get(config.ENCFS_ENVIRONMENT_VARIABLE):
-        logger.info(f'{config.ENCFS_ENVIRONMENT_VARIABLE} environment variable is not defined. '
-                    f'Defining: {config.ENCFS_CONFIG_PATH}')
-        os.environ[config.ENCFS_ENVIRONMENT_VARIABLE] = config.ENCFS_CONFIG_PATH
-
-    # Encrypt!
-    os.makedirs(encrypted_dir)
-    return_code = subprocess.call(
-        f'echo {config.ENCFS_PASSWORD} | {config.ENCFS_PATH} -S "{encrypted_dir}" "{plain_dir}"', shell=True)
-
-    if return_code != 0:
-        logger.error(f'Bad return code ({return_code}) for encryption. Stopping!')
-        return False
-
-    return True
-
-
 def _extract_ufc_path(file_name):
     """
     Extract UFC cloud dir and cloud file name from the given file name.
@@ -71,7 +66,7 @@ def _extract_ufc_path(file_name):
     :param file_name: The file name to extract data from.
     :return: A tuple of format (cloud_dir, cloud_file)
     """
-    guess_results = guessit(file_name)
+    guess_results = cached_guessit(file_name)
 
     # Get real episode number.
     episode_num = guess_results.get('episode')
@@ -119,11 +114,18 @@ def guess_path(file_name):
     :param file_name: The file name to guess on.
     :return: A tuple of format (cloud_dir, cloud_file)
     """
+    # Cached paths depend on the configured cloud directories as well.
+    cache = get_guess_cache()
+    cache_namespace = f'{PATH_NAMESPACE}/{config.CLOUD_TV_PATH}/{config.CLOUD_MOVIES_PATH}'
+    cached_path = cache.get(cache_namespace, file_name)
+    if cached_path is not None:
+        return cached_path
+
     cloud_dir = None
     cloud_file = None
 
     # Start guessing!
-    guess_results = guessit(file_name)
+    guess_results = cached_guessit(file_name)
     video_type = guess_results.get('type')
     title = guess_results.get('title')
 
@@ -131,6 +133,8 @@ def guess_path(file_name):
         title = title[0]
 
     if video_type == 'episode' and title:
+        from showsformatter import format_show
+
         # Translate show title if needed.
         title = format_show(title)
         season = guess_results.get('season')
@@ -159,32 +163,34 @@ def guess_path(file_name):
             cloud_dir = os.path.join(config.CLOUD_MOVIES_PATH, f'{title} ({year})')
             cloud_file = f'{title} ({year})'
 
+    cache.set(cache_namespace, file_name, (cloud_dir, cloud_file))
     return cloud_dir, cloud_file
 
 
-def upload_file(file_path):
+def _classify_file(file_path):
     """
-    Upload the given file to its proper Google Drive cloud directory.
+    Classify the given file and find its proper cloud dir and cloud file name.
 
-    :param: file_path: The file to upload.
+    :param file_path: The file to classify.
+    :return: A tuple of format (cloud_dir, cloud_file, is_subtitles). Cloud dir and file are None if the file should
+             be skipped.
     """
-    logger.info(f'Uploading file: {file_path}')
     fixed_file_path = file_path
     file_parts = os.path.splitext(file_path)
 
     # Verify file name.
     if len(file_parts) != 2:
         logger.info('File has no extension! Skipping...')
-        return
+        return None, None, False
     file_name, file_extension = file_parts
     file_extension = file_extension.lower()
     if file_extension not in EXTENSIONS_WHITE_LIST:
         logger.info('File extension is not in white list! Skipping...')
-        return
+        return None, None, False
     for black_list_word in NAMES_BLACK_LIST:
         if black_list_word in file_name.lower():
             logger.info(f'File name contains a black listed word ({black_list_word})! Skipping...')
-            return
+            return None, None, False
     language_extension = None
     is_subtitles = file_extension in SUBTITLES_EXTENSIONS
 
@@ -217,97 +223,661 @@ def upload_file(file_path):
     else:
         cloud_dir, cloud_file = guess_path(fixed_file_name)
 
-    if cloud_dir and cloud_file:
-        if is_kids:
-            cloud_dir = cloud_dir.replace(config.CLOUD_MOVIES_PATH, config.CLOUD_KIDS_MOVIES_PATH, 1).replace(config.CLOUD_TV_PATH, config.CLOUD_KIDS_TV_PATH, 1)
-            cloud_file += ' - Hebrew'
-        if language_extension:
-            cloud_file += language_extension
-
-        cloud_file += file_extension
-        logger.info('Cloud path: {}'.format(os.path.join(cloud_dir, cloud_file)))
-        # Create a temporary random cloud dir structure.
-        original_dir = os.path.dirname(file_path)
-        random_dir_name = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10))
-        base_dir = os.path.join(original_dir, random_dir_name)
-        plain_base_dir = os.path.join(base_dir, config.CLOUD_PLAIN_PATH)
-        os.makedirs(plain_base_dir)
-        cloud_temp_path = os.path.join(plain_base_dir, cloud_dir)
-        final_file_path = os.path.join(cloud_temp_path, cloud_file)
-        # Use the plain directory when uploading, unless encryption is enabled.
-        upload_base_dir = plain_base_dir
-        # Set up encryption if needed.
-        if config.SHOULD_ENCRYPT:
-            encrypted_base_dir = os.path.join(base_dir, config.CLOUD_ENCRYPTED_PATH)
-            encryption_successful = _encrypt(encrypted_base_dir, plain_base_dir)
-            if not encryption_successful:
-                # Delete directories and stop.
-                shutil.rmtree(base_dir)
-                return
-            # Upload the encrypted directory tree instead of the plain one.
-            upload_base_dir = encrypted_base_dir
-        gdrive_dir = upload_base_dir.split(base_dir)[1].strip(os.path.sep)
-        logger.info(f'Moving file to temporary path: {cloud_temp_path}')
-        os.makedirs(cloud_temp_path)
-        if config.SHOULD_DELETE:
-            shutil.move(file_path, cloud_temp_path)
+    if not (cloud_dir and cloud_file):
+        logger.info('Couldn\'t guess file info. Skipping...')
+        return None, None, is_subtitles
+
+    if is_kids:
+        cloud_dir = cloud_dir.replace(config.CLOUD_MOVIES_PATH, config.CLOUD_KIDS_MOVIES_PATH, 1).replace(config.CLOUD_TV_PATH, config.CLOUD_KIDS_TV_PATH, 1)
+        cloud_file += ' - Hebrew'
+    if language_extension:
+        cloud_file += language_extension
+    cloud_file += file_extension
+    return cloud_dir, cloud_file, is_subtitles
+
+
+class UploadJob(object):
+    """
+    A single file upload, holding everything known about it from classification to its final result.
+    """
+
+    def __init__(self, file_path):
+        """
+        :param file_path: The file to upload.
+        """
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.cloud_dir = None
+        self.cloud_file = None
+        self.is_subtitles = False
+        self.log_original_name = True
+        # The file path inside the plain staging tree.
+        self.staged_path = None
+        # The file path relative to the uploaded tree root (encrypted, if encryption is enabled).
+        self.upload_path = None
+        # The ownership token of the file staged in the encrypted mount (None if this job didn't create it).
+        self.staging_token = None
+        # The strategy used for staging the file (see the staging module).
+        self.stage_strategy = None
+        # The file's size and hashes (see the dedup module).
+        self.size = None
+        self.partial_hash = None
+        self.full_hash = None
+        # The name of the transfer profile used for uploading the file (see the tuning module).
+        self.transfer_profile = None
+        # The batch's work directory, uploaded tree root and its Google Drive directory.
+        self.work_dir = None
+        self.upload_base_dir = None
+        self.gdrive_dir = None
+        self.encrypted = False
+        self.status = None
+        self.metrics = JobMetrics()
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        Restore an upload job from its journal record.
+
+        :param record: The job's journal record.
+        :return: The restored upload job.
+        """
+        job = cls(record['file_path'])
+        for field in JOB_FIELDS:
+            setattr(job, field, record.get(field))
+        return job
+
+    @property
+    def cloud_path(self):
+        """
+        :return: The full cloud path of the file, or None if it wasn't classified.
+        """
+        if self.cloud_dir and self.cloud_file:
+            return os.path.join(self.cloud_dir, self.cloud_file)
+        return None
+
+    def to_dict(self):
+        """
+        :return: A JSON serializable dictionary of the job's result.
+        """
+        return {
+            'file_path': self.file_path,
+            'status': self.status,
+            'cloud_path': self.cloud_path,
+            'stage_strategy': self.stage_strategy,
+            'transfer_profile': self.transfer_profile,
+            'metrics': self.metrics.to_dict()
+        }
+
+    def __repr__(self):
+        return f'<UploadJob {self.file_path} ({self.status})>'
+
+
+def _create_work_dir(original_dir):
+    """
+    Create a temporary random work directory, for the plain staging tree and rclone's file lists.
+
+    :param original_dir: The directory to create the work directory in.
+    :return: The work directory path.
+    """
+    random_dir_name = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(10))
+    work_dir = os.path.join(original_dir, random_dir_name)
+    os.makedirs(work_dir)
+    return work_dir
+
+
+def _stage_file(job, mount=None):
+    """
+    Move (or copy) the given job's file into the staging tree, under its final cloud path.
+
+    :param job: The upload job to stage.
+    :param mount: The encrypted mount to stage into, or None if encryption is disabled.
+    """
+    cloud_temp_path = os.path.dirname(job.staged_path)
+    logger.info(f'Moving file to temporary path: {cloud_temp_path}')
+    if job.size is None:
+        job.size = os.path.getsize(job.file_path)
+    # Hash the file while it's copied, if it's going to be indexed.
+    hasher = new_hasher() if get_dedup_index() and not job.full_hash else None
+    if mount:
+        # Create the file first, in order to find its encrypted name, and only then fill it.
+        with job.metrics.timer(STAGE_ENCRYPT):
+            job.upload_path, job.staging_token = mount.create_file(job.cloud_path)
+        if not job.upload_path:
+            return
+        get_journal().record(job, STATE_STAGED)
+        with job.metrics.timer(STAGE_STAGE):
+            job.stage_strategy = stage_file(job.file_path, job.staged_path, move=config.SHOULD_DELETE, hasher=hasher)
+        get_journal().record(job, STATE_ENCRYPTED)
+    else:
+        os.makedirs(cloud_temp_path, exist_ok=True)
+        with job.metrics.timer(STAGE_STAGE):
+            job.stage_strategy = stage_file(job.file_path, job.staged_path, move=config.SHOULD_DELETE, hasher=hasher)
+        get_journal().record(job, STATE_STAGED)
+    job.metrics.count(BYTES_STAGED, job.size)
+    if job.stage_strategy in (STRATEGY_COPY_FILE_RANGE, STRATEGY_COPY):
+        job.metrics.count(BYTES_COPIED, job.size)
+    if hasher and job.stage_strategy == STRATEGY_COPY:
+        job.full_hash = hasher.hexdigest()
+        job.metrics.count(BYTES_HASHED, job.size)
+    logger.info(f'File staged using: {job.stage_strategy}')
+
+
+def _rollback_file(job):
+    """
+    Reverse all changes made to the given job's file.
+
+    :param job: The upload job to roll back.
+    """
+    # A staged file in the encrypted mount may belong to another upload of the same cloud path.
+    is_owned = job.staging_token or not job.encrypted
+    if config.SHOULD_DELETE and is_owned and job.staged_path and os.path.isfile(job.staged_path) and \
+            not os.path.exists(job.file_path):
+        with job.metrics.timer(STAGE_ROLLBACK):
+            stage_file(job.staged_path, job.file_path, move=True)
+
+
+def _log_progress(progress):
+    """
+    Log a live transfer progress event.
+
+    :param progress: The transfer progress (see the rclone module).
+    """
+    eta = f'{progress.eta:.0f} seconds' if progress.eta is not None else 'unknown'
+    logger.info(f'Upload progress: {progress.bytes / 1024 ** 2:.1f} / {progress.total_bytes / 1024 ** 2:.1f} MB, '
+                f'{progress.speed / 1024 ** 2:.2f} MB/sec, ETA {eta}')
+
+
+def _transfer(jobs, work_dir, upload_base_dir, gdrive_dir, scheduler=None):
+    """
+    Upload all staged jobs' files using a single rclone run per size bucket, each with its own tuned transfer profile
+    (retrying only the failed files). Smaller files are transferred first, and larger ones may be deferred by the
+    bandwidth scheduler (unless an upload scheduler already deferred the submission before it was staged).
+
+    :param jobs: The staged upload jobs.
+    :param work_dir: The work directory (used for rclone's file lists).
+    :param upload_base_dir: The staging directory to upload.
+    :param gdrive_dir: The Google Drive directory to upload to.
+    :param scheduler: An optional upload scheduler, limiting concurrent transfers.
+    :return: A set of the jobs which failed to upload.
+    """
+    bucket_jobs = defaultdict(list)
+    for job in jobs:
+        if job.size is None:
+            job.size = os.path.getsize(job.staged_path)
+        bucket_jobs[get_size_bucket(job.size)].append(job)
+
+    tuner = get_transfer_tuner()
+    bandwidth = get_bandwidth_scheduler()
+    failed_jobs = set()
+    for bucket in [bucket for bucket, _ in config.TRANSFER_SIZE_BUCKETS if bucket in bucket_jobs]:
+        transferred_jobs = bucket_jobs[bucket]
+        if bandwidth and not scheduler:
+            start_time = time.perf_counter()
+            bandwidth.defer(transferred_jobs)
+            for job in transferred_jobs:
+                job.metrics.add_time(STAGE_DEFER, time.perf_counter() - start_time)
+        profile = tuner.choose_profile(bucket)
+        for job in transferred_jobs:
+            job.transfer_profile = get_profile_name(profile) if profile else None
+            logger.info(f'Transfer profile ({bucket} files): {job.transfer_profile or "default"}: {job.file_path}')
+        destinations = [job.cloud_dir for job in transferred_jobs]
+        with scheduler.transfer_slot(destinations) if scheduler else nullcontext(), \
+                bandwidth.transfer(transferred_jobs) if bandwidth else nullcontext():
+            start_time = time.perf_counter()
+            try:
+                failed_jobs |= _transfer_with_retries(transferred_jobs, work_dir, upload_base_dir, gdrive_dir,
+                                                      profile, bucket)
+            finally:
+                # The bucket is transferred together, so every job waits for all of it.
+                for job in transferred_jobs:
+                    job.metrics.add_time(STAGE_TRANSFER, time.perf_counter() - start_time)
+    return failed_jobs
+
+
+def _transfer_with_retries(jobs, work_dir, upload_base_dir, gdrive_dir, profile=None, bucket=None):
+    """
+    Upload all staged jobs' files using a single rclone run, retrying only the failed files while the retry policy
+    allows it. The throughput of a successful run is recorded in the transfer tuner's history, unless a bandwidth limit
+    applied to it.
+
+    :param jobs: The staged upload jobs.
+    :param work_dir: The work directory (used for rclone's file lists).
+    :param upload_base_dir: The staging directory to upload.
+    :param gdrive_dir: The Google Drive directory to upload to.
+    :param profile: An optional transfer profile (see the tuning module).
+    :param bucket: The jobs' size bucket name (required along with a profile).
+    :return: A set of the jobs which failed to upload.
+    """
+    for job in jobs:
+        get_journal().record(job, STATE_UPLOADING)
+    retry_policy = get_retry_policy()
+    remaining_jobs = set(jobs)
+    upload_tries = 0
+    while remaining_jobs:
+        retry_policy.wait_for_window()
+        logger.info(f'Uploading {len(remaining_jobs)} files...')
+        upload_tries += 1
+        start_time = time.perf_counter()
+        bandwidth = get_bandwidth_scheduler()
+        result = copy_files(upload_base_dir, gdrive_dir, [job.upload_path for job in remaining_jobs], work_dir,
+                            _log_progress, profile, bandwidth.get_bwlimit() if bandwidth else None,
+                            bandwidth.get_rate() if bandwidth else None)
+        # Check results.
+        if result.return_code == 0:
+            elapsed = time.perf_counter() - start_time
+            # A throughput capped by a bandwidth limit says nothing about the profile, so it's not recorded.
+            if profile and not (bandwidth and bandwidth.was_limited(elapsed)):
+                get_transfer_tuner().record(bucket, profile, sum(job.size or 0 for job in remaining_jobs), elapsed)
+            return set()
+        failure = classify_failure(result.return_code, result.output)
+        logger.error(f'Bad return code ({result.return_code}, {failure}) for {len(remaining_jobs)} files. Output:\n'
+                     f'{result.output}')
+        # Only files reported by rclone have failed, unless it failed without reporting any specific file.
+        failed_jobs = {job for job in remaining_jobs if job.upload_path in (result.failed_paths or ())}
+        remaining_jobs = failed_jobs or remaining_jobs
+        if not retry_policy.should_retry(failure, upload_tries):
+            logger.error(f'Giving up after {upload_tries} tries ({failure})! Skipping...')
+            break
+        delay = retry_policy.backoff(failure, upload_tries)
+        logger.info(f'Trying again in {delay:.1f} seconds!')
+        time.sleep(delay)
+    return remaining_jobs
+
+
+def _skip_duplicates(jobs, log_original_names=True):
+    """
+    Skip all jobs whose files were already uploaded to their cloud paths with the exact same content.
+    A skipped file is added to the upload catalog (or the original names log) like an uploaded one, before it's deleted,
+    and it's kept if it couldn't be added.
+
+    :param jobs: The classified upload jobs.
+    :param log_original_names: Whether to add the skipped files to the upload catalog (or the original names log).
+    :return: A list of the jobs which should be uploaded.
+    """
+    dedup_index = get_dedup_index()
+    if not dedup_index:
+        return jobs
+    for job in jobs:
+        try:
+            with job.metrics.timer(STAGE_DEDUP):
+                duplicate = dedup_index.find_duplicate(job)
+        except OSError:
+            logger.exception(f'Failed to check for duplicates: {job.file_path}')
+            continue
+        if job.full_hash:
+            job.metrics.count(BYTES_HASHED, job.size)
+        if not duplicate:
+            continue
+        logger.info(f'File was already uploaded with the exact same content! Skipping: {job.file_path}')
+        job.status = STATUS_SKIPPED_DUPLICATE
+        if not config.SHOULD_DELETE:
+            continue
+        is_recorded = True
+        if log_original_names and not job.is_subtitles:
+            try:
+                is_recorded = _catalog_job(job)
+            except OSError:
+                logger.exception(f'Failed to add file to the original names log: {job.file_path}')
+                is_recorded = False
+        if is_recorded:
+            os.remove(job.file_path)
         else:
-            shutil.copy(file_path, cloud_temp_path)
-        os.rename(os.path.join(cloud_temp_path, os.path.basename(file_path)), final_file_path)
+            logger.warning(f'Keeping the skipped file, since it could not be recorded: {job.file_path}')
+    return [job for job in jobs if not job.status]
 
-        # Upload!
-        upload_tries = 0
-        return_code = 1
-        while return_code != 0 and upload_tries < config.MAX_UPLOAD_TRIES:
-            logger.info('Uploading file...')
-            upload_tries += 1
-            process_result = subprocess.run(
-                f'{config.RCLONE_PATH} --config {config.RCLONE_CONFIG_PATH} copyto --update "{upload_base_dir}" '
-                f'"GDrive:{gdrive_dir}"', shell=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                check=False)
-            # Check results.
-            return_code = process_result.returncode
-            if return_code != 0:
-                logger.error(
-                    f'Bad return code ({return_code}) for file: {cloud_file}. Output:\n{process_result.stdout}')
-                if upload_tries < config.MAX_UPLOAD_TRIES:
-                    logger.info('Trying again!')
-                else:
-                    logger.error('Max retries with no success! Skipping...')
-        # If everything went smoothly, add the file name to the original names log.
-        if return_code == 0:
-            logger.info('Upload succeeded! Deleting original file...')
-            if not is_subtitles:
-                open(config.ORIGINAL_NAMES_LOG, 'a', encoding='UTF-8').write(file_path + '\n')
+
+def _index_job(job):
+    """
+    Add the given uploaded job's file to the dedup index (if enabled).
+    Files which weren't hashed while staged (since no data was copied) are hashed now, from their staged copy.
+
+    :param job: The uploaded job.
+    """
+    dedup_index = get_dedup_index()
+    if not dedup_index:
+        return
+    try:
+        if job.size is None:
+            job.size = os.path.getsize(job.staged_path)
+        if job.partial_hash is None:
+            job.partial_hash = get_partial_hash(job.staged_path, job.size)
+        if job.full_hash is None:
+            with job.metrics.timer(STAGE_DEDUP):
+                job.full_hash = get_full_hash(job.staged_path)
+            job.metrics.count(BYTES_HASHED, job.size)
+        dedup_index.add(job.cloud_path, job.size, job.partial_hash, job.full_hash)
+    except OSError:
+        logger.exception(f'Failed to index file: {job.file_path}')
+
+
+def _catalog_job(job):
+    """
+    Add the given uploaded job's file to the upload catalog, or to the original names log if the catalog is disabled.
+
+    :param job: The uploaded job.
+    :return: True if the file was added, and False otherwise.
+    """
+    catalog = get_upload_catalog()
+    if not catalog:
+        with open(config.ORIGINAL_NAMES_LOG, 'a', encoding='UTF-8') as original_names_log:
+            original_names_log.write(job.file_path + '\n')
+        return True
+    try:
+        catalog.add(job.file_path, job.cloud_dir, job.cloud_file, job.size, get_metadata(job.file_path))
+    except sqlite3.Error:
+        logger.exception(f'Failed to add file to the upload catalog: {job.file_path}')
+        return False
+    return True
+
+
+def _finish_jobs(jobs, failed_jobs):
+    """
+    Set the final result of the given transferred jobs, rolling back the failed ones.
+
+    :param jobs: The transferred upload jobs.
+    :param failed_jobs: The jobs which failed to upload.
+    """
+    for job in jobs:
+        # If everything went smoothly, add the file to the upload catalog (or the original names log).
+        if job not in failed_jobs:
+            logger.info(f'Upload succeeded! Deleting original file: {job.file_path}')
+            if job.log_original_name and not job.is_subtitles:
+                _catalog_job(job)
+            _index_job(job)
+            job.metrics.count(BYTES_UPLOADED, job.size or 0)
+            job.status = STATUS_UPLOADED
+            get_journal().record(job, STATE_UPLOADED)
         else:
             # Reverse everything.
-            logger.info('Upload failed! Reversing all changes...')
-            if config.SHOULD_DELETE:
-                shutil.move(final_file_path, original_dir)
-                os.rename(os.path.join(original_dir, cloud_file), file_path)
-        # Unmount ENCFS directory.
-        if config.SHOULD_ENCRYPT:
-            subprocess.call(f'{config.UMOUNT_PATH} -l "{plain_base_dir}"', shell=True)
-        # Delete all temporary directories.
-        shutil.rmtree(base_dir)
+            logger.info(f'Upload failed! Reversing all changes: {job.file_path}')
+            _rollback_file(job)
+            job.status = STATUS_ROLLED_BACK
+            get_journal().record(job, STATE_ROLLED_BACK)
+
+
+def _cleanup_jobs(jobs, mount=None):
+    """
+    Delete the given jobs' staged files and work directories.
+
+    :param jobs: The finished upload jobs.
+    :param mount: The encrypted mount the jobs were staged into, or None if encryption is disabled.
+    """
+    start_time = time.perf_counter()
+    if mount:
+        # Only clean up the files these jobs created, since the mount is shared.
+        for job in jobs:
+            if job.staging_token:
+                mount.remove_file(job.cloud_path, job.staging_token)
+    for work_dir in {job.work_dir for job in jobs}:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for job in jobs:
+        job.metrics.add_time(STAGE_CLEANUP, time.perf_counter() - start_time)
+
+
+def upload_jobs(jobs, scheduler=None, log_original_names=True):
+    """
+    Upload the given classified jobs' files, by staging them into a single shared tree, and uploading them using a
+    single rclone run. The result of each file is set in its job's status.
+
+    :param jobs: The classified upload jobs.
+    :param scheduler: An optional upload scheduler, limiting concurrent staging and transfers.
+    :param log_original_names: Whether to add the uploaded files to the upload catalog (or the original names log).
+    """
+    try:
+        _upload_batch(_skip_duplicates(jobs, log_original_names), scheduler, log_original_names)
+    finally:
+        get_metrics_reporter().report(jobs)
+
+
+def _group_by_device(jobs):
+    """
+    Group the given jobs by the filesystem (device) of their files, so every group is staged next to its files, and
+    files are moved (rather than copied) into its staging tree.
+
+    :param jobs: The upload jobs.
+    :return: A list of tuples of format (original_dir, jobs): the directory to stage each group in, and its jobs.
+    """
+    device_jobs = defaultdict(list)
+    for job in jobs:
+        try:
+            device = os.stat(job.file_path).st_dev
+        except OSError:
+            # The file will fail to stage anyway, next to where it was.
+            device = os.path.dirname(job.file_path)
+        device_jobs[device].append(job)
+    groups = []
+    for device, group_jobs in device_jobs.items():
+        original_dir = os.path.commonpath([os.path.dirname(job.file_path) for job in group_jobs])
+        try:
+            # The common directory of files on a single device may be on another one (e.g. /mnt for /mnt/a and /mnt/b).
+            if os.stat(original_dir).st_dev != device:
+                original_dir = os.path.dirname(group_jobs[0].file_path)
+        except OSError:
+            original_dir = os.path.dirname(group_jobs[0].file_path)
+        groups.append((original_dir, group_jobs))
+    return groups
+
+
+def _upload_batch(jobs, scheduler, log_original_names):
+    """
+    Stage and upload the given classified (and not duplicate) jobs' files, a batch per filesystem. See upload_jobs.
+
+    :param jobs: The classified upload jobs.
+    :param scheduler: An optional upload scheduler, limiting concurrent staging and transfers.
+    :param log_original_names: Whether to add the uploaded files to the upload catalog (or the original names log).
+    """
+    for original_dir, group_jobs in _group_by_device(jobs):
+        _upload_group(group_jobs, original_dir, scheduler, log_original_names)
+
+
+def _upload_group(jobs, original_dir, scheduler, log_original_names):
+    """
+    Stage and upload the given jobs' files (all on a single filesystem), using a work directory in the given directory.
+
+    :param jobs: The classified upload jobs.
+    :param original_dir: The directory to create the work directory in (on the files' filesystem).
+    :param scheduler: An optional upload scheduler, limiting concurrent staging and transfers.
+    :param log_original_names: Whether to add the uploaded files to the upload catalog (or the original names log).
+    """
+    work_dir = _create_work_dir(original_dir)
+    mount = None
+    if config.SHOULD_ENCRYPT:
+        # Upload the shared encrypted directory tree instead of a plain one.
+        mount = get_shared_mount()
+        start_time = time.perf_counter()
+        is_mounted = mount.acquire()
+        for job in jobs:
+            job.metrics.add_time(STAGE_ENCRYPT, time.perf_counter() - start_time)
+        if not is_mounted:
+            shutil.rmtree(work_dir)
+            for job in jobs:
+                job.status = STATUS_FAILED
+            return
+        plain_base_dir = mount.mount_dir
+        upload_base_dir = mount.root_dir
+        gdrive_dir = config.CLOUD_ENCRYPTED_PATH
     else:
-        logger.info('Couldn\'t guess file info. Skipping...')
+        plain_base_dir = upload_base_dir = os.path.join(work_dir, config.CLOUD_PLAIN_PATH)
+        gdrive_dir = config.CLOUD_PLAIN_PATH
+        os.makedirs(plain_base_dir)
 
+    for job in jobs:
+        job.log_original_name = log_original_names
+        job.work_dir = work_dir
+        job.upload_base_dir = upload_base_dir
+        job.gdrive_dir = gdrive_dir
+        job.encrypted = mount is not None
+        job.staged_path = os.path.join(plain_base_dir, job.cloud_path)
+        if not mount:
+            job.upload_path = job.cloud_path
+        get_journal().record(job, STATE_CLASSIFIED)
+
+    try:
+        staged_jobs = []
+        for job in jobs:
+            try:
+                with scheduler.staging_slot() if scheduler else nullcontext():
+                    _stage_file(job, mount)
+                if not job.upload_path:
+                    logger.error(f'Couldn\'t find staged file in upload tree: {job.file_path}')
+            except OSError:
+                logger.exception(f'Failed to stage file: {job.file_path}')
+                job.upload_path = None
+            if not job.upload_path:
+                _rollback_file(job)
+                job.status = STATUS_FAILED
+                get_journal().record(job, STATE_ROLLED_BACK)
+                continue
+            staged_jobs.append(job)
 
-def main():
+        # Upload!
+        if staged_jobs:
+            _finish_jobs(staged_jobs, _transfer(staged_jobs, work_dir, upload_base_dir, gdrive_dir, scheduler))
+    finally:
+        _cleanup_jobs(jobs, mount)
+        if mount:
+            mount.release()
+
+
+def recover_jobs():
+    """
+    Resume (or roll back) unfinished upload jobs of processes which crashed, without staging their files again.
+    Should be called once when the program starts.
+
+    :return: A list of the recovered upload jobs.
+    """
+    journal = get_journal()
+    records, orphan_journals = journal.find_orphans()
+    if not records:
+        journal.delete_orphans(orphan_journals)
+        return []
+
+    logger.info(f'Recovering {len(records)} unfinished upload jobs...')
+    mount = None
+    if any(record['encrypted'] for record in records):
+        mount = get_shared_mount()
+        if not mount.acquire():
+            logger.error('Couldn\'t mount the encrypted staging directory. Recovery will be retried next time!')
+            return []
+
+    try:
+        jobs = []
+        resumed_jobs = defaultdict(list)
+        for record in records:
+            job = UploadJob.from_record(record)
+            jobs.append(job)
+            if mount and job.encrypted:
+                job.staging_token = mount.adopt_file(job.cloud_path)
+            source_exists = os.path.isfile(job.file_path)
+            # A staged file claimed by another (live) upload isn't this job's.
+            staged_exists = bool(job.staged_path) and os.path.isfile(job.staged_path) and \
+                (job.staging_token is not None or not job.encrypted)
+            # Staged files are complete once their source is gone, or once staging was recorded as done.
+            is_staging_done = not source_exists or record['state'] in (STATE_ENCRYPTED, STATE_UPLOADING) or \
+                (record['state'] == STATE_STAGED and not job.encrypted)
+            if staged_exists and job.upload_path and is_staging_done:
+                logger.info(f'Resuming upload: {job.file_path}')
+                resumed_jobs[(job.work_dir, job.upload_base_dir, job.gdrive_dir)].append(job)
+            else:
+                if source_exists:
+                    logger.info(f'Rolling back upload: {job.file_path}')
+                else:
+                    logger.error(f'Lost upload (neither the original nor the staged file exist): {job.file_path}')
+                job.status = STATUS_ROLLED_BACK
+                get_journal().record(job, STATE_ROLLED_BACK)
+
+        for (work_dir, upload_base_dir, gdrive_dir), batch_jobs in resumed_jobs.items():
+            os.makedirs(work_dir, exist_ok=True)
+            _finish_jobs(batch_jobs, _transfer(batch_jobs, work_dir, upload_base_dir, gdrive_dir))
+    finally:
+        _cleanup_jobs(jobs, mount)
+        if mount:
+            mount.release()
+    journal.delete_orphans(orphan_journals)
+    get_metrics_reporter().report(jobs)
+    return jobs
+
+
+def upload_files(file_paths, scheduler=None):
+    """
+    Upload the given files to their proper Google Drive cloud directories.
+    All files are staged into a single shared tree, and uploaded using a single rclone run.
+
+    :param file_paths: The files to upload.
+    :param scheduler: An optional upload scheduler, limiting concurrent staging and transfers.
+    :return: A list of upload jobs (one per file), holding each file's result.
+    """
+    jobs = []
+    for file_path in dict.fromkeys(file_paths):
+        logger.info(f'Classifying file: {file_path}')
+        job = UploadJob(file_path)
+        with job.metrics.timer(STAGE_GUESS):
+            job.cloud_dir, job.cloud_file, job.is_subtitles = _classify_file(file_path)
+        if job.cloud_path:
+            logger.info(f'Cloud path: {job.cloud_path}')
+        else:
+            job.status = STATUS_SKIPPED
+        jobs.append(job)
+
+    get_metrics_reporter().report([job for job in jobs if job.status == STATUS_SKIPPED])
+    pending_jobs = [job for job in jobs if not job.status]
+    if pending_jobs:
+        upload_jobs(pending_jobs, scheduler)
+    return jobs
+
+
+def upload_file(file_path):
     """
     Upload the given file to its proper Google Drive cloud directory.
+
+    :param: file_path: The file to upload.
+    :return: The upload job, holding the file's result.
+    """
+    logger.info(f'Uploading file: {file_path}')
+    return upload_files([file_path])[0]
+
+
+def _expand_paths(paths):
+    """
+    Expand the given paths into a list of files (directories are walked recursively).
+
+    :param paths: The file and directory paths to expand.
+    :return: A tuple of format (file_paths, invalid_paths): a list of absolute file paths, and a list of the given
+             paths which are neither files nor directories.
+    """
+    file_paths = []
+    invalid_paths = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            file_paths.append(path)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                file_paths.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            invalid_paths.append(path)
+    return file_paths, invalid_paths
+
+
+def main():
+    """
+    Upload the given files (or directories) to their proper Google Drive cloud directories.
     """
     # Parse input arguments.
-    if len(sys.argv) == 2:
-        file_path = os.path.abspath(sys.argv[1])
-        if os.path.isfile(file_path):
+    if len(sys.argv) >= 2:
+        file_paths, invalid_paths = _expand_paths(sys.argv[1:])
+        for invalid_path in invalid_paths:
+            print(f'Invalid path given: {invalid_path}. Skipping!')
+        if file_paths:
             with logbook.NestedSetup(_get_log_handlers()).applicationbound():
-                upload_file(file_path)
+                recover_jobs()
+                upload_files(file_paths)
+                get_journal().close()
         else:
-            print('Invalid file path given. Stopping!')
+            print('No valid file paths given. Stopping!')
     else:
-        print('Usage: python3 uploader.py <FILE_PATH>')
+        print('Usage: python3 uploader.py <PATH> [<PATH> ...]')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from clouduploader import bandwidth, cache, catalog, config, dedup, encfs, journal, retry, tuning
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'stubs')
+
+
+@pytest.fixture
+def uploader_config(tmp_path, monkeypatch):
+    """
+    Point the configuration at a temporary directory and the stub binaries (see the benchmarks), with fresh shared
+    instances.
+
+    :return: The temporary directory path.
+    """
+    monkeypatch.setattr(config, 'RCLONE_PATH', os.path.join(STUBS_DIR, 'rclone'))
+    monkeypatch.setattr(config, 'ENCFS_PATH', os.path.join(STUBS_DIR, 'encfs'))
+    monkeypatch.setattr(config, 'UMOUNT_PATH', os.path.join(STUBS_DIR, 'umount'))
+    monkeypatch.setattr(config, 'RCLONE_CONFIG_PATH', os.devnull)
+    monkeypatch.setattr(config, 'RCLONE_RC_URL', None)
+    monkeypatch.setattr(config, 'SHOULD_DELETE', True)
+    monkeypatch.setattr(config, 'SHOULD_ENCRYPT', True)
+    monkeypatch.setattr(config, 'ENCFS_STAGING_PATH', str(tmp_path / 'staging'))
+    monkeypatch.setattr(config, 'JOURNAL_PATH', str(tmp_path / 'journal'))
+    monkeypatch.setattr(config, 'ORIGINAL_NAMES_LOG', str(tmp_path / 'original_names.log'))
+    monkeypatch.setattr(config, 'CATALOG_PATH', str(tmp_path / 'upload_catalog.db'))
+    monkeypatch.setattr(config, 'GUESS_CACHE_PATH', str(tmp_path / 'guess_cache.db'))
+    monkeypatch.setattr(config, 'DEDUP_INDEX_PATH', None)
+    monkeypatch.setattr(config, 'TRANSFER_HISTORY_PATH', str(tmp_path / 'transfer_history.db'))
+    monkeypatch.setattr(config, 'BANDWIDTH_TIMETABLE', None)
+    monkeypatch.setattr(config, 'METRICS_TEXTFILE_PATH', None)
+    monkeypatch.setattr(config, 'METRICS_JSON_PATH', None)
+    monkeypatch.setattr(config, 'RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(config, 'RETRY_MAX_DELAY', 0.001)
+    monkeypatch.setattr(config, 'RATE_LIMIT_BASE_DELAY', 0.001)
+    for module, name in [(bandwidth, '_bandwidth_scheduler'), (cache, '_guess_cache'), (catalog, '_upload_catalog'),
+                         (dedup, '_dedup_index'), (encfs, '_shared_mount'), (journal, '_journal'),
+                         (retry, '_retry_policy'), (tuning, '_transfer_tuner')]:
+        monkeypatch.setattr(module, name, None)
+    yield tmp_path
+    if journal._journal:
+        journal._journal.close()
@@ -0,0 +1,62 @@
+import pytest
+
+from clouduploader.bandwidth import BandwidthScheduler
+
+HOUR = 60 * 60
+# Unlimited at night, limited in the evening.
+TIMETABLE = [('01:00', None), ('18:00', 1024 * 1024)]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = BandwidthScheduler(TIMETABLE, small_file_size=1, defer_below=1)
+
+    def _set_now(now):
+        monkeypatch.setattr(scheduler, '_now', lambda: now)
+
+    return scheduler, _set_now
+
+
+@pytest.mark.parametrize('now, duration, expected', [
+    (12 * HOUR, HOUR, False),
+    # Started in the limited window before midnight, and still limited then.
+    (2 * HOUR, 2 * HOUR, True),
+    (19 * HOUR, 30, True),
+    (18 * HOUR + 10, 60, True),
+    (17 * HOUR, 15 * HOUR, False),
+    (17 * HOUR, 16 * HOUR, False),
+    (17 * HOUR, 17 * HOUR, True),
+    (12 * HOUR, 24 * HOUR, True),
+])
+def test_was_limited(scheduler, now, duration, expected):
+    scheduler, set_now = scheduler
+    set_now(now)
+    assert scheduler.was_limited(duration) == expected
+
+
+def test_unlimited_timetable_was_never_limited():
+    assert not BandwidthScheduler([('00:00', None)], small_file_size=1, defer_below=1).was_limited(2 * 24 * HOUR)
+
+
+def test_rate_is_the_current_window_whole_limit(scheduler):
+    scheduler, set_now = scheduler
+    set_now(19 * HOUR)
+    with scheduler.transfer([]), scheduler.transfer([]):
+        assert scheduler.get_rate() == '1024k'
+        assert scheduler.get_bwlimit() == '01:00,off 18:00,512k'
+
+
+def test_large_submission_is_deferred_until_the_next_open_window(scheduler, tmp_path):
+    scheduler, set_now = scheduler
+    video_path = tmp_path / 'Heat.1995.mkv'
+    video_path.write_bytes(b'video')
+    subtitles_path = tmp_path / 'Heat.1995.srt'
+    subtitles_path.write_bytes(b'subtitles')
+    set_now(19 * HOUR)
+    scheduler.defer_below = 2 * 1024 * 1024
+    assert scheduler.get_deferral(1, [str(subtitles_path)]) == 0
+    assert scheduler.get_deferral(2, [str(video_path)]) == 6 * HOUR
+    assert scheduler.stats()['deferred_jobs'] == 1
+    set_now(1 * HOUR)
+    assert scheduler.get_deferral(2, [str(video_path)]) == 0
+    assert scheduler.stats()['deferred_jobs'] == 0
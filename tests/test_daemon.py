@@ -0,0 +1,28 @@
+import os
+import stat
+
+import pytest
+
+from clouduploader import config
+from clouduploader.daemon import UploadDaemon
+
+
+@pytest.fixture
+def socket_path(uploader_config, monkeypatch):
+    monkeypatch.setattr(config, 'UPLOAD_QUEUE_PATH', None)
+    return str(uploader_config / 'clouduploader.sock')
+
+
+def test_socket_is_private(socket_path):
+    with UploadDaemon(socket_path) as daemon:
+        daemon.scheduler.stop()
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+
+def test_file_which_is_not_a_socket_is_kept(socket_path):
+    with open(socket_path, 'w') as f:
+        f.write('data')
+    with pytest.raises(FileExistsError):
+        UploadDaemon(socket_path)
+    with open(socket_path, 'r') as f:
+        assert f.read() == 'data'
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+
+import pytest
+
+from clouduploader import catalog, config, uploader
+from clouduploader.dedup import get_dedup_index, get_full_hash, get_partial_hash
+
+CLOUD_DIR = os.path.join('TV', 'The Wire', 'Season 01')
+
+
+def _new_job(file_path, cloud_file):
+    """
+    :return: A new upload job of the given file, classified to the given cloud file name.
+    """
+    job = uploader.UploadJob(str(file_path))
+    job.cloud_dir = CLOUD_DIR
+    job.cloud_file = cloud_file
+    return job
+
+
+@pytest.fixture
+def uploaded_path(uploader_config, monkeypatch):
+    """
+    :return: The path of a file which was already uploaded to The Wire's first episode.
+    """
+    monkeypatch.setattr(config, 'DEDUP_INDEX_PATH', str(uploader_config / 'dedup_index.db'))
+    file_path = uploader_config / 'The.Wire.S01E01.HDTV.mkv'
+    file_path.write_text('episode')
+    size = os.path.getsize(file_path)
+    get_dedup_index().add(os.path.join(CLOUD_DIR, 'The Wire - S01E01.mkv'), size, get_partial_hash(file_path, size),
+                          get_full_hash(file_path))
+    return file_path
+
+
+def test_renamed_duplicate_is_found(uploaded_path):
+    renamed_path = uploaded_path.parent / 'the_wire_101.mkv'
+    uploaded_path.rename(renamed_path)
+    duplicate = get_dedup_index().find_duplicate(_new_job(renamed_path, 'The Wire - S01E01.mkv'))
+    assert duplicate.cloud_path == os.path.join(CLOUD_DIR, 'The Wire - S01E01.mkv')
+
+
+def test_same_content_for_another_cloud_path_is_uploaded(uploaded_path):
+    job = _new_job(uploaded_path, 'The Wire - S01E01 - The Target.mkv')
+    assert get_dedup_index().find_duplicate(job) is None
+    assert uploader._skip_duplicates([job]) == [job]
+    assert uploaded_path.exists()
+
+
+def test_different_content_is_not_a_duplicate(uploaded_path):
+    uploaded_path.write_text('episod3')
+    job = _new_job(uploaded_path, 'The Wire - S01E01.mkv')
+    assert get_dedup_index().find_duplicate(job) is None
+    # The partial hash differs, so the file is never read in full.
+    assert job.full_hash is None
+
+
+def test_skipped_duplicate_is_cataloged_before_deletion(uploaded_path):
+    job = _new_job(uploaded_path, 'The Wire - S01E01.mkv')
+    assert uploader._skip_duplicates([job]) == []
+    assert job.status == uploader.STATUS_SKIPPED_DUPLICATE
+    assert not uploaded_path.exists()
+    entry, = catalog.get_upload_catalog().get_latest()
+    assert entry.source_path == str(uploaded_path)
+    assert entry.cloud_file == 'The Wire - S01E01.mkv'
+
+
+def test_skipped_duplicate_is_kept_if_not_recorded(uploaded_path, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(catalog.get_upload_catalog(), 'add', _fail)
+    job = _new_job(uploaded_path, 'The Wire - S01E01.mkv')
+    assert uploader._skip_duplicates([job]) == []
+    assert uploaded_path.exists()
@@ -0,0 +1,164 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from clouduploader import config, encfs, uploader
+from clouduploader.encfs import EncryptedMount
+
+CLOUD_PATH = os.path.join('TV', 'The Wire', 'Season 01', 'The Wire - S01E01.mkv')
+
+# A stub rclone which checks that every copied file still exists once its (simulated) transfer is done.
+SLOW_RCLONE = '''#!{python}
+import json, os, sys, time
+args = sys.argv[1:]
+source_dir = [arg for arg in args if not arg.startswith('-')][-2]
+with open(args[args.index('--files-from-raw') + 1], 'r', encoding='UTF-8') as files_list:
+    file_paths = [line.rstrip('\\n') for line in files_list if line.strip()]
+time.sleep({latency})
+missing_paths = [file_path for file_path in file_paths if not os.path.isfile(os.path.join(source_dir, file_path))]
+for file_path in missing_paths:
+    print(json.dumps({{'level': 'error', 'msg': 'Failed to copy: file vanished', 'object': file_path}}))
+sys.exit(1 if missing_paths else 0)
+'''
+
+
+def _get_dead_pid():
+    """
+    :return: The process ID of a process which already exited.
+    """
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def _write_claim(mount, file_path, pid):
+    """
+    Claim the given file on behalf of another process.
+    """
+    os.makedirs(mount._claims_dir, exist_ok=True)
+    with open(mount._get_claim_path(file_path), 'w', encoding='UTF-8') as claim_file:
+        json.dump({'path': file_path, 'pid': pid, 'token': 'other'}, claim_file)
+
+
+@pytest.fixture
+def mount(uploader_config):
+    mount = EncryptedMount()
+    assert mount.acquire()
+    yield mount
+    mount.release()
+    mount.close()
+
+
+def test_create_file_returns_token(mount):
+    upload_path, token = mount.create_file(CLOUD_PATH)
+    assert upload_path == CLOUD_PATH
+    assert token
+    assert os.path.isfile(os.path.join(mount.mount_dir, CLOUD_PATH))
+    mount.remove_file(CLOUD_PATH, token)
+    assert not os.path.exists(os.path.join(mount.mount_dir, 'TV'))
+
+
+def test_staged_file_is_removed_by_owner_only(mount):
+    _, token = mount.create_file(CLOUD_PATH)
+    with pytest.raises(FileExistsError):
+        mount.create_file(CLOUD_PATH)
+    mount.remove_file(CLOUD_PATH, None)
+    mount.remove_file(CLOUD_PATH, 'other')
+    assert os.path.isfile(os.path.join(mount.mount_dir, CLOUD_PATH))
+    mount.remove_file(CLOUD_PATH, token)
+    assert not os.path.exists(os.path.join(mount.mount_dir, CLOUD_PATH))
+
+
+def test_file_staged_by_live_process_is_kept(mount):
+    full_path = os.path.join(mount.mount_dir, CLOUD_PATH)
+    os.makedirs(os.path.dirname(full_path))
+    with open(full_path, 'w') as staged_file:
+        staged_file.write('data')
+    _write_claim(mount, CLOUD_PATH, os.getppid())
+    with pytest.raises(FileExistsError):
+        mount.create_file(CLOUD_PATH)
+    assert mount.adopt_file(CLOUD_PATH) is None
+    with open(full_path, 'r') as staged_file:
+        assert staged_file.read() == 'data'
+
+
+def test_leftover_file_is_replaced(mount):
+    full_path = os.path.join(mount.mount_dir, CLOUD_PATH)
+    os.makedirs(os.path.dirname(full_path))
+    with open(full_path, 'w') as staged_file:
+        staged_file.write('data')
+    _write_claim(mount, CLOUD_PATH, _get_dead_pid())
+    upload_path, token = mount.create_file(CLOUD_PATH)
+    assert upload_path == CLOUD_PATH
+    assert os.path.getsize(full_path) == 0
+    mount.remove_file(CLOUD_PATH, token)
+
+
+def test_leftover_file_is_adopted(mount):
+    full_path = os.path.join(mount.mount_dir, CLOUD_PATH)
+    os.makedirs(os.path.dirname(full_path))
+    open(full_path, 'w').close()
+    _write_claim(mount, CLOUD_PATH, _get_dead_pid())
+    token = mount.adopt_file(CLOUD_PATH)
+    assert token
+    mount.remove_file(CLOUD_PATH, token)
+    assert not os.path.exists(full_path)
+
+
+def test_close_keeps_mount_used_by_other_process(uploader_config):
+    mount = EncryptedMount()
+    assert mount.acquire()
+    # Another live process holds a reference as well.
+    open(os.path.join(mount._holders_dir, str(os.getppid())), 'w').close()
+    mount.release()
+    mount.close()
+    assert mount.is_healthy()
+    os.remove(os.path.join(mount._holders_dir, str(os.getppid())))
+    mount.close()
+    assert not mount.is_healthy()
+
+
+def test_close_forgets_dead_holders(uploader_config):
+    mount = EncryptedMount()
+    assert mount.acquire()
+    open(os.path.join(mount._holders_dir, str(_get_dead_pid())), 'w').close()
+    mount.release()
+    mount.close()
+    assert not mount.is_healthy()
+    assert not os.listdir(mount._holders_dir)
+
+
+def test_concurrent_uploads_of_same_cloud_path(uploader_config, monkeypatch):
+    # Classifying episodes requires showsformatter.
+    pytest.importorskip('showsformatter')
+    rclone_path = uploader_config / 'rclone'
+    rclone_path.write_text(SLOW_RCLONE.format(python=sys.executable, latency=2))
+    rclone_path.chmod(0o755)
+    monkeypatch.setattr(config, 'RCLONE_PATH', str(rclone_path))
+    first_path = uploader_config / 'first' / 'The.Wire.S01E01.HDTV.mkv'
+    second_path = uploader_config / 'second' / 'The.Wire.S01E01.720p.BluRay.mkv'
+    for file_path in (first_path, second_path):
+        file_path.parent.mkdir()
+        file_path.write_text(file_path.name)
+
+    first_jobs = []
+    first_upload = threading.Thread(target=lambda: first_jobs.extend(uploader.upload_files([str(first_path)])))
+    first_upload.start()
+    staged_path = os.path.join(config.ENCFS_STAGING_PATH, config.CLOUD_PLAIN_PATH, CLOUD_PATH)
+    deadline = time.monotonic() + 10
+    while not (os.path.isfile(staged_path) and os.path.getsize(staged_path)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The second upload can't stage its file while the first one is being uploaded, and must leave it alone.
+    second_job, = uploader.upload_files([str(second_path)])
+    first_upload.join()
+
+    assert second_job.status == uploader.STATUS_FAILED
+    assert second_path.read_text() == second_path.name
+    assert first_jobs[0].status == uploader.STATUS_UPLOADED
+    assert not os.path.exists(staged_path)
+    encfs.get_shared_mount().close()
@@ -0,0 +1,26 @@
+import json
+
+from clouduploader import config, daemon, planner
+from clouduploader.planner import plan_uploads
+
+
+def test_invalid_path_is_planned_as_skipped(uploader_config):
+    invalid_path = str(uploader_config / 'missing.mkv')
+    plan = plan_uploads([invalid_path], workers=1)
+    assert plan == [{'file_path': invalid_path, 'cloud_path': None, 'is_subtitles': False, 'is_valid': False}]
+
+
+def test_plan_output_is_json(uploader_config, capsys):
+    daemon.plan([str(uploader_config / 'missing.mkv'), str(uploader_config / 'missing')])
+    output = capsys.readouterr()
+    assert [entry['is_valid'] for entry in json.loads(output.out)] == [False, False]
+    assert 'Planned 0 files (2 skipped).' in output.err
+
+
+def test_workers_use_runtime_settings(uploader_config, monkeypatch):
+    monkeypatch.setattr(planner, 'MIN_POOL_FILES', 1)
+    monkeypatch.setattr(config, 'CLOUD_MOVIES_PATH', 'Films')
+    file_path = uploader_config / 'Inception.2010.1080p.BluRay.x264-REFiNED.mkv'
+    file_path.write_text('movie')
+    entry, = plan_uploads([str(file_path)], workers=2)
+    assert entry['cloud_path'] == 'Films/Inception (2010)/Inception (2010).mkv'
@@ -0,0 +1,76 @@
+import pytest
+import requests
+
+from clouduploader import config, rclone
+from clouduploader.rclone import RCLONE_GENERIC_ERROR, TransferResult
+
+
+class FakeRcClient(rclone.RcClient):
+    """
+    An rc client which answers calls itself, and loses the server after the given amount of calls.
+    """
+
+    def __init__(self, lost_after):
+        super().__init__('http://localhost:5572')
+        self.lost_after = lost_after
+        self.calls = []
+        self.params = []
+
+    def call(self, command, **params):
+        self.calls.append(command)
+        self.params.append(params)
+        if command != 'job/stop' and len(self.calls) > self.lost_after:
+            raise requests.ConnectionError('Connection refused')
+        if command == 'operations/copyfile':
+            return {'jobid': len(self.calls)}
+        return {'finished': False}
+
+
+@pytest.fixture
+def rc_client(monkeypatch):
+    monkeypatch.setattr(config, 'RCLONE_RC_URL', 'http://localhost:5572')
+    monkeypatch.setattr(config, 'RCLONE_RC_POLL_INTERVAL', 0)
+    subprocess_calls = []
+    monkeypatch.setattr(rclone, '_copy_files_subprocess',
+                        lambda *args: subprocess_calls.append(args) or TransferResult(0, '', None))
+
+    def _get_rc_client(lost_after):
+        client = FakeRcClient(lost_after)
+        monkeypatch.setattr(rclone, '_rc_client', client)
+        return client, subprocess_calls
+
+    return _get_rc_client
+
+
+def test_unreachable_server_falls_back_to_process(rc_client):
+    client, subprocess_calls = rc_client(lost_after=0)
+    result = rclone.copy_files('/staging', 'Media', ['a.mkv', 'b.mkv'], '/work')
+    assert result.return_code == 0
+    assert len(subprocess_calls) == 1
+
+
+def test_lost_server_stops_started_jobs(rc_client):
+    # Both jobs are started, and the server is lost while polling them.
+    client, subprocess_calls = rc_client(lost_after=2)
+    result = rclone.copy_files('/staging', 'Media', ['a.mkv', 'b.mkv'], '/work')
+    assert not subprocess_calls
+    assert result.return_code == RCLONE_GENERIC_ERROR
+    assert result.failed_paths == {'a.mkv', 'b.mkv'}
+    assert client.calls.count('job/stop') == 2
+
+
+def test_lost_server_fails_files_which_were_not_started(rc_client):
+    client, subprocess_calls = rc_client(lost_after=1)
+    result = rclone.copy_files('/staging', 'Media', ['a.mkv', 'b.mkv'], '/work')
+    assert not subprocess_calls
+    assert result.failed_paths == {'a.mkv', 'b.mkv'}
+    assert client.calls.count('job/stop') == 1
+
+
+def test_rc_server_gets_a_single_rate(rc_client):
+    client, subprocess_calls = rc_client(lost_after=0)
+    rclone.copy_files('/staging', 'Media', ['a.mkv'], '/work', bwlimit='00:00,512k 18:00,off', bwlimit_rate='1024k')
+    assert client.calls[0] == 'core/bwlimit'
+    assert client.params[0] == {'rate': '1024k'}
+    # The rclone process gets the timetable.
+    assert subprocess_calls[0][-1] == '00:00,512k 18:00,off'
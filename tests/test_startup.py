@@ -0,0 +1,8 @@
+import pytest
+
+from benchmarks.startup_benchmark import ENTRY_POINTS, get_heavy_imports
+
+
+@pytest.mark.parametrize('module_name', list(ENTRY_POINTS))
+def test_entry_point_imports_no_heavy_modules(module_name):
+    assert get_heavy_imports(module_name) == []
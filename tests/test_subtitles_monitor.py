@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+from clouduploader.scripts import subtitles_monitor
+
+babelfish = pytest.importorskip('babelfish')
+pytest.importorskip('subliminal')
+
+HEBREW = babelfish.Language('heb')
+ENGLISH = babelfish.Language('eng')
+
+
+class FakePool(object):
+    """
+    A provider pool whose given providers are down, and whose other providers find nothing.
+    """
+
+    def __init__(self, down_providers=(), discarded_providers=()):
+        self.down_providers = set(down_providers)
+        self.discarded_providers = set(discarded_providers)
+        self.failed_providers = set()
+
+    def list_subtitles_provider(self, provider, video, languages):
+        is_down = provider in self.down_providers
+        return SimpleNamespace(subtitles=[], outage=lambda: is_down)
+
+    def download_best_subtitles(self, subtitles, video, languages):
+        return []
+
+
+@pytest.fixture
+def providers(uploader_config, monkeypatch):
+    monkeypatch.setattr(subtitles_monitor, 'PROVIDERS_MAP', {'heb': ['wizdom'], 'eng': ['opensubtitles']})
+
+
+def _find(pool, tmp_path):
+    video_path = str(tmp_path / 'The.Wire.S01E01.720p.HDTV.x264-KILLERS.mkv')
+    pools = SimpleNamespace(get=lambda provider_languages: pool)
+    return subtitles_monitor.find_video_subtitles(video_path, video_path, [HEBREW, ENGLISH], pools)
+
+
+def test_clean_searches_are_not_found(providers, tmp_path):
+    assert _find(FakePool(), tmp_path) == [(HEBREW, None), (ENGLISH, None)]
+
+
+def test_provider_outage_is_not_a_not_found_result(providers, tmp_path):
+    pool = FakePool(down_providers=['wizdom'])
+    assert _find(pool, tmp_path) == [(ENGLISH, None)]
+    assert 'wizdom' in pool.discarded_providers
+
+
+def test_discarded_provider_is_not_a_not_found_result(providers, tmp_path):
+    assert _find(FakePool(discarded_providers=['opensubtitles']), tmp_path) == [(HEBREW, None)]
@@ -0,0 +1,31 @@
+import time
+
+from clouduploader.upload_queue import MEMORY_PATH, UploadQueue
+
+
+def test_restored_submissions_drop_recovered_files(tmp_path):
+    queue_path = str(tmp_path / 'upload_queue.db')
+    upload_queue = UploadQueue(queue_path)
+    upload_queue.put(['/download/a.mkv', '/download/b.mkv'])
+    upload_queue.put(['/download/c.mkv'])
+    # The daemon dies while uploading the first submission, whose files the journal recovers.
+    upload_queue.get()
+
+    restored_queue = UploadQueue(queue_path)
+    assert restored_queue.discard_files(['/download/a.mkv', '/download/c.mkv']) == 2
+    assert restored_queue.qsize() == 1
+    assert restored_queue.get()[1] == ['/download/b.mkv']
+
+
+def test_deferred_submission_is_taken_once_due(monkeypatch):
+    upload_queue = UploadQueue(MEMORY_PATH)
+    upload_queue.put(['/download/Heat.1995.mkv'], priority=-10)
+    upload_queue.put(['/download/Heat.1995.srt'])
+    submission_id, _ = upload_queue.get()
+    upload_queue.defer(submission_id, 60)
+    assert upload_queue.get()[1] == ['/download/Heat.1995.srt']
+    assert upload_queue.stats()['deferred'] == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert upload_queue.get() == (submission_id, ['/download/Heat.1995.mkv'])
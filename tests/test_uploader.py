@@ -0,0 +1,29 @@
+import os
+from types import SimpleNamespace
+
+from clouduploader import uploader
+
+# The devices of every mount point in the fake filesystem (everything else is on the root filesystem).
+DEVICES = {'/mnt/a': 1, '/mnt/b': 2, '/srv/b': 2}
+
+
+def _fake_stat(path):
+    """
+    :return: The stat result of the given path in the fake filesystem (its device only).
+    """
+    for mount_point, device in DEVICES.items():
+        if path == mount_point or path.startswith(mount_point + os.sep):
+            return SimpleNamespace(st_dev=device)
+    return SimpleNamespace(st_dev=0)
+
+
+def test_jobs_are_staged_next_to_their_files(monkeypatch):
+    monkeypatch.setattr(uploader.os, 'stat', _fake_stat)
+    jobs = [uploader.UploadJob(file_path) for file_path in
+            ['/mnt/a/TV/a.mkv', '/mnt/a/TV/Season 1/b.mkv', '/srv/b/c.mkv', '/mnt/b/d.mkv']]
+    groups = uploader._group_by_device(jobs)
+    assert [(original_dir, [job.file_path for job in group_jobs]) for original_dir, group_jobs in groups] == [
+        ('/mnt/a/TV', ['/mnt/a/TV/a.mkv', '/mnt/a/TV/Season 1/b.mkv']),
+        # The common directory (/) is on another device.
+        ('/srv/b', ['/srv/b/c.mkv', '/mnt/b/d.mkv']),
+    ]